@@ -19,6 +19,11 @@
 
 """GStreamer Development Utilities Common Data module."""
 
+from collections import deque
+import logging
+import threading
+from time import time
+
 import pygtk
 pygtk.require ("2.0")
 
@@ -34,6 +39,14 @@ class Dispatcher (object):
 
         pass
 
+    def call (self, func, *args):
+
+        """Call func with args in the thread that owns the dispatcher.
+        Dispatched iterators use this for notifications that can touch the
+        user interface."""
+
+        func (*args)
+
 class DefaultDispatcher (Dispatcher):
 
     def __call__ (self, iterator):
@@ -43,18 +56,27 @@ class DefaultDispatcher (Dispatcher):
 
 class GSourceDispatcher (Dispatcher):
 
+    """Dispatcher that runs iterators from an idle handler of the main loop.
+    Each main loop iteration advances the iterator for up to time_budget
+    seconds."""
+
+    time_budget = .01
+
     def __init__ (self):
 
         Dispatcher.__init__ (self)
 
         self.source_id = None
+        self.iterator = None
 
     def __call__ (self, iterator):
 
         if self.source_id is not None:
             gobject.source_remove (self.source_id)
 
-        self.source_id = gobject.idle_add (iterator.next, priority = gobject.PRIORITY_LOW)
+        self.iterator = iterator
+        self.source_id = gobject.idle_add (self.__step, iterator,
+                                           priority = gobject.PRIORITY_LOW)
 
     def cancel (self):
 
@@ -63,3 +85,264 @@ class GSourceDispatcher (Dispatcher):
 
         gobject.source_remove (self.source_id)
         self.source_id = None
+        self.iterator = None
+
+    def __step (self, iterator):
+
+        deadline = time () + self.time_budget
+        while True:
+            try:
+                result = iterator.next ()
+            except StopIteration:
+                result = False
+            if self.iterator is not iterator:
+                # Replaced or cancelled from within the step.
+                return False
+            if not result:
+                self.source_id = None
+                self.iterator = None
+                return False
+            if time () >= deadline:
+                return True
+
+class ThreadDispatcher (Dispatcher):
+
+    """Dispatcher that runs iterators in a worker thread, so they are not
+    time-sliced against the main loop.  Functions passed to call () from the
+    worker are queued and run in the main loop thread, in order.
+
+    Dispatching a new iterator (or cancelling) stops the running one after
+    its current step.  Calls queued by an iterator that was replaced are
+    still made, while cancel () drops them."""
+
+    def __init__ (self):
+
+        Dispatcher.__init__ (self)
+
+        gobject.threads_init ()
+
+        self.main_thread = threading.current_thread ()
+        self.thread = None
+        self.stop_event = None
+
+        self.lock = threading.Lock ()
+        self.pending = deque ()
+        self.source_id = None
+
+    def __call__ (self, iterator):
+
+        self.__stop ()
+
+        self.stop_event = threading.Event ()
+        self.thread = threading.Thread (target = self.__run,
+                                        args = (iterator, self.stop_event,))
+        self.thread.daemon = True
+        self.thread.start ()
+
+    def cancel (self):
+
+        self.__stop ()
+
+        with self.lock:
+            self.pending.clear ()
+            if self.source_id is not None:
+                gobject.source_remove (self.source_id)
+                self.source_id = None
+
+    def call (self, func, *args):
+
+        if threading.current_thread () is self.main_thread:
+            func (*args)
+            return
+
+        with self.lock:
+            self.pending.append ((func, args,))
+            if self.source_id is None:
+                self.source_id = gobject.idle_add (self.__process_pending)
+
+    def __stop (self):
+
+        if self.thread is None:
+            return
+
+        self.stop_event.set ()
+        if self.thread is not threading.current_thread ():
+            self.thread.join ()
+        self.thread = None
+        self.stop_event = None
+
+    @staticmethod
+    def __run (iterator, stop_event):
+
+        for result in iterator:
+            if not result or stop_event.is_set ():
+                break
+
+    def __process_pending (self):
+
+        with self.lock:
+            pending = list (self.pending)
+            self.pending.clear ()
+            self.source_id = None
+
+        for func, args in pending:
+            func (*args)
+
+        return False
+
+class Job (object):
+
+    """A dispatched iterator of a Scheduler.  Serves as cancellation token:
+    the iterator can check the cancelled attribute."""
+
+    def __init__ (self, iterator, dispatcher):
+
+        self.iterator = iterator
+        self.dispatcher = dispatcher
+        self.cancelled = False
+
+    def cancel (self):
+
+        self.dispatcher.scheduler.remove (self)
+
+class SchedulerDispatcher (Dispatcher):
+
+    """Dispatcher for one subsystem, backed by a Scheduler.  See
+    Scheduler.dispatcher."""
+
+    def __init__ (self, scheduler, priority, after, view):
+
+        Dispatcher.__init__ (self)
+
+        self.scheduler = scheduler
+        self.priority = priority
+        self.after = tuple (after)
+        self.job = None
+
+        if view is not None:
+            view.connect ("notify::model", self.__handle_view_notify_model)
+
+    def __call__ (self, iterator):
+
+        self.cancel ()
+
+        self.job = Job (iterator, self)
+        self.scheduler.add (self.job)
+
+        return self.job
+
+    def cancel (self):
+
+        if self.job is not None:
+            self.job.cancel ()
+
+    def is_busy (self):
+
+        return self.job is not None
+
+    def __handle_view_notify_model (self, view, pspec):
+
+        # The running job was computing something for the previous model.
+        self.cancel ()
+
+class Scheduler (object):
+
+    """Runs the iterators of several dispatchers from a single idle handler,
+    so background jobs of different subsystems do not compete blindly.
+
+    The job of the dispatcher with the highest priority (lowest value) is
+    advanced first, jobs of equal priority take turns.  A job does not run
+    while any of the dispatchers it has to wait for is busy."""
+
+    PRIORITY_HIGH = -100
+    PRIORITY_DEFAULT = 0
+    PRIORITY_LOW = 100
+
+    time_budget = .01
+
+    def __init__ (self):
+
+        self.logger = logging.getLogger ("scheduler")
+        self.jobs = []
+        self.source_id = None
+
+    def dispatcher (self, priority = PRIORITY_DEFAULT, after = (), view = None):
+
+        """Create a dispatcher that runs iterators with the given priority.
+        The jobs wait for all dispatchers in after to finish theirs.  If
+        view is given, the running job is cancelled when the model of the
+        view changes."""
+
+        return SchedulerDispatcher (self, priority, after, view)
+
+    def add (self, job):
+
+        self.jobs.append (job)
+        self.__schedule ()
+
+    def remove (self, job):
+
+        job.cancelled = True
+        if job.dispatcher.job is job:
+            job.dispatcher.job = None
+
+        try:
+            self.jobs.remove (job)
+        except ValueError:
+            return
+
+        # Jobs waiting for this one might be runnable now:
+        self.__schedule ()
+
+    def __schedule (self):
+
+        if self.source_id is None and self.jobs:
+            self.source_id = gobject.idle_add (self.__step,
+                                               priority = gobject.PRIORITY_LOW)
+
+    def __next_job (self):
+
+        best = None
+        for job in self.jobs:
+            dispatcher = job.dispatcher
+            if any (other.is_busy () for other in dispatcher.after):
+                continue
+            if best is None or dispatcher.priority < best.dispatcher.priority:
+                best = job
+
+        return best
+
+    def __step (self):
+
+        deadline = time () + self.time_budget
+        while True:
+            job = self.__next_job ()
+            if job is None:
+                # Nothing to do, or all jobs wait for jobs that are gone.
+                self.source_id = None
+                return False
+
+            try:
+                result = job.iterator.next ()
+            except StopIteration:
+                result = False
+            except Exception:
+                # A broken job must not stall the jobs of other subsystems:
+                self.logger.exception ("job of dispatcher %r failed",
+                                       job.dispatcher)
+                result = False
+
+            if job.cancelled:
+                # Cancelled from within the step.
+                pass
+            elif result:
+                # Let jobs of the same priority take turns:
+                self.jobs.remove (job)
+                self.jobs.append (job)
+            else:
+                if job.dispatcher.job is job:
+                    job.dispatcher.job = None
+                self.jobs.remove (job)
+
+            if time () >= deadline:
+                return True
@@ -22,10 +22,83 @@
 import os
 import logging
 import re
+import struct
+from time import time
+from array import array
+from bisect import bisect_left, bisect_right, insort_left
+from collections import OrderedDict
+from itertools import imap
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Nanosecond resolution (like gst.SECOND)
 SECOND = 1000000000
 
+# Array type code for file offsets.  This is 64 bits wide on LP64 platforms,
+# lifting the 4 GiB limit of "I":
+OFFSET_TYPECODE = "L"
+
+# Array type code for timestamps in nanoseconds.  There is no 64 bit integer
+# type code that works on every platform, but doubles hold timestamps exactly
+# for more than 100 days:
+TIME_TYPECODE = "d"
+
+class YieldLimit (object):
+
+    """Adaptive replacement for a fixed number of loop iterations between the
+    yields of a generator process.  The batch size is adjusted to the
+    measured time per iteration, so that each batch takes about budget
+    seconds: enough work per main loop iteration, without making the UI
+    stutter.
+
+    Use like this:
+
+        limit = YieldLimit ()
+        y = limit.size
+        for item in items:
+            ...
+            y -= 1
+            if y == 0:
+                y = limit.end_batch ()
+                yield True
+                limit.start_batch ()"""
+
+    # Keeps the UI above 60 frames per second with some room for drawing:
+    budget = .01
+
+    def __init__ (self, size = 100, minimum = 1, maximum = 1 << 20, budget = None):
+
+        self.size = size
+        self.minimum = minimum
+        self.maximum = maximum
+        if budget is not None:
+            self.budget = budget
+
+        self.start_batch ()
+
+    def start_batch (self):
+
+        self.__start_time = time ()
+
+    def end_batch (self):
+
+        """Measure the batch of self.size iterations that just ended and
+        return the size of the next batch."""
+
+        elapsed = time () - self.__start_time
+        if elapsed <= 0.:
+            size = self.size * 2
+        else:
+            # Move half of the way to the ideal size, so that a single slow
+            # batch (e.g. because of page faults) does not throw it off:
+            size = (self.size + self.size * self.budget / elapsed) // 2
+        self.size = int (max (self.minimum, min (self.maximum, size)))
+
+        return self.size
+
 def time_args (ts):
 
     secs = ts // SECOND
@@ -124,6 +197,223 @@ debug_levels = [debug_level_none,
                 debug_level_warning,
                 debug_level_error]
 
+# Indexed by level value:
+_debug_level_table = sorted (debug_levels)
+
+class DebugLevelArray (array):
+
+    """Compact sequence of debug levels, using one byte per item.
+
+    Items are stored as plain integers; indexing and iteration return the
+    shared DebugLevel instances, so no objects are created per line."""
+
+    def __new__ (cls, initializer = ""):
+
+        return array.__new__ (cls, "B", initializer)
+
+    def __getitem__ (self, i):
+
+        if isinstance (i, slice):
+            return DebugLevelArray (array.__getitem__ (self, i).tostring ())
+
+        return _debug_level_table[array.__getitem__ (self, i)]
+
+    def __getslice__ (self, i, j):
+
+        return DebugLevelArray (array.__getslice__ (self, i, j).tostring ())
+
+    def __iter__ (self):
+
+        return imap (_debug_level_table.__getitem__, array.__iter__ (self))
+
+class LevelCounts (object):
+
+    """Running totals of the debug levels in a DebugLevelArray, for counting
+    the levels of any range of lines without going through the lines.  The
+    totals are stored every block_size lines, the rest of a block is counted
+    when needed."""
+
+    block_size = 64
+
+    def __init__ (self):
+
+        self.levels = DebugLevelArray ()
+        # Level counts of the lines before each block, one row per block
+        # (a NumPy array, or a list of lists without NumPy):
+        self.totals = None
+
+    def __len__ (self):
+
+        return len (self.levels)
+
+    def build (self, levels, lines_per_iteration = 1 << 20):
+
+        """Generator that computes the totals for the given levels."""
+
+        n_levels = len (_debug_level_table)
+        block_size = self.block_size
+        lines_per_iteration -= lines_per_iteration % block_size
+        self.levels = levels
+        n_blocks = len (levels) // block_size
+
+        if numpy is None:
+            totals = [[0] * n_levels]
+            for block in xrange (n_blocks):
+                counts = list (totals[-1])
+                for level in array.__getslice__ (levels, block * block_size,
+                                                 (block + 1) * block_size):
+                    counts[level] += 1
+                totals.append (counts)
+                if (block + 1) * block_size % lines_per_iteration == 0:
+                    yield True
+            self.totals = totals
+            return
+
+        values = numpy.frombuffer (levels, dtype = numpy.uint8)[:n_blocks * block_size]
+        totals = [numpy.zeros ((1, n_levels), dtype = numpy.int64)]
+        for start in xrange (0, len (values), lines_per_iteration):
+            chunk = values[start:start + lines_per_iteration]
+            chunk_blocks = len (chunk) // block_size
+            block_ids = numpy.arange (len (chunk)) // block_size
+            counts = numpy.bincount (block_ids * n_levels + chunk,
+                                     minlength = chunk_blocks * n_levels)
+            counts = counts.reshape ((chunk_blocks, n_levels)).cumsum (axis = 0)
+            totals.append (counts + totals[-1][-1])
+            yield True
+
+        self.totals = numpy.concatenate (totals)
+
+    def partition_counts (self, boundaries):
+
+        """Return the level counts of the lines between each two of the given
+        ascending line indices, as a list of tuples indexed by level."""
+
+        n_levels = len (_debug_level_table)
+        block_size = self.block_size
+        levels = self.levels
+
+        if numpy is None:
+            cumulative = []
+            for boundary in boundaries:
+                block = boundary // block_size
+                counts = list (self.totals[block])
+                for level in array.__getslice__ (levels, block * block_size, boundary):
+                    counts[level] += 1
+                cumulative.append (counts)
+            return [tuple (b - a for a, b in zip (counts, next_counts))
+                    for counts, next_counts in zip (cumulative, cumulative[1:])]
+
+        if not len (levels):
+            return [(0,) * n_levels] * max (0, len (boundaries) - 1)
+
+        values = numpy.frombuffer (levels, dtype = numpy.uint8)
+        boundaries = numpy.asarray (boundaries, dtype = numpy.int64)
+        blocks = boundaries // block_size
+        # Count the lines from the start of the block up to each boundary, all
+        # at once:
+        indices = blocks[:, None] * block_size + numpy.arange (block_size)
+        in_range = indices < boundaries[:, None]
+        partial_ids = (numpy.arange (len (boundaries))[:, None] * n_levels +
+                       values[numpy.minimum (indices, len (values) - 1)])
+        partial = numpy.bincount (partial_ids[in_range],
+                                  minlength = len (boundaries) * n_levels)
+        cumulative = self.totals[blocks] + partial.reshape ((-1, n_levels))
+
+        return [tuple (counts) for counts in numpy.diff (cumulative, axis = 0).tolist ()]
+
+class TimePyramid (object):
+
+    """Counts of the debug levels of the lines in power of two sized time
+    buckets, at every resolution from at most max_buckets buckets for the
+    whole log down to one bucket.  Each layer of the pyramid sums up pairs of
+    buckets of the one below, so that any time range can be split into
+    spans by adding up only a few buckets per span.  Requires NumPy."""
+
+    max_buckets = 1 << 16
+
+    def __init__ (self):
+
+        self.origin = 0
+        self.shift = 0
+        self.layers = []
+
+    @property
+    def resolution (self):
+
+        """Width of the finest buckets in nanoseconds."""
+
+        return 1 << self.shift
+
+    def build (self, times, levels, lines_per_iteration = 1 << 20):
+
+        """Generator that counts the lines with the given (ascending)
+        timestamps and levels."""
+
+        n_levels = len (_debug_level_table)
+        del self.layers[:]
+        if not len (times):
+            return
+
+        times = numpy.frombuffer (times, dtype = times.typecode)
+        levels = numpy.frombuffer (levels, dtype = numpy.uint8)
+        self.origin = origin = int (times[0])
+        span = int (times[-1]) - origin + 1
+        shift = 0
+        while (span - 1) >> shift >= self.max_buckets:
+            shift += 1
+        self.shift = shift
+
+        n_buckets = ((span - 1) >> shift) + 1
+        counts = numpy.zeros (n_buckets * n_levels, dtype = numpy.int64)
+        for start in xrange (0, len (times), lines_per_iteration):
+            stop = start + lines_per_iteration
+            buckets = (times[start:stop].astype (numpy.int64) - origin) >> shift
+            counts += numpy.bincount (buckets * n_levels + levels[start:stop],
+                                      minlength = len (counts))
+            yield True
+
+        layer = counts.reshape ((n_buckets, n_levels))
+        self.layers.append (layer)
+        while len (layer) > 1:
+            if len (layer) % 2:
+                layer = numpy.vstack ((layer, numpy.zeros ((1, n_levels),
+                                                           dtype = layer.dtype)))
+            layer = layer[0::2] + layer[1::2]
+            self.layers.append (layer)
+
+    def histogram (self, start_ts, stop_ts, n):
+
+        """Return the level counts of n equal spans of time from start_ts to
+        stop_ts, as a list of tuples indexed by level.  The span boundaries
+        are rounded to the buckets of the coarsest layer that still has at
+        least one bucket per span."""
+
+        n_levels = len (_debug_level_table)
+        if not self.layers:
+            return [(0,) * n_levels] * n
+
+        span_width = float (stop_ts - start_ts) / n
+        layer_index = 0
+        while (layer_index + 1 < len (self.layers) and
+               1 << (self.shift + layer_index + 1) <= span_width):
+            layer_index += 1
+        layer = self.layers[layer_index]
+        bucket_width = 1 << (self.shift + layer_index)
+
+        edges = (start_ts - self.origin + span_width * numpy.arange (n + 1)) / bucket_width
+        indices = numpy.round (edges)
+        # Partially covered buckets at the ends are included:
+        indices[0] = numpy.floor (edges[0])
+        indices[-1] = numpy.ceil (edges[-1])
+        indices = numpy.clip (indices, 0, len (layer))
+        indices = indices.astype (numpy.intp)
+        padded = numpy.vstack ((layer, numpy.zeros ((1, n_levels), dtype = layer.dtype)))
+        counts = numpy.add.reduceat (padded, indices, axis = 0)[:-1]
+        # reduceat gives the bucket at the index for empty spans:
+        counts[indices[1:] <= indices[:-1]] = 0
+
+        return [tuple (span_counts) for span_counts in counts.tolist ()]
+
 # For stripping color codes:
 _escape = re.compile ("\x1b\\[[0-9;]*m")
 def strip_escape (s):
@@ -186,6 +476,16 @@ class Producer (object):
         for consumer in self.consumers:
             consumer.handle_load_finished ()
 
+    def have_lines_added (self, line_indices):
+
+        for consumer in self.consumers:
+            consumer.handle_lines_added (line_indices)
+
+    def have_columns_ready (self):
+
+        for consumer in self.consumers:
+            consumer.handle_columns_ready ()
+
 class SortHelper (object):
 
     def __init__ (self, fileobj, offsets):
@@ -198,7 +498,7 @@ class SortHelper (object):
         self.find_insert_position = self._gen.send
 
     @staticmethod
-    def find_insert_position (insert_time_string):
+    def find_insert_position (insert_time_string_and_thread):
 
         # Stub for documentary purposes.
 
@@ -213,66 +513,433 @@ class SortHelper (object):
         read = fileobj.read
         time_len = len (time_args (0))
 
-        # We remember the previous insertion point. This gives a nice speed up
-        # for larger bubbles which are already sorted. TODO: In practice, log
-        # lines only get out of order across threads. Need to check if it pays
-        # to parse the thread here and maintain multiple insertion points for
-        # heavily interleaved parts of the log.
-        pos = 0
-        pos_time_string = ""
+        def time_at (index):
+            seek (offsets[index])
+            return read (time_len)
+
+        # In practice, log lines only get out of order across threads, while
+        # the lines of any one thread are in order.  We remember the previous
+        # insertion point for each thread, which is usually still correct or
+        # only a few rows off for the next line of that thread.
+        cursors = {}
 
         insert_pos = None
         while True:
-            insert_time_string = (yield insert_pos)
+            insert_time_string, thread = (yield insert_pos)
 
             save_offset = tell ()
 
-            if pos_time_string <= insert_time_string:
-                lo = pos
-                hi = len (offsets)
+            lo = 0
+            hi = len (offsets)
+            pos = cursors.get (thread)
+
+            if pos is None or pos > hi:
+                # This is a bisection search, except we don't cut the range
+                # in the middle each time, but at the 90th percentile. This is
+                # because logs are "mostly sorted", so the insertion point is
+                # much more likely to be at the end anyways:
+                while lo < hi:
+                    mid = int (floor (lo * 0.1 + hi * 0.9))
+                    seek (offsets[mid])
+                    mid_time_string = read (time_len)
+                    if insert_time_string < mid_time_string:
+                        hi = mid
+                    else:
+                        lo = mid + 1
             else:
-                lo = 0
-                hi = pos
-
-            # This is a bisection search, except we don't cut the range in the
-            # middle each time, but at the 90th percentile. This is because
-            # logs are "mostly sorted", so the insertion point is much more
-            # likely to be at the end anyways:
-            while lo < hi:
-                mid = int (floor (lo * 0.1 + hi * 0.9))
-                seek (offsets[mid])
-                mid_time_string = read (time_len)
-                if insert_time_string < mid_time_string:
-                    hi = mid
+                # Gallop away from the cursor until the insertion point is
+                # bracketed, then bisect:
+                if pos > 0 and insert_time_string < time_at (pos - 1):
+                    hi = pos - 1
+                    step = 1
+                    while hi - step > 0 and insert_time_string < time_at (hi - step):
+                        hi -= step
+                        step *= 2
+                    lo = max (hi - step, 0)
+                elif pos < hi and not insert_time_string < time_at (pos):
+                    lo = pos + 1
+                    step = 1
+                    while lo + step < hi and not insert_time_string < time_at (lo + step):
+                        lo += step + 1
+                        step *= 2
+                    hi = min (lo + step, hi)
                 else:
-                    lo = mid + 1
-            pos = lo
-            # Caller will replace row at pos with the new one, so this is
-            # correct:
-            pos_time_string = insert_time_string
+                    lo = hi = pos
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if insert_time_string < time_at (mid):
+                        hi = mid
+                    else:
+                        lo = mid + 1
 
-            insert_pos = pos
+            cursors[thread] = lo
+            insert_pos = lo
 
             seek (save_offset)
 
+class LineIndexCache (object):
+
+    """Persistent on-disk cache for the line index built by LineCache.
+
+    Entries are stored in a directory (usually below XDG.CACHE_HOME), one file
+    per log file path.  An entry is only used if the size, modification time
+    and a hash of the head of the log file still match."""
+
+    MAGIC = "GSTDVIDX"
+    VERSION = 1
+
+    # Magic, version, offset item size, file size, mtime, head hash, line
+    # count.  Native byte order, the arrays are dumped natively as well:
+    _header = struct.Struct ("=8sIIQd20sQ")
+    _head_size = 1 << 16
+
+    # Indexing small files is fast enough already:
+    min_file_size = 1 << 20
+    max_entries = 32
+
+    def __init__ (self, directory):
+
+        self.logger = logging.getLogger ("indexcache")
+        self.directory = directory
+
+    def _entry_filename (self, path, suffix = ".idx"):
+
+        from hashlib import sha1
+
+        return os.path.join (self.directory, "%s%s" % (sha1 (path).hexdigest (), suffix,))
+
+    def _make_header (self, path, fileobj, line_count):
+
+        from hashlib import sha1
+
+        st = os.stat (path)
+        head_hash = sha1 (fileobj[:self._head_size]).digest ()
+
+        return self._header.pack (self.MAGIC, self.VERSION,
+                                  array (OFFSET_TYPECODE).itemsize,
+                                  st.st_size, st.st_mtime, head_hash,
+                                  line_count)
+
+    def load (self, path, fileobj):
+
+        """Return a tuple of (offsets, levels) arrays for the log file at path,
+        or None if there is no valid cache entry."""
+
+        filename = self._entry_filename (path)
+
+        try:
+            with open (filename, "rb") as entry:
+                header = entry.read (self._header.size)
+                if len (header) != self._header.size:
+                    return None
+                line_count = self._header.unpack (header)[-1]
+                if header != self._make_header (path, fileobj, line_count):
+                    self.logger.debug ("cached index for %s is stale", path)
+                    return None
+                offsets = array (OFFSET_TYPECODE)
+                offsets.fromfile (entry, line_count)
+                levels = DebugLevelArray ()
+                levels.fromfile (entry, line_count)
+        except (EnvironmentError, EOFError,) as exc:
+            self.logger.debug ("no cached index for %s: %s", path, exc)
+            return None
+
+        self.logger.debug ("loaded cached index with %i lines for %s",
+                           line_count, path)
+        return (offsets, levels,)
+
+    def save (self, path, fileobj, offsets, levels):
+
+        if len (fileobj) < self.min_file_size:
+            return
+
+        def write (entry):
+            entry.write (self._make_header (path, fileobj, len (offsets)))
+            offsets.tofile (entry)
+            levels.tofile (entry)
+
+        if not self.__write_entry (self._entry_filename (path), write):
+            return
+
+        self.logger.debug ("saved index with %i lines for %s", len (offsets), path)
+
+        self.prune ()
+
+    def load_data (self, path, fileobj, suffix):
+
+        """Return the string stored with save_data for the log file at path,
+        or None if there is no valid cache entry."""
+
+        filename = self._entry_filename (path, suffix)
+
+        try:
+            with open (filename, "rb") as entry:
+                header = entry.read (self._header.size)
+                if len (header) != self._header.size:
+                    return None
+                data_size = self._header.unpack (header)[-1]
+                if header != self._make_header (path, fileobj, data_size):
+                    self.logger.debug ("cached %s data for %s is stale", suffix, path)
+                    return None
+                data = entry.read (data_size)
+        except EnvironmentError as exc:
+            self.logger.debug ("no cached %s data for %s: %s", suffix, path, exc)
+            return None
+
+        if len (data) != data_size:
+            return None
+
+        return data
+
+    def save_data (self, path, fileobj, suffix, data):
+
+        """Store additional data for the log file at path, in an entry next to
+        the line index.  suffix names the kind of data."""
+
+        if len (fileobj) < self.min_file_size:
+            return
+
+        def write (entry):
+            entry.write (self._make_header (path, fileobj, len (data)))
+            entry.write (data)
+
+        if self.__write_entry (self._entry_filename (path, suffix), write):
+            self.logger.debug ("saved %i bytes of %s data for %s",
+                               len (data), suffix, path)
+
+    def __write_entry (self, filename, write):
+
+        from tempfile import mkstemp
+
+        try:
+            try:
+                os.makedirs (self.directory)
+            except OSError:
+                pass
+            fd, temp_name = mkstemp (dir = self.directory, prefix = ".tmp")
+            with os.fdopen (fd, "wb") as entry:
+                write (entry)
+            os.rename (temp_name, filename)
+        except EnvironmentError as exc:
+            self.logger.warning ("could not save %s: %s", filename, exc)
+            return False
+
+        return True
+
+    def prune (self):
+
+        from glob import glob
+
+        entries = glob (os.path.join (self.directory, "*.idx"))
+        if len (entries) <= self.max_entries:
+            return
+
+        entries.sort (key = os.path.getmtime)
+        for filename in entries[:-self.max_entries]:
+            # Also remove additional data saved for the same log file:
+            for filename in glob ("%s.*" % (os.path.splitext (filename)[0],)):
+                try:
+                    os.unlink (filename)
+                except EnvironmentError as exc:
+                    self.logger.warning ("could not remove stale index %s: %s",
+                                         filename, exc)
+
+def merge_lines (fileobj, offsets, levels,
+                 insert_positions, insert_offsets, insert_levels):
+
+    """Merge lines into the offsets and levels arrays in one pass.  The
+    insert_* sequences give the index in offsets before which each line goes,
+    its file offset and its level.  Lines that go to the same position are
+    ordered by timestamp, and by their order in the sequences for equal
+    timestamps.
+
+    Returns an array with the (ascending) indices of the merged lines in the
+    resulting arrays."""
+
+    merged_indices = array (OFFSET_TYPECODE)
+
+    if not insert_positions:
+        return merged_indices
+
+    time_len = len (time_args (0))
+    def time_string (i):
+        offset = insert_offsets[i]
+        return fileobj[offset:offset + time_len]
+
+    order = sorted (xrange (len (insert_positions)),
+                    key = insert_positions.__getitem__)
+
+    # Everything before the first insertion point stays in place:
+    first_pos = insert_positions[order[0]]
+    new_offsets = array (OFFSET_TYPECODE)
+    new_levels = DebugLevelArray ()
+    get_levels = array.__getslice__
+
+    prev_pos = first_pos
+    i = 0
+    while i < len (order):
+        pos = insert_positions[order[i]]
+        j = i + 1
+        while j < len (order) and insert_positions[order[j]] == pos:
+            j += 1
+        group = order[i:j]
+        if len (group) > 1:
+            group.sort (key = time_string)
+
+        new_offsets.extend (offsets[prev_pos:pos])
+        new_levels.extend (get_levels (levels, prev_pos, pos))
+        for k in group:
+            merged_indices.append (first_pos + len (new_offsets))
+            new_offsets.append (insert_offsets[k])
+            new_levels.append (insert_levels[k])
+
+        prev_pos = pos
+        i = j
+
+    new_offsets.extend (offsets[prev_pos:])
+    new_levels.extend (get_levels (levels, prev_pos, len (levels)))
+
+    # Replace the contents, our caller's references must stay valid:
+    offsets[first_pos:] = new_offsets
+    levels[first_pos:] = new_levels
+
+    return merged_indices
+
+def index_lines (fileobj, offsets, levels, start = 0, stop = None,
+                 lines_per_iteration = 50000):
+
+    """Index the log lines that start in the byte range [start, stop) of
+    fileobj, appending to the offsets and levels arrays in timestamp order.
+    This is a generator that yields True every lines_per_iteration lines."""
+
+    if stop is None:
+        fileobj.seek (0, 2)
+        stop = fileobj.tell ()
+
+    dict_levels = {"T" : debug_level_trace, "F" : debug_level_fixme,
+                   "L" : debug_level_log, "D" : debug_level_debug,
+                   "I" : debug_level_info, "W" : debug_level_warning,
+                   "E" : debug_level_error, " " : debug_level_none}
+    ANSI = "(?:\x1b\\[[0-9;]*m)?"
+    ANSI_PATTERN = (r"\d:\d\d:\d\d\.\d+ " + ANSI +
+                    r" *\d+" + ANSI +
+                    r" +(0x[0-9a-f]+) +" + ANSI +
+                    r"([TFLDIEW ])")
+    BARE_PATTERN = ANSI_PATTERN.replace (ANSI, "")
+    rexp_bare = re.compile (BARE_PATTERN)
+    rexp_ansi = re.compile (ANSI_PATTERN)
+    rexp = rexp_bare
+
+    # Out of order lines are collected here and merged in one go, instead of
+    # inserting each of them into the arrays:
+    insert_positions = array (OFFSET_TYPECODE)
+    insert_offsets = array (OFFSET_TYPECODE)
+    insert_levels = array ("B")
+
+    # Moving attribute lookups out of the loop:
+    readline = fileobj.readline
+    tell = fileobj.tell
+    rexp_match = rexp.match
+    levels_append = levels.append
+    offsets_append = offsets.append
+    dict_levels_get = dict_levels.get
+
+    fileobj.seek (start)
+    limit = lines_per_iteration
+    last_line = ""
+    i = 0
+    sort_helper = SortHelper (fileobj, offsets)
+    find_insert_position = sort_helper.find_insert_position
+    while True:
+        i += 1
+        if i >= limit:
+            i = 0
+            if len (insert_positions) > len (offsets):
+                merge_lines (fileobj, offsets, levels, insert_positions,
+                             insert_offsets, insert_levels)
+                del insert_positions[:], insert_offsets[:], insert_levels[:]
+            yield True
+
+        offset = tell ()
+        if offset >= stop:
+            break
+        line = readline ()
+        if not line:
+            break
+        match = rexp_match (line)
+        if match is None:
+            if rexp is rexp_ansi or not "\x1b" in line:
+                continue
+
+            match = rexp_ansi.match (line)
+            if match is None:
+                continue
+            # Switch to slower ANSI parsing:
+            rexp = rexp_ansi
+            rexp_match = rexp.match
+
+        # Timestamp is in the very beginning of the row, and can be sorted
+        # by lexical comparison. That's why we don't bother parsing the
+        # time to integer. We also don't have to take a substring here,
+        # which would be a useless memcpy.
+        if line >= last_line:
+            levels_append (dict_levels_get (match.group (2), debug_level_none))
+            offsets_append (offset)
+            last_line = line
+        else:
+            insert_positions.append (find_insert_position ((line, match.group (1),)))
+            insert_levels.append (dict_levels_get (match.group (2), debug_level_none))
+            insert_offsets.append (offset)
+
+    merge_lines (fileobj, offsets, levels,
+                 insert_positions, insert_offsets, insert_levels)
+
+def _index_chunk (path, start, stop):
+
+    # Runs in a worker process of LineCache.
+
+    import mmap
+
+    with open (path, "rb") as f:
+        fileobj = mmap.mmap (f.fileno (), 0, access = mmap.ACCESS_READ)
+        offsets = array (OFFSET_TYPECODE)
+        levels = DebugLevelArray ()
+        for x in index_lines (fileobj, offsets, levels, start, stop):
+            pass
+        fileobj.close ()
+
+    return (offsets.tostring (), levels.tostring (),)
+
 class LineCache (Producer):
 
     _lines_per_iteration = 50000
 
-    def __init__ (self, fileobj, dispatcher):
+    # Files smaller than this are not worth starting worker processes for:
+    _parallel_min_size = 1 << 26
+    _chunks_per_worker = 4
+
+    def __init__ (self, fileobj, dispatcher, index_cache = None, path = None,
+                  workers = 1):
 
         Producer.__init__ (self)
 
         self.logger = logging.getLogger ("linecache")
         self.dispatcher = dispatcher
+        self.index_cache = index_cache
+        self.path = path
+        self.workers = workers
 
         self.__fileobj = fileobj
         self.__fileobj.seek (0, 2)
         self.__file_size = self.__fileobj.tell ()
         self.__fileobj.seek (0)
+        self.__progress_offset = None
+
+        self.offsets = array (OFFSET_TYPECODE)
+        self.levels = DebugLevelArray ()
 
-        self.offsets = []
-        self.levels = [] # FIXME
+        self.__tail_offset = None
+        self.__tail_indexed = False
 
     def start_loading (self):
 
@@ -280,81 +947,195 @@ class LineCache (Producer):
         self.have_load_started ()
         self.dispatcher (self.__process ())
 
+    def start_update (self, fileobj):
+
+        """Index the data that was appended to the file.  fileobj must be a
+        new mapping of the (grown) file."""
+
+        self.logger.debug ("dispatching update process")
+        self.dispatcher (self.__process_update (fileobj))
+
     def get_progress (self):
 
+        if self.__progress_offset is not None:
+            return float (self.__progress_offset) / self.__file_size
+
         return float (self.__fileobj.tell ()) / self.__file_size
 
+    def __load_index (self):
+
+        if self.index_cache is None or self.path is None:
+            return False
+
+        cached = self.index_cache.load (self.path, self.__fileobj)
+        if cached is None:
+            return False
+
+        self.offsets, self.levels = cached
+
+        return True
+
+    def __save_index (self):
+
+        if self.index_cache is None or self.path is None:
+            return
+
+        self.index_cache.save (self.path, self.__fileobj,
+                               self.offsets, self.levels)
+
     def __process (self):
 
-        offsets = self.offsets
-        levels = self.levels
+        if self.__load_index ():
+            self.dispatcher.call (self.have_load_finished)
+            yield False
+            return
 
-        dict_levels = {"T" : debug_level_trace, "F" : debug_level_fixme,
-                       "L" : debug_level_log, "D" : debug_level_debug,
-                       "I" : debug_level_info, "W" : debug_level_warning,
-                       "E" : debug_level_error, " " : debug_level_none}
-        ANSI = "(?:\x1b\\[[0-9;]*m)?"
-        ANSI_PATTERN = (r"\d:\d\d:\d\d\.\d+ " + ANSI +
-                        r" *\d+" + ANSI +
-                        r" +0x[0-9a-f]+ +" + ANSI +
-                        r"([TFLDIEW ])")
-        BARE_PATTERN = ANSI_PATTERN.replace (ANSI, "")
-        rexp_bare = re.compile (BARE_PATTERN)
-        rexp_ansi = re.compile (ANSI_PATTERN)
-        rexp = rexp_bare
-
-        # Moving attribute lookups out of the loop:
-        readline = self.__fileobj.readline
-        tell = self.__fileobj.tell
-        rexp_match = rexp.match
-        levels_append = levels.append
-        offsets_append = offsets.append
-        dict_levels_get = dict_levels.get
+        if (self.workers > 1 and self.path is not None and
+            self.__file_size >= self._parallel_min_size):
+            process = self.__process_parallel ()
+        else:
+            process = index_lines (self.__fileobj, self.offsets, self.levels,
+                                   lines_per_iteration = self._lines_per_iteration)
 
-        self.__fileobj.seek (0)
-        limit = self._lines_per_iteration
-        last_line = ""
-        i = 0
-        sort_helper = SortHelper (self.__fileobj, offsets)
-        find_insert_position = sort_helper.find_insert_position
-        while True:
-            i += 1
-            if i >= limit:
-                i = 0
-                yield True
+        for x in process:
+            yield True
 
-            offset = tell ()
-            line = readline ()
-            if not line:
-                break
-            match = rexp_match (line)
-            if match is None:
-                if rexp is rexp_ansi or not "\x1b" in line:
-                    continue
+        self.__save_index ()
+        self.__update_tail ()
 
-                match = rexp_ansi.match (line)
-                if match is None:
-                    continue
-                # Switch to slower ANSI parsing:
-                rexp = rexp_ansi
-                rexp_match = rexp.match
-
-            # Timestamp is in the very beginning of the row, and can be sorted
-            # by lexical comparison. That's why we don't bother parsing the
-            # time to integer. We also don't have to take a substring here,
-            # which would be a useless memcpy.
-            if line >= last_line:
-                levels_append (dict_levels_get (match.group (1), debug_level_none))
-                offsets_append (offset)
-                last_line = line
+        self.dispatcher.call (self.have_load_finished)
+        yield False
+
+    def __update_tail (self):
+
+        # The writer of a growing file might be in the middle of a line.  If
+        # that line could not be indexed yet, it needs to be indexed again
+        # once the update comes in.
+
+        fileobj = self.__fileobj
+        size = self.__file_size
+
+        if size == 0 or fileobj[size - 1] == "\n":
+            self.__tail_offset = None
+            self.__tail_indexed = False
+            return
+
+        tail_offset = fileobj.rfind ("\n", 0, size) + 1
+        self.__tail_offset = tail_offset
+        self.__tail_indexed = ((len (self.offsets) and
+                                self.offsets[-1] == tail_offset) or
+                               find_line_index (fileobj, self.offsets, tail_offset) != -1)
+
+    def __find_merge_positions (self, new_offsets):
+
+        # Appended lines are usually newer than anything indexed before, which
+        # is checked for first:
+
+        time_len = len (time_args (0))
+        fileobj = self.__fileobj
+        offsets = self.offsets
+        n_lines = len (offsets)
+
+        positions = array (OFFSET_TYPECODE)
+        if n_lines:
+            last_offset = offsets[-1]
+            last_time_string = fileobj[last_offset:last_offset + time_len]
+            find_insert_position = SortHelper (fileobj, offsets).find_insert_position
+            for offset in new_offsets:
+                time_string = fileobj[offset:offset + time_len]
+                if time_string >= last_time_string:
+                    break
+                positions.append (find_insert_position ((time_string, None,)))
+        positions.extend (array (OFFSET_TYPECODE, [n_lines]) *
+                          (len (new_offsets) - len (positions)))
+
+        return positions
+
+    def __process_update (self, fileobj):
+
+        if self.__tail_offset is None:
+            start = self.__file_size
+        elif self.__tail_indexed:
+            start = fileobj.find ("\n", self.__tail_offset)
+            if start == -1:
+                start = len (fileobj)
             else:
-                pos = find_insert_position (line)
-                levels.insert (pos, dict_levels_get (match.group (1), debug_level_none))
-                offsets.insert (pos, offset)
+                start += 1
+        else:
+            start = self.__tail_offset
 
-        self.have_load_finished ()
+        self.__fileobj = fileobj
+        self.__file_size = len (fileobj)
+
+        new_offsets = array (OFFSET_TYPECODE)
+        new_levels = DebugLevelArray ()
+        for x in index_lines (fileobj, new_offsets, new_levels, start,
+                              lines_per_iteration = self._lines_per_iteration):
+            yield True
+
+        positions = self.__find_merge_positions (new_offsets)
+
+        # Consumers must see the lines change together with the
+        # notification:
+        self.dispatcher.call (self.__merge_lines, fileobj, positions,
+                              new_offsets, new_levels)
         yield False
 
+    def __merge_lines (self, fileobj, positions, new_offsets, new_levels):
+
+        line_indices = merge_lines (fileobj, self.offsets, self.levels,
+                                    positions, new_offsets, new_levels)
+        self.__update_tail ()
+
+        self.logger.debug ("indexed %i appended lines", len (line_indices))
+
+        self.have_lines_added (line_indices)
+
+    def __iter_chunks (self):
+
+        n_chunks = self.workers * self._chunks_per_worker
+        chunk_size = self.__file_size // n_chunks + 1
+
+        start = 0
+        while start < self.__file_size:
+            stop = self.__fileobj.find ("\n", start + chunk_size)
+            if stop == -1:
+                stop = self.__file_size
+            else:
+                stop += 1
+            yield (start, stop,)
+            start = stop
+
+    def __process_parallel (self):
+
+        from multiprocessing import Pool
+
+        self.logger.debug ("indexing with %i worker processes", self.workers)
+
+        chunks = list (self.__iter_chunks ())
+        pool = Pool (self.workers)
+        try:
+            results = [pool.apply_async (_index_chunk, (self.path, start, stop,))
+                       for start, stop in chunks]
+            # Lines at the start of a chunk can be older than the last lines
+            # of the previous one, so each chunk is merged in like an update:
+            for (start, stop), result in zip (chunks, results):
+                while not result.ready ():
+                    result.wait (.02)
+                    yield True
+                offsets_string, levels_string = result.get ()
+                new_offsets = array (OFFSET_TYPECODE, offsets_string)
+                new_levels = DebugLevelArray ()
+                new_levels.fromstring (levels_string)
+                positions = self.__find_merge_positions (new_offsets)
+                merge_lines (self.__fileobj, self.offsets, self.levels,
+                             positions, new_offsets, new_levels)
+                self.__progress_offset = stop
+                yield True
+        finally:
+            pool.terminate ()
+            self.__progress_offset = None
+
 class LogLine (list):
 
     _line_regex = default_log_line_regex ()
@@ -390,6 +1171,690 @@ class LogLine (list):
 
         return line
 
+def parse_line_times (fileobj, offsets, times, lines_per_iteration = 1 << 16):
+
+    """Generator that appends the timestamps of the lines at the given
+    offsets to the times array, parsing only the fixed width time prefix that
+    index_lines matched on.  Lines without a valid prefix get 0."""
+
+    time_len = len (time_args (0))
+    time_regex = re.compile (r"(\d+):(\d\d):(\d\d)\.(\d+)")
+
+    def parse_slow (offset):
+        match = time_regex.match (fileobj[offset:offset + 32])
+        if match is None:
+            return 0
+        return parse_time (match.group (0))
+
+    try:
+        data = numpy.frombuffer (fileobj, dtype = numpy.uint8)
+    except (AttributeError, TypeError,):
+        # No NumPy, or fileobj is not a buffer.
+        data = None
+
+    if data is None:
+        append = times.append
+        for i, offset in enumerate (offsets):
+            append (parse_slow (offset))
+            if (i + 1) % lines_per_iteration == 0:
+                yield True
+        return
+
+    # Weights of the characters of "0:00:00.000000000", 0 for the
+    # separators:
+    template = time_args (0)
+    weights = numpy.zeros (time_len, dtype = numpy.int64)
+    digits = [i for i, c in enumerate (template) if c.isdigit ()]
+    weights[digits] = [60**2 * SECOND, 10 * 60 * SECOND, 60 * SECOND,
+                       10 * SECOND, SECOND,] + [10**i for i in range (8, -1, -1)]
+    separators = [i for i, c in enumerate (template) if not c.isdigit ()]
+    separator_chars = numpy.array ([ord (template[i]) for i in separators],
+                                   dtype = numpy.int64)
+    positions = numpy.arange (time_len)
+
+    for start in xrange (0, len (offsets), lines_per_iteration):
+        # Slicing copies, so offsets may grow between the iterations:
+        chunk = offsets[start:start + lines_per_iteration]
+        chunk = numpy.frombuffer (chunk, dtype = chunk.typecode).astype (numpy.int64)
+        indices = chunk[:, None] + positions
+        in_file = indices[:, -1] < len (data)
+        chars = data[numpy.minimum (indices, len (data) - 1)].astype (numpy.int64)
+        values = chars - ord ("0")
+        valid = (in_file &
+                 ((values[:, digits] >= 0) & (values[:, digits] <= 9)).all (axis = 1) &
+                 (chars[:, separators] == separator_chars).all (axis = 1))
+        chunk_times = values.dot (weights)
+        # Hours with more than one digit, and shorter fractions:
+        for i in numpy.flatnonzero (~valid):
+            chunk_times[i] = parse_slow (int (chunk[i]))
+        times.fromstring (chunk_times.astype (times.typecode).tostring ())
+        yield True
+
+class LineColumns (object):
+
+    """All fields of every line, parsed once and stored in typed arrays in
+    line index order (parallel to LineCache.offsets).  Category, filename,
+    function and object are stored as IDs into the strings list."""
+
+    # The string columns that posting lists are kept for, with the position
+    # of their value in the result of __parse_line:
+    posting_columns = (("categories", 3,), ("filenames", 4,),
+                       ("functions", 6,), ("objects", 7,),)
+
+    def __init__ (self):
+
+        self.times = array (TIME_TYPECODE)
+        self.pids = array ("i")
+        self.threads = array (OFFSET_TYPECODE)
+        self.categories = array ("I")
+        self.filenames = array ("I")
+        self.line_numbers = array ("i")
+        self.functions = array ("I")
+        self.objects = array ("I")
+        self.message_offsets = array ("I")
+
+        self.strings = [""]
+        self.string_ids = {"" : 0}
+
+        # Line offsets in file order and the corresponding line indices, for
+        # looking up lines by offset:
+        self.__sorted_offsets = array (OFFSET_TYPECODE)
+        self.__sorted_indices = array ("I")
+
+        # Posting lists, built along with the columns (see get_postings):
+        self.__postings = dict ((name, {},) for name, position in self.posting_columns)
+
+    def __len__ (self):
+
+        return len (self.times)
+
+    def __iter_columns (self):
+
+        return (self.times, self.pids, self.threads, self.categories,
+                self.filenames, self.line_numbers, self.functions,
+                self.objects, self.message_offsets,)
+
+    def __parse_line (self, line):
+
+        # Same as LogLine.parse_full, without creating a row.
+
+        match = LogLine._line_regex.match (line)
+        if match is None:
+            return (0, 0, 0, 0, 0, 0, 0, 0, 0,)
+
+        (time_string, pid, thread, level, category, filename, line_number,
+         function, object_, message,) = match.groups ()
+
+        string_ids = self.string_ids
+        ids = []
+        for string in (category, filename, function, object_ or "",):
+            string_id = string_ids.get (string)
+            if string_id is None:
+                string_id = string_ids[string] = len (self.strings)
+                self.strings.append (string)
+            ids.append (string_id)
+
+        return (parse_time (time_string), int (pid), int (thread, 16),
+                ids[0], ids[1], int (line_number), ids[2], ids[3],
+                match.start (10),)
+
+    def parse (self, fileobj, offsets, lines_per_iteration = 20000):
+
+        """Generator that parses all lines at the given offsets."""
+
+        appends = [column.append for column in self.__iter_columns ()]
+        parse_line = self.__parse_line
+        add_postings = self.__add_postings
+        # This runs in a worker thread, so the lines are sliced out instead
+        # of moving the file position that the UI uses:
+        find = fileobj.find
+        size = len (fileobj)
+
+        i = 0
+        for line_index, offset in enumerate (offsets):
+            line = fileobj[offset:find ("\n", offset) + 1 or size]
+            values = parse_line (line)
+            for append, value in zip (appends, values):
+                append (value)
+            add_postings (line_index, values)
+            i += 1
+            if i == lines_per_iteration:
+                i = 0
+                yield True
+
+        self.__build_lookup (offsets)
+
+        yield False
+
+    def insert_lines (self, fileobj, offsets, line_indices):
+
+        """Parse the lines that were inserted at the ascending positions
+        line_indices of offsets."""
+
+        if not line_indices:
+            return
+
+        columns = self.__iter_columns ()
+        old_n_lines = len (self)
+        size = len (fileobj)
+
+        if line_indices[0] < old_n_lines:
+            self.__shift_postings (line_indices)
+
+        for line_index in line_indices:
+            offset = offsets[line_index]
+            line = fileobj[offset:fileobj.find ("\n", offset) + 1 or size]
+            values = self.__parse_line (line)
+            for column, value in zip (columns, values):
+                column.insert (line_index, value)
+            self.__add_postings (line_index, values)
+
+        new_offsets = sorted ((offsets[i], i,) for i in line_indices)
+        sorted_offsets = self.__sorted_offsets
+        if (line_indices[0] >= old_n_lines and
+            (not sorted_offsets or new_offsets[0][0] > sorted_offsets[-1])):
+            # Appended to the file and sorted to the end, which is the common
+            # case when following a log.
+            sorted_offsets.extend (array (OFFSET_TYPECODE, (o for o, i in new_offsets)))
+            self.__sorted_indices.extend (array ("I", (i for o, i in new_offsets)))
+        else:
+            self.__build_lookup (offsets)
+
+    def __add_postings (self, line_index, values):
+
+        # Lines are added in ascending order, mostly at the end.
+
+        postings = self.__postings
+        for name, position in self.posting_columns:
+            name_postings = postings[name]
+            string_id = values[position]
+            line_indices = name_postings.get (string_id)
+            if line_indices is None:
+                name_postings[string_id] = array ("I", (line_index,))
+            elif line_indices[-1] < line_index:
+                line_indices.append (line_index)
+            else:
+                insort_left (line_indices, line_index)
+
+    def __shift_postings (self, inserted_indices):
+
+        # Makes room for lines inserted at the ascending final positions
+        # inserted_indices.  Only the line indices from the first of them on
+        # change.
+
+        first = inserted_indices[0]
+        gaps = [index - r for r, index in enumerate (inserted_indices)]
+        for name_postings in self.__postings.itervalues ():
+            for line_indices in name_postings.itervalues ():
+                split = bisect_left (line_indices, first)
+                if split == len (line_indices):
+                    continue
+                line_indices[split:] = array ("I", (i + bisect_right (gaps, i)
+                                                    for i in line_indices[split:]))
+
+    def __build_lookup (self, offsets):
+
+        # Offsets are mostly in file order already, which makes this cheap.
+        indices = sorted (xrange (len (offsets)), key = offsets.__getitem__)
+        self.__sorted_indices = array ("I", indices)
+        self.__sorted_offsets = array (OFFSET_TYPECODE, (offsets[i] for i in indices))
+
+    def index_of_offset (self, line_offset):
+
+        sorted_offsets = self.__sorted_offsets
+        pos = bisect_left (sorted_offsets, line_offset)
+        if pos == len (sorted_offsets) or sorted_offsets[pos] != line_offset:
+            raise KeyError ("no line at offset %i" % (line_offset,))
+
+        return self.__sorted_indices[pos]
+
+    def get_postings (self, name):
+
+        """Return a dict that maps each string ID of the string column name
+        ("categories", "filenames", "functions" or "objects") to the sorted
+        array of line indices with that value."""
+
+        return self.__postings[name]
+
+    def get_lines_with_value (self, name, value):
+
+        """Return the sorted array of line indices where the string column
+        name has the given value."""
+
+        string_id = self.string_ids.get (value)
+        if string_id is None:
+            return array ("I")
+
+        return self.get_postings (name).get (string_id, array ("I"))
+
+    def get_counts (self, name):
+
+        """Return a dict that maps each value of the string column name to
+        the number of lines having it."""
+
+        strings = self.strings
+
+        return dict ((strings[string_id], len (line_indices),)
+                     for string_id, line_indices in self.get_postings (name).iteritems ())
+
+    def get_row (self, line_index):
+
+        """Return a LogLine like LogLine.parse_full does."""
+
+        strings = self.strings
+        i = line_index
+
+        return LogLine ([int (self.times[i]), self.pids[i], self.threads[i], 0,
+                         strings[self.categories[i]], strings[self.filenames[i]],
+                         self.line_numbers[i], strings[self.functions[i]],
+                         strings[self.objects[i]], self.message_offsets[i]])
+
+def intersect_sorted (a, b):
+
+    """Return the items of the ascending sequence a that are also in the
+    ascending array b, as an array.  Fast if b is short."""
+
+    result = array ("I")
+    n = len (a)
+    pos = 0
+    for item in b:
+        pos = bisect_left (a, item, pos)
+        if pos == n:
+            break
+        if a[pos] == item:
+            result.append (item)
+
+    return result
+
+def subtract_sorted (a, b):
+
+    """Return the items of the ascending array a that are not in the ascending
+    array b, as an array.  Fast if b is short."""
+
+    result = array ("I")
+    n = len (a)
+    start = 0
+    for item in b:
+        pos = bisect_left (a, item, start)
+        if pos == n:
+            break
+        if a[pos] == item:
+            result.extend (a[start:pos])
+            start = pos + 1
+    result.extend (a[start:])
+
+    return result
+
+class ParseCache (object):
+
+    """Bounded cache of fully parsed lines, keyed by line offset.
+
+    Lines are parsed and evicted in blocks: a block holds every line that
+    starts in the same block_size bytes of the file, so the rows of a page
+    of adjacent lines get parsed together.  Once more than max_lines lines
+    are cached, the least recently used blocks are dropped."""
+
+    block_size = 1 << 14
+    max_lines = 50000
+
+    def __init__ (self, fileobj = None, block_size = None, max_lines = None):
+
+        if block_size is not None:
+            self.block_size = block_size
+        if max_lines is not None:
+            self.max_lines = max_lines
+
+        self.fileobj = fileobj
+        self.columns = None
+        self.blocks = OrderedDict ()
+        self.n_lines = 0
+        self.__recent_id = None
+        self.__recent_block = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def set_fileobj (self, fileobj):
+
+        """Switch to a new mapping of the file.  If the file has only grown,
+        blocks that might contain an incomplete last line are dropped and
+        everything else is kept."""
+
+        old_fileobj = self.fileobj
+        self.fileobj = fileobj
+
+        if old_fileobj is None or len (fileobj) < len (old_fileobj):
+            self.clear ()
+            return
+
+        last_line_offset = old_fileobj.rfind ("\n", 0, max (len (old_fileobj) - 1, 0)) + 1
+        first_stale = last_line_offset // self.block_size
+        for block_id in [b for b in self.blocks if b >= first_stale]:
+            self.n_lines -= len (self.blocks.pop (block_id))
+        self.__recent_id = None
+        self.__recent_block = None
+
+    def set_columns (self, columns):
+
+        """Look up rows in the given LineColumns instead of parsing from now
+        on (or parse again, if columns is None)."""
+
+        self.columns = columns
+        self.clear ()
+
+    def clear (self):
+
+        self.blocks.clear ()
+        self.n_lines = 0
+        self.__recent_id = None
+        self.__recent_block = None
+
+    def reset_stats (self):
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__ (self):
+
+        return self.n_lines
+
+    def __contains__ (self, line_offset):
+
+        if self.columns is not None:
+            try:
+                self.columns.index_of_offset (line_offset)
+            except KeyError:
+                return False
+            return True
+
+        block = self.blocks.get (line_offset // self.block_size)
+
+        return block is not None and line_offset in block
+
+    def ensure (self, line_offset):
+
+        """Make sure the line starting at line_offset is parsed, and mark its
+        block as recently used."""
+
+        if self.columns is not None:
+            self.hits += 1
+            return
+
+        block_id = line_offset // self.block_size
+        if block_id == self.__recent_id:
+            # Most recently used already, which is the common case when
+            # walking adjacent lines.
+            self.hits += 1
+            return self.__recent_block
+
+        blocks = self.blocks
+        try:
+            block = blocks.pop (block_id)
+        except KeyError:
+            self.misses += 1
+            block = self.__parse_block (block_id)
+            self.n_lines += len (block)
+            while self.n_lines > self.max_lines and blocks:
+                dummy, old_block = blocks.popitem (last = False)
+                self.n_lines -= len (old_block)
+        else:
+            self.hits += 1
+
+        blocks[block_id] = block
+        self.__recent_id = block_id
+        self.__recent_block = block
+
+        return block
+
+    def __getitem__ (self, line_offset):
+
+        columns = self.columns
+        if columns is not None:
+            return columns.get_row (columns.index_of_offset (line_offset))
+
+        block_id = line_offset // self.block_size
+        if block_id == self.__recent_id:
+            block = self.__recent_block
+        else:
+            block = self.blocks.get (block_id)
+            if block is None:
+                block = self.ensure (line_offset)
+
+        return block[line_offset]
+
+    def __parse_block (self, block_id):
+
+        fileobj = self.fileobj
+        block_start = block_id * self.block_size
+        block_stop = block_start + self.block_size
+
+        offset = block_start
+        if offset > 0 and fileobj[offset - 1] != "\n":
+            # The line at the start of the block belongs to the previous one.
+            offset = fileobj.find ("\n", offset, block_stop) + 1
+            if offset == 0:
+                return {}
+
+        block = {}
+        parse_full = LogLine.parse_full
+        fileobj.seek (offset)
+        readline = fileobj.readline
+        while offset < block_stop:
+            line = readline ()
+            if not line:
+                break
+            block[offset] = parse_full (line)
+            offset += len (line)
+
+        return block
+
+def find_line_index (fileobj, line_offsets, line_offset):
+
+    """Return the index of line_offset in line_offsets, or -1 if it is not in
+    there.  line_offsets must be in timestamp order, like LineCache.offsets
+    or any subsequence of it."""
+
+    time_len = len (time_args (0))
+    time_string = fileobj[line_offset:line_offset + time_len]
+
+    lo = 0
+    hi = len (line_offsets)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        offset = line_offsets[mid]
+        if time_string < fileobj[offset:offset + time_len]:
+            hi = mid
+        else:
+            lo = mid + 1
+
+    # Only lines with the same timestamp remain to be checked:
+    index = lo
+    while index > 0:
+        index -= 1
+        offset = line_offsets[index]
+        if offset == line_offset:
+            return index
+        if fileobj[offset:offset + time_len] != time_string:
+            break
+
+    return -1
+
+def find_line_offsets (fileobj, text, line_offsets, start = 0, stop = None,
+                       window_size = 1 << 22, ignore_case = False):
+
+    """Generator that searches the raw bytes of fileobj for text and appends
+    the offset of each line containing it to line_offsets, in file order.
+    Yields after each window of window_size bytes."""
+
+    if stop is None:
+        stop = len (fileobj)
+
+    find = fileobj.find
+    rfind = fileobj.rfind
+
+    if ignore_case:
+        search = re.compile (re.escape (text), re.IGNORECASE).search
+        def find (text, start, stop):
+            match = search (fileobj, start, stop)
+            if match is None:
+                return -1
+            return match.start ()
+
+    pos = start
+    while pos < stop:
+        window_stop = min (pos + window_size, stop)
+        # Matches starting in the window:
+        search_stop = min (window_stop + len (text) - 1, stop)
+        while pos < window_stop:
+            hit = find (text, pos, search_stop)
+            if hit == -1:
+                pos = window_stop
+                break
+            line_offsets.append (rfind ("\n", 0, hit) + 1)
+            # Continue after the line:
+            pos = fileobj.find ("\n", hit, stop) + 1
+            if pos == 0:
+                pos = stop
+        yield True
+
+class TrigramIndex (object):
+
+    """Index of the trigrams occurring in each block of the file, for finding
+    candidate lines for a text search without reading the whole file.
+
+    Trigrams are hashed into n_buckets buckets; each block of block_size bytes
+    has one bit per bucket.  Searching for a text only needs to look at
+    lines in blocks that have the bits of all of its trigrams set.  Building
+    the index needs NumPy."""
+
+    block_size = 1 << 16
+    n_buckets = 1 << 12
+
+    SUFFIX = ".tri"
+
+    # Covered file size, block count:
+    _header = struct.Struct ("=QI")
+
+    def __init__ (self):
+
+        # Packed bits, one row per block:
+        self.bits = numpy.zeros ((0, self.n_buckets // 8,), dtype = numpy.uint8)
+        # For each block, if it contains a line break:
+        self.has_newline = numpy.zeros (0, dtype = bool)
+        self.size = 0
+
+    def tostring (self):
+
+        return (self._header.pack (self.size, len (self.bits)) +
+                self.bits.tostring () + self.has_newline.tostring ())
+
+    @classmethod
+    def fromstring (cls, data):
+
+        self = cls ()
+        header_size = self._header.size
+        self.size, n_blocks = self._header.unpack (data[:header_size])
+        bits_size = n_blocks * self.n_buckets // 8
+        if len (data) != header_size + bits_size + n_blocks:
+            raise ValueError ("invalid trigram index data")
+        self.bits = numpy.fromstring (data[header_size:header_size + bits_size],
+                                      dtype = numpy.uint8).reshape ((n_blocks, -1,))
+        self.has_newline = numpy.fromstring (data[header_size + bits_size:],
+                                             dtype = bool)
+
+        return self
+
+    @classmethod
+    def hash_trigrams (cls, data):
+
+        """Return the bucket of each trigram in the uint8 array data."""
+
+        data = data.astype (numpy.uint32)
+        values = (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+
+        return (values * numpy.uint32 (2654435761)) >> numpy.uint32 (32 - 12)
+
+    def build (self, fileobj, blocks_per_iteration = 16):
+
+        """Generator that indexes fileobj, continuing after the last complete
+        block if the index covers a shorter version of the file already."""
+
+        block_size = self.block_size
+        size = len (fileobj)
+        n_blocks = (size + block_size - 1) // block_size
+        first_block = self.size // block_size
+
+        bits = numpy.zeros ((n_blocks, self.n_buckets // 8,), dtype = numpy.uint8)
+        bits[:first_block] = self.bits[:first_block]
+        has_newline = numpy.zeros (n_blocks, dtype = bool)
+        has_newline[:first_block] = self.has_newline[:first_block]
+
+        data = numpy.frombuffer (fileobj, dtype = numpy.uint8)
+        row = numpy.zeros (self.n_buckets, dtype = bool)
+        for block in xrange (first_block, n_blocks):
+            start = block * block_size
+            # Trigrams starting in this block:
+            block_data = data[start:start + block_size + 2]
+            row[:] = False
+            row[self.hash_trigrams (block_data)] = True
+            bits[block] = numpy.packbits (row)
+            has_newline[block] = (block_data[:block_size] == 10).any ()
+            if (block + 1) % blocks_per_iteration == 0:
+                yield True
+
+        self.bits = bits
+        self.has_newline = has_newline
+        self.size = size
+
+        yield False
+
+    def __candidate_blocks (self, text):
+
+        buckets = numpy.unique (self.hash_trigrams (numpy.fromstring (text, dtype = numpy.uint8)))
+
+        # A match can span two blocks, so the union of each block and the
+        # next one is checked.  numpy.packbits puts the first bucket into the
+        # highest bit.
+        pairs = self.bits.copy ()
+        pairs[:-1] |= self.bits[1:]
+        found = numpy.ones (len (pairs), dtype = bool)
+        for bucket in buckets:
+            found &= (pairs[:, bucket >> 3] & (0x80 >> (bucket & 7))) != 0
+
+        # The last block might have grown since indexing:
+        found[-1:] = True
+
+        # A line runs from the block it starts in up to the next block that
+        # contains a line break at most.  It is a candidate if any of these
+        # blocks is:
+        n_blocks = len (found)
+        blocks = numpy.arange (n_blocks)
+        newline_blocks = numpy.flatnonzero (self.has_newline)
+        ends = numpy.append (newline_blocks, n_blocks - 1)[
+            numpy.searchsorted (newline_blocks, blocks + 1)]
+        found_count = numpy.concatenate (([0], numpy.cumsum (found),))
+
+        return found_count[ends + 1] > found_count[blocks]
+
+    def find_candidates (self, text, line_offsets):
+
+        """Return the ascending positions in the NumPy array line_offsets of
+        lines that may contain text, or None if the index cannot narrow the
+        search down."""
+
+        if len (text) < 3 or len (text) > self.block_size or len (self.bits) == 0:
+            return None
+
+        reach = self.__candidate_blocks (text)
+
+        # Lines after the indexed part of the file are always candidates:
+        blocks = line_offsets // self.block_size
+        is_candidate = blocks >= len (reach)
+        indexed = ~is_candidate
+        is_candidate[indexed] = reach[blocks[indexed]]
+
+        return numpy.flatnonzero (is_candidate)
+
 class LogLines (object):
 
     def __init__ (self, fileobj, line_cache):
@@ -421,19 +1886,33 @@ class LogLines (object):
 
 class LogFile (Producer):
 
-    def __init__ (self, filename, dispatcher):
-
-        import mmap
+    def __init__ (self, filename, dispatcher, index_cache = None, workers = 1,
+                  parse_columns = False):
 
         Producer.__init__ (self)
 
         self.logger = logging.getLogger ("logfile")
 
+        self.dispatcher = dispatcher
+        self.index_cache = index_cache
+        self.trigram_index = None
+        self.__trigram_index_pending = False
+        # If set, all fields of all lines are parsed into self.columns after
+        # loading:
+        self.parse_columns = parse_columns
+        self.columns = None
+        self.__columns_pending = False
+
         self.path = os.path.normpath (os.path.abspath (filename))
         self.__real_fileobj = file (filename, "rb")
-        self.fileobj = mmap.mmap (self.__real_fileobj.fileno (), 0, access = mmap.ACCESS_READ)
-        self.line_cache = LineCache (self.fileobj, dispatcher)
+        self.fileobj = self.__map_file ()
+        # Indexing seeks around in the file, possibly in a worker thread, so
+        # it gets a mapping of its own:
+        self.line_cache = LineCache (self.__map_file (), dispatcher,
+                                     index_cache = index_cache, path = self.path,
+                                     workers = workers)
         self.line_cache.consumers.append (self)
+        self.lines = None
 
     def get_full_line (self, line_index):
 
@@ -445,11 +1924,34 @@ class LogFile (Producer):
         line[-1] = msg
         return line
 
+    def __map_file (self):
+
+        import mmap
+
+        return mmap.mmap (self.__real_fileobj.fileno (), 0, access = mmap.ACCESS_READ)
+
     def start_loading (self):
 
         self.logger.debug ("starting load")
         self.line_cache.start_loading ()
 
+    def has_grown (self):
+
+        size = os.fstat (self.__real_fileobj.fileno ()).st_size
+
+        return size > len (self.fileobj)
+
+    def start_update (self):
+
+        """Map the file again and index lines that were appended to it.
+        Consumers are notified through handle_lines_added."""
+
+        self.logger.debug ("updating grown file")
+        # This replaces a running column parse process (if any), which is
+        # restarted when the update is done.
+        self.fileobj = self.__map_file ()
+        self.line_cache.start_update (self.__map_file ())
+
     def get_load_progress (self):
 
         return self.line_cache.get_progress ()
@@ -466,3 +1968,94 @@ class LogFile (Producer):
         # Chain up to our consumers:
         self.have_load_finished ()
 
+        if self.parse_columns:
+            self.start_parsing_columns ()
+
+    def handle_lines_added (self, line_indices):
+
+        self.lines = LogLines (self.fileobj, self.line_cache)
+
+        if self.columns is not None:
+            self.columns.insert_lines (self.fileobj, self.line_cache.offsets,
+                                       line_indices)
+
+        # Chain up to our consumers:
+        self.have_lines_added (line_indices)
+
+        if self.__columns_pending:
+            self.start_parsing_columns ()
+
+    def start_trigram_index (self, dispatcher):
+
+        """Build the trigram index for text searches, or bring it up to date
+        with the file, in the background using the given dispatcher.  The
+        index is loaded from or saved to the index cache if possible.
+        Returns False if the index is not supported (NumPy is missing)."""
+
+        if numpy is None:
+            return False
+
+        if not self.__trigram_index_pending:
+            self.logger.debug ("dispatching trigram index process")
+            self.__trigram_index_pending = True
+            dispatcher (self.__process_trigram_index ())
+
+        return True
+
+    def abort_trigram_index (self):
+
+        self.__trigram_index_pending = False
+
+    def __process_trigram_index (self):
+
+        fileobj = self.fileobj
+        index = self.trigram_index
+        index_cache = self.index_cache
+
+        if index is None and index_cache is not None:
+            data = index_cache.load_data (self.path, fileobj, TrigramIndex.SUFFIX)
+            if data is not None:
+                try:
+                    index = TrigramIndex.fromstring (data)
+                except ValueError as exc:
+                    self.logger.warning ("cannot load trigram index: %s", exc)
+        if index is None:
+            index = TrigramIndex ()
+
+        if index.size != len (fileobj):
+            for x in index.build (fileobj):
+                yield True
+            if index_cache is not None:
+                index_cache.save_data (self.path, fileobj, TrigramIndex.SUFFIX,
+                                       index.tostring ())
+
+        self.logger.debug ("trigram index covers %i bytes", index.size)
+
+        self.trigram_index = index
+        self.__trigram_index_pending = False
+        yield False
+
+    def start_parsing_columns (self):
+
+        self.logger.debug ("dispatching column parse process")
+        self.columns = None
+        self.__columns_pending = True
+        self.dispatcher (self.__process_columns ())
+
+    def __process_columns (self):
+
+        columns = LineColumns ()
+        for x in columns.parse (self.fileobj, self.line_cache.offsets):
+            yield True
+
+        self.logger.debug ("parsed all fields of %i lines", len (columns))
+
+        self.dispatcher.call (self.__handle_columns_parsed, columns)
+        yield False
+
+    def __handle_columns_parsed (self, columns):
+
+        self.__columns_pending = False
+        self.columns = columns
+        self.have_columns_ready ()
+
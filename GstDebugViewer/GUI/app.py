@@ -24,7 +24,7 @@ import os.path
 import gobject
 import gtk
 
-from GstDebugViewer import Common
+from GstDebugViewer import Common, Data
 from GstDebugViewer.GUI.columns import ViewColumnManager
 from GstDebugViewer.GUI.window import Window
 
@@ -40,6 +40,8 @@ class AppStateSection (Common.GUI.StateSection):
 
     zoom_level = Common.GUI.StateInt ("zoom-level")
 
+    parse_all_fields = Common.GUI.StateBool ("parse-all-fields")
+
 class AppState (Common.GUI.State):
 
     def __init__ (self, *a, **kw):
@@ -79,6 +81,11 @@ class App (object):
         self.state = AppState (state_filename)
         self.state_section = self.state.sections["state"]
 
+        cache_home = Common.utils.XDG.CACHE_HOME
+
+        index_dirname = os.path.join (cache_home, "gst-debug-viewer", "index")
+        self.index_cache = Data.LineIndexCache (index_dirname)
+
         self.load_plugins ()
 
         self.windows = []
@@ -19,11 +19,32 @@
 
 """GStreamer Debug Viewer GUI module."""
 
+import operator
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from GstDebugViewer import Data
 from GstDebugViewer.GUI.models import LogModelBase
 
 class Filter (object):
 
-    pass
+    # Filters that select rows by a single column value set these, which
+    # allows applying them using posting lists:
+    col_id = None
+    value = None
+    show_only = False
+
+    def filter_mask (self, arrays):
+
+        """Return a boolean NumPy array of the rows to keep, evaluated on the
+        given models.ColumnArrays.  Filters that cannot do this raise
+        NotImplementedError and are applied with filter_func per row."""
+
+        raise NotImplementedError ("filter has no array implementation")
 
 class DebugLevelFilter (Filter):
 
@@ -34,30 +55,358 @@ class DebugLevelFilter (Filter):
             return row[col_id] != debug_level
         self.filter_func = filter_func
 
-class CategoryFilter (Filter):
+        def filter_mask (arrays):
+            return arrays.get (col_id) != int (debug_level)
+        self.filter_mask = filter_mask
+
+class StringFilter (Filter):
+
+    """Hides the rows where the column has the given value, or with
+    show_only set, all the others."""
+
+    def __init__ (self, col_id, value, show_only = False):
+
+        self.col_id = col_id
+        self.value = value
+        self.show_only = show_only
+
+        if show_only:
+            def filter_func (row):
+                return row[col_id] == value
+            def filter_mask (arrays):
+                return arrays.get (col_id) == arrays.string_id (value)
+        else:
+            def filter_func (row):
+                return row[col_id] != value
+            def filter_mask (arrays):
+                return arrays.get (col_id) != arrays.string_id (value)
+        self.filter_func = filter_func
+        self.filter_mask = filter_mask
+
+class CategoryFilter (StringFilter):
 
     def __init__ (self, category):
 
-        col_id = LogModelBase.COL_CATEGORY
-        def category_filter_func (row):
-            return row[col_id] != category
-        self.filter_func = category_filter_func
+        StringFilter.__init__ (self, LogModelBase.COL_CATEGORY, category)
 
-class ObjectFilter (Filter):
+class ObjectFilter (StringFilter):
 
-    def __init__ (self, object_):
+    def __init__ (self, object_, show_only = False):
 
-        col_id = LogModelBase.COL_OBJECT
-        def object_filter_func (row):
-            return row[col_id] != object_
-        self.filter_func = object_filter_func
+        StringFilter.__init__ (self, LogModelBase.COL_OBJECT, object_, show_only)
 
-class FilenameFilter (Filter):
+class FilenameFilter (StringFilter):
 
     def __init__ (self, filename):
 
-        col_id = LogModelBase.COL_FILENAME
-        def filename_filter_func (row):
-            return row[col_id] != filename
-        self.filter_func = filename_filter_func
+        StringFilter.__init__ (self, LogModelBase.COL_FILENAME, filename)
+
+
+class FilterExpressionError (ValueError):
+
+    pass
+
+class ExpressionFilter (Filter):
+
+    """Shows only the rows matching a filter expression, like
+
+      level>=WARN and category in (v4l2src, queue) and not object=~"sink"
+
+    Comparisons are combined with and, or, not and parentheses.  The
+    operators are = (or ==), !=, <, <=, >, >=, in (...), =~ and !~ (regular
+    expression search).  Levels compare by severity, so level>=WARN matches
+    warnings and errors; lines without a level (NONE) never match <, <=, >
+    or >= comparisons of the level.  The whole expression is compiled into one
+    filter_func and one filter_mask, instead of applying a filter for each
+    comparison.  Raises FilterExpressionError for invalid expressions."""
+
+    fields = {"level" : LogModelBase.COL_LEVEL,
+              "pid" : LogModelBase.COL_PID,
+              "thread" : LogModelBase.COL_THREAD,
+              "category" : LogModelBase.COL_CATEGORY,
+              "filename" : LogModelBase.COL_FILENAME,
+              "line" : LogModelBase.COL_LINE_NUMBER,
+              "function" : LogModelBase.COL_FUNCTION,
+              "object" : LogModelBase.COL_OBJECT,}
+
+    string_fields = ("category", "filename", "function", "object",)
+
+    operators = {"==" : operator.eq, "!=" : operator.ne,
+                 "<" : operator.lt, "<=" : operator.le,
+                 ">" : operator.gt, ">=" : operator.ge,}
+
+    # Operators with the level operands swapped, to compare by severity
+    # instead of by level number:
+    severity_operators = {"==" : "==", "!=" : "!=",
+                          "<" : ">", "<=" : ">=", ">" : "<", ">=" : "<=",}
+    ordering_operators = ("<", "<=", ">", ">=",)
+
+    # NONE has the lowest level number, but is no severity at all:
+    level_none = int (Data.debug_level_none)
+
+    token_re = re.compile (r"""\s*(?:
+                               (?P<op>==|!=|<=|>=|=~|!~|[=<>(),])
+                               |"(?P<dquoted>(?:[^"\\]|\\.)*)"
+                               |'(?P<squoted>(?:[^'\\]|\\.)*)'
+                               |(?P<word>[^\s()=!<>,~"']+))""", re.X)
+
+    def __init__ (self, expression):
+
+        self.expression = expression
+        self.__tokens = self.__tokenize (expression)
+        self.__pos = 0
+
+        tree = self.__parse_or ()
+        if self.__peek () is not None:
+            self.__error ("unexpected %r" % (self.__peek ()[1],))
+        del self.__tokens
+
+        # Single comparisons can still use the posting lists:
+        if tree[0] == "cmp" and tree[1] in self.string_fields:
+            op, value = tree[2], tree[3]
+            if op == "in" and len (value) == 1:
+                op, value = "==", list (value)[0]
+            if op in ("==", "!=",):
+                self.col_id = self.fields[tree[1]]
+                self.value = value
+                self.show_only = (op == "==")
+
+        self.__constants = {}
+        source = self.__compile_func (tree)
+        self.filter_func = eval ("lambda row: %s" % (source,), self.__constants)
+        self.filter_mask = self.__compile_mask (tree)
+
+    @staticmethod
+    def __tokenize (expression):
+
+        tokens = []
+        pos = 0
+        expression = expression.rstrip ()
+        while pos < len (expression):
+            match = ExpressionFilter.token_re.match (expression, pos)
+            if match is None:
+                raise FilterExpressionError ("invalid character %r at position %i"
+                                             % (expression[pos:].lstrip ()[0], pos,))
+            pos = match.end ()
+            for kind in ("op", "dquoted", "squoted", "word",):
+                value = match.group (kind)
+                if value is not None:
+                    break
+            if kind in ("dquoted", "squoted",):
+                kind = "string"
+                value = re.sub (r"\\(.)", r"\1", value)
+            tokens.append ((kind, value,))
+
+        return tokens
+
+    def __error (self, message):
+
+        raise FilterExpressionError (message)
+
+    def __peek (self):
+
+        if self.__pos < len (self.__tokens):
+            return self.__tokens[self.__pos]
+        else:
+            return None
+
+    def __next (self, expected = None):
+
+        token = self.__peek ()
+        if token is None:
+            self.__error ("unexpected end of expression")
+        if expected is not None and token != expected:
+            self.__error ("expected %r instead of %r" % (expected[1], token[1],))
+        self.__pos += 1
+        return token
+
+    def __accept (self, token):
+
+        if self.__peek () == token:
+            self.__pos += 1
+            return True
+        return False
+
+    def __parse_or (self):
+
+        operands = [self.__parse_and ()]
+        while self.__accept (("word", "or",)):
+            operands.append (self.__parse_and ())
+
+        if len (operands) == 1:
+            return operands[0]
+        return ("or", operands,)
+
+    def __parse_and (self):
+
+        operands = [self.__parse_not ()]
+        while self.__accept (("word", "and",)):
+            operands.append (self.__parse_not ())
+
+        if len (operands) == 1:
+            return operands[0]
+        return ("and", operands,)
+
+    def __parse_not (self):
+
+        if self.__accept (("word", "not",)):
+            return ("not", self.__parse_not (),)
+        if self.__accept (("op", "(",)):
+            tree = self.__parse_or ()
+            self.__next (("op", ")",))
+            return tree
+        return self.__parse_comparison ()
+
+    def __parse_comparison (self):
+
+        kind, field = self.__next ()
+        if kind != "word" or field not in self.fields:
+            self.__error ("unknown field %r (expected one of %s)"
+                          % (field, ", ".join (sorted (self.fields)),))
+
+        negate = self.__accept (("word", "not",))
+        if negate or self.__accept (("word", "in",)):
+            if negate:
+                self.__next (("word", "in",))
+            self.__next (("op", "(",))
+            values = [self.__parse_value (field)]
+            while self.__accept (("op", ",",)):
+                values.append (self.__parse_value (field))
+            self.__next (("op", ")",))
+            tree = ("cmp", field, "in", frozenset (values),)
+            if negate:
+                return ("not", tree,)
+            return tree
+
+        kind, op = self.__next ()
+        if kind != "op" or op in ("(", ")", ",",):
+            self.__error ("expected an operator after %r instead of %r" % (field, op,))
+        if op == "=":
+            op = "=="
+
+        if op in ("=~", "!~",):
+            kind, pattern = self.__next ()
+            if kind not in ("word", "string",):
+                self.__error ("expected a pattern instead of %r" % (pattern,))
+            if field not in self.string_fields:
+                self.__error ("cannot match a pattern against %r" % (field,))
+            try:
+                regex = re.compile (pattern)
+            except re.error as exc:
+                self.__error ("invalid pattern %r: %s" % (pattern, exc,))
+            tree = ("cmp", field, "=~", regex,)
+            if op == "!~":
+                return ("not", tree,)
+            return tree
+
+        if field in self.string_fields and op not in ("==", "!=",):
+            self.__error ("cannot compare %r using %r" % (field, op,))
+
+        return ("cmp", field, op, self.__parse_value (field),)
+
+    def __parse_value (self, field):
+
+        kind, value = self.__next ()
+        if kind not in ("word", "string",):
+            self.__error ("expected a value instead of %r" % (value,))
+
+        if field == "level":
+            try:
+                return int (Data.DebugLevel (value))
+            except (ValueError, IndexError,):
+                self.__error ("invalid debug level %r" % (value,))
+        elif field not in self.string_fields:
+            try:
+                return int (value, 0)
+            except ValueError:
+                self.__error ("invalid number %r for %r" % (value, field,))
+
+        return value
+
+    def __constant (self, value):
+
+        name = "_c%i" % (len (self.__constants),)
+        self.__constants[name] = value
+        return name
+
+    def __compile_func (self, tree):
+
+        # Generates the source of a Python expression on row, so that the
+        # whole filter is a single function without nested calls.
+
+        kind = tree[0]
+        if kind == "not":
+            return "not (%s)" % (self.__compile_func (tree[1]),)
+        elif kind in ("and", "or",):
+            return (" %s " % (kind,)).join (["(%s)" % (self.__compile_func (operand),)
+                                             for operand in tree[1]])
+
+        field, op, value = tree[1:]
+        col_id = self.fields[field]
+        if op == "=~":
+            return "%s (row[%i]) is not None" % (self.__constant (value.search), col_id,)
+        elif op == "in":
+            return "row[%i] in %s" % (col_id, self.__constant (value),)
+        elif field == "level" and op in self.ordering_operators:
+            return "%s %s row[%i] != %i" % (value, op, col_id, self.level_none,)
+        elif field == "level":
+            return "%s %s row[%i]" % (value, op, col_id,)
+        else:
+            return "row[%i] %s %s" % (col_id, op, self.__constant (value),)
+
+    def __compile_mask (self, tree):
+
+        kind = tree[0]
+        if kind == "not":
+            operand = self.__compile_mask (tree[1])
+            def filter_mask (arrays):
+                return ~operand (arrays)
+            return filter_mask
+        elif kind in ("and", "or",):
+            operands = [self.__compile_mask (operand) for operand in tree[1]]
+            def filter_mask (arrays):
+                mask = operands[0] (arrays)
+                for operand in operands[1:]:
+                    if kind == "and":
+                        mask &= operand (arrays)
+                    else:
+                        mask |= operand (arrays)
+                return mask
+            return filter_mask
+
+        field, op, value = tree[1:]
+        col_id = self.fields[field]
+        if field in self.string_fields:
+            # String columns are compared by ID.
+            if op == "=~":
+                search = value.search
+                def string_ids (arrays):
+                    return arrays.string_ids_matching (search)
+            elif op == "in":
+                def string_ids (arrays):
+                    return [arrays.string_id (s) for s in value]
+            else:
+                def string_ids (arrays):
+                    return [arrays.string_id (value)]
+            def filter_mask (arrays):
+                mask = numpy.in1d (arrays.get (col_id), string_ids (arrays))
+                if op == "!=":
+                    mask = ~mask
+                return mask
+        elif op == "in":
+            values = sorted (value)
+            def filter_mask (arrays):
+                return numpy.in1d (arrays.get (col_id), values)
+        else:
+            ordering = op in self.ordering_operators
+            if field == "level":
+                op = self.severity_operators[op]
+            compare = self.operators[op]
+            def filter_mask (arrays):
+                values = arrays.get (col_id)
+                mask = compare (values, value)
+                if field == "level" and ordering:
+                    mask &= values != self.level_none
+                return mask
 
+        return filter_mask
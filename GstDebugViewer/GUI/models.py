@@ -20,14 +20,35 @@
 """GStreamer Debug Viewer GUI module."""
 
 from array import array
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
+from itertools import imap
 import logging
 
 import gobject
 import gtk
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from GstDebugViewer import Common, Data
 
+def index_shift_func (inserted_indices):
+
+    """Return a function that maps an index from before the insertion of rows
+    to the index after it.  inserted_indices are the ascending final indices
+    of the inserted rows."""
+
+    # Every inserted row r has inserted_indices[r] - r existing rows in front
+    # of it:
+    gaps = [index - r for r, index in enumerate (inserted_indices)]
+
+    def shift (index):
+        return index + bisect_right (gaps, index)
+
+    return shift
+
 class LogModelBase (gtk.GenericTreeModel):
 
     __metaclass__ = Common.GUI.MetaModel
@@ -49,14 +70,53 @@ class LogModelBase (gtk.GenericTreeModel):
 
         ##self.props.leak_references = False
 
-        self.line_offsets = array ("I")
-        self.line_levels = [] # FIXME: Not so nice!
+        self.line_offsets = array (Data.OFFSET_TYPECODE)
+        self.line_levels = Data.DebugLevelArray ()
         self.line_cache = {}
+        # Timestamp of each row, see update_line_times:
+        self.line_times = None
+        # Data.LevelCounts of the rows, see update_level_counts:
+        self.level_counts = None
 
     def ensure_cached (self, line_offset):
 
         raise NotImplementedError ("derived classes must override this method")
 
+    def update_line_times (self):
+
+        """Generator that sets line_times to an array with the timestamp of
+        every row, without parsing whole rows.  Yields True while working."""
+
+        raise NotImplementedError ("derived classes must override this method")
+
+    def get_time_range_rows (self, start_ts, stop_ts):
+
+        """Return the start and stop row of the rows with timestamps from
+        start_ts to stop_ts, inclusive.  Needs line_times (see
+        update_line_times)."""
+
+        times = self.line_times
+
+        return (bisect_left (times, start_ts), bisect_right (times, stop_ts),)
+
+    def update_level_counts (self):
+
+        """Generator that sets level_counts to a Data.LevelCounts for the
+        rows.  Yields True while working."""
+
+        while self.level_counts is None:
+            levels = self.line_levels
+            if isinstance (levels, SubRange):
+                levels = levels.l[levels.start:levels.stop]
+            if not isinstance (levels, Data.DebugLevelArray):
+                levels = Data.DebugLevelArray (array ("B", levels).tostring ())
+            level_counts = Data.LevelCounts ()
+            for x in level_counts.build (levels):
+                yield True
+            # Start over if rows changed in between:
+            if len (level_counts) == len (self.line_levels):
+                self.level_counts = level_counts
+
     def access_offset (self, offset):
 
         raise NotImplementedError ("derived classes must override this method")
@@ -130,6 +190,20 @@ class LogModelBase (gtk.GenericTreeModel):
 
         return value
 
+    def get_column_arrays (self, indices):
+
+        """Return a ColumnArrays for the rows at the given indices, or None if
+        the model does not support this."""
+
+        return None
+
+    def get_lines_with_value (self, col_id, value):
+
+        """Return the ascending line indices of all rows where the column has
+        the given value, or None if the model does not support this."""
+
+        return None
+
     def get_value_range (self, col_id, start, stop):
 
         if col_id != self.COL_LEVEL:
@@ -182,12 +256,103 @@ class LogModelBase (gtk.GenericTreeModel):
 
     ##     pass
 
+def numpy_index (seq):
+
+    """Convert a sequence of (ascending) row indices, as used for super_index,
+    to a slice or NumPy index array."""
+
+    if isinstance (seq, xrange):
+        if len (seq) == 0:
+            return slice (0, 0)
+        return slice (seq[0], seq[-1] + 1)
+    elif isinstance (seq, SubRange):
+        index = numpy_index (seq.l)
+        if isinstance (index, slice):
+            return slice (index.start + seq.start, index.start + seq.stop)
+        return index[seq.start:seq.stop]
+    elif isinstance (seq, array):
+        return numpy.frombuffer (seq, dtype = seq.typecode)
+    else:
+        return numpy.array (seq, dtype = numpy.intp)
+
+def numpy_values (seq):
+
+    """Return the values of an array (or SubRange of one) as NumPy array."""
+
+    if isinstance (seq, SubRange):
+        return numpy_values (seq.l)[seq.start:seq.stop]
+    elif isinstance (seq, array):
+        return numpy.frombuffer (seq, dtype = seq.typecode)
+    else:
+        return numpy.array (seq)
+
+class ColumnArrays (object):
+
+    """Column values of a set of rows as NumPy arrays, for evaluating filters
+    on all rows at once.  String columns are given as IDs (see string_id)."""
+
+    column_names = {LogModelBase.COL_TIME : "times",
+                    LogModelBase.COL_PID : "pids",
+                    LogModelBase.COL_THREAD : "threads",
+                    LogModelBase.COL_CATEGORY : "categories",
+                    LogModelBase.COL_FILENAME : "filenames",
+                    LogModelBase.COL_LINE_NUMBER : "line_numbers",
+                    LogModelBase.COL_FUNCTION : "functions",
+                    LogModelBase.COL_OBJECT : "objects",}
+    string_columns = (LogModelBase.COL_CATEGORY,
+                      LogModelBase.COL_FILENAME,
+                      LogModelBase.COL_FUNCTION,
+                      LogModelBase.COL_OBJECT,)
+
+    def __init__ (self, line_levels, columns, index):
+
+        self.line_levels = line_levels
+        self.columns = columns
+        self.index = index
+
+    def get (self, col_id):
+
+        """Return the values of the column for the rows.  Raises KeyError if
+        the column is not available as an array."""
+
+        if col_id == LogModelBase.COL_LEVEL:
+            values = self.line_levels
+        elif self.columns is None:
+            raise KeyError ("columns not parsed")
+        else:
+            values = getattr (self.columns, self.column_names[col_id])
+
+        return numpy.frombuffer (values, dtype = values.typecode)[self.index]
+
+    def string_id (self, string):
+
+        """Return the ID of string in the string columns, or -1 if no row has
+        that value."""
+
+        if self.columns is None:
+            raise KeyError ("columns not parsed")
+
+        return self.columns.string_ids.get (string, -1)
+
+    def string_ids_matching (self, predicate):
+
+        """Return the IDs of the strings for which predicate is true."""
+
+        if self.columns is None:
+            raise KeyError ("columns not parsed")
+
+        return [string_id for string_id, string in enumerate (self.columns.strings)
+                if predicate (string)]
+
 class LazyLogModel (LogModelBase):
 
-    def __init__ (self, log_obj = None):
+    def __init__ (self, log_obj = None, cache_lines = None):
 
         LogModelBase.__init__ (self)
 
+        self.line_cache = Data.ParseCache (max_lines = cache_lines)
+        self.columns = None
+
         self.__log_obj = log_obj
 
         if log_obj:
@@ -198,8 +363,62 @@ class LazyLogModel (LogModelBase):
         self.__fileobj = log_obj.fileobj
 
         self.line_cache.clear ()
+        self.line_cache.set_fileobj (log_obj.fileobj)
         self.line_offsets = log_obj.line_cache.offsets
         self.line_levels = log_obj.line_cache.levels
+        self.line_times = None
+        self.level_counts = None
+        self.__lines_changed = 0
+
+        self.__log_obj = log_obj
+
+    def set_columns (self, columns):
+
+        """Take rows from the given Data.LineColumns instead of parsing
+        lines."""
+
+        self.columns = columns
+        self.line_cache.set_columns (columns)
+
+    def get_column_arrays (self, indices):
+
+        if numpy is None or not isinstance (self.line_levels, Data.DebugLevelArray):
+            return None
+
+        return ColumnArrays (self.line_levels, self.columns, numpy_index (indices))
+
+    def get_lines_with_value (self, col_id, value):
+
+        if self.columns is None or col_id not in ColumnArrays.string_columns:
+            return None
+
+        return self.columns.get_lines_with_value (ColumnArrays.column_names[col_id],
+                                                  value)
+
+    def handle_lines_added (self, line_indices):
+
+        # The offset and level arrays are updated in place by the line cache,
+        # only the mapping of the file needs to be picked up:
+        self.__fileobj = self.__log_obj.fileobj
+        self.line_cache.set_fileobj (self.__fileobj)
+        self.line_times = None
+        self.level_counts = None
+        self.__lines_changed += 1
+
+        for line_index in line_indices:
+            path = (line_index,)
+            self.row_inserted (path, self.get_iter (path))
+
+    def update_line_times (self):
+
+        while self.line_times is None:
+            lines_changed = self.__lines_changed
+            times = array (Data.TIME_TYPECODE)
+            for x in Data.parse_line_times (self.__fileobj, self.line_offsets, times):
+                yield True
+            # Start over if lines got added in between:
+            if lines_changed == self.__lines_changed:
+                self.line_times = times
 
     def access_offset (self, offset):
 
@@ -209,16 +428,7 @@ class LazyLogModel (LogModelBase):
 
     def ensure_cached (self, line_offset):
 
-        if line_offset in self.line_cache:
-            return
-
-        if len (self.line_cache) > 10000:
-            self.line_cache.clear ()
-
-        self.__fileobj.seek (line_offset)
-        line = self.__fileobj.readline ()
-
-        self.line_cache[line_offset] = Data.LogLine.parse_full (line)
+        self.line_cache.ensure (line_offset)
 
 class FilteredLogModelBase (LogModelBase):
 
@@ -250,68 +460,303 @@ class FilteredLogModel (FilteredLogModelBase):
         self.logger = logging.getLogger ("filtered-log-model")
 
         self.filters = []
+        # For each filter, the super model rows (within super_range) that pass
+        # it and all filters before it:
+        self.filter_results = []
         self.reset ()
         self.__active_process = None
+        self.__saved_filters = None
         self.__filter_progress = 0.
+        # Super model rows that were added while a filter process was
+        # running, in the current super model index space:
+        self.__pending_super_indices = None
 
     def reset (self):
 
-        self.line_offsets = self.super_model.line_offsets
-        self.line_levels = self.super_model.line_levels
-        self.super_index = xrange (len (self.line_offsets))
+        self.super_range = None
 
         del self.filters[:]
+        del self.filter_results[:]
+
+        self.__update_rows ()
+
+    def __range_index (self):
+
+        # The super model rows before any filtering.
+
+        if self.super_range is None:
+            return xrange (len (self.super_model.line_offsets))
+        else:
+            return xrange (*self.super_range)
+
+    def __update_rows (self):
+
+        # Make the result of the last filter the rows of this model.
+
+        super_model = self.super_model
+        self.line_times = None
+        self.level_counts = None
+
+        if not self.filter_results:
+            # Identity.
+            if self.super_range is None:
+                self.super_index = xrange (len (super_model.line_offsets))
+                self.line_offsets = super_model.line_offsets
+                self.line_levels = super_model.line_levels
+            else:
+                start, stop = self.super_range
+                self.super_index = xrange (start, stop)
+                self.line_offsets = SubRange (super_model.line_offsets, start, stop)
+                self.line_levels = SubRange (super_model.line_levels, start, stop)
+            return
+
+        self.super_index = self.filter_results[-1]
+        self.line_offsets = self.__take_super (super_model.line_offsets,
+                                               array (Data.OFFSET_TYPECODE))
+        self.line_levels = self.__take_super (super_model.line_levels,
+                                              Data.DebugLevelArray ())
+
+    def __update_tail_rows (self, split):
+
+        # Like __update_rows, for a last filter result that only changed from
+        # index split on.
+
+        super_model = self.super_model
+        self.line_times = None
+        self.level_counts = None
+
+        tail = self.super_index[split:]
+        self.line_offsets[split:] = array (Data.OFFSET_TYPECODE,
+                                           imap (super_model.line_offsets.__getitem__,
+                                                 tail))
+        line_levels = Data.DebugLevelArray ()
+        line_levels.extend (imap (super_model.line_levels.__getitem__, tail))
+        self.line_levels[split:] = line_levels
+
+    def __take_super (self, values, result):
+
+        # Fill the result array with the values of the super model rows in
+        # super_index.
+
+        super_index = self.super_index
+        if isinstance (super_index, xrange):
+            start = super_index[0] if super_index else 0
+            result.extend (values[start:start + len (super_index)])
+        elif numpy is not None:
+            data = numpy.frombuffer (values, dtype = values.typecode)
+            result.fromstring (data[numpy_values (super_index)].tostring ())
+        else:
+            result.extend (imap (values.__getitem__, super_index))
+
+        return result
+
+    def update_line_times (self):
+
+        for x in self.super_model.update_line_times ():
+            yield True
+
+        self.line_times = self.__take_super (self.super_model.line_times,
+                                             array (Data.TIME_TYPECODE))
+
+    def __filter_process (self, keep, filters, super_index):
+
+        # The results replace those of all but the first keep filters.
+
+        results = []
+        for x in self.__filter_stack (filters, super_index, results):
+            yield True
+
+        self.logger.debug ("filtering finished")
+
+        self.__filter_progress = 1.
+        self.__dispatcher.call (self.__handle_filter_process_finished, keep, results)
+        yield False
+
+    def __filter_stack (self, filters, super_index, results):
+
+        # Applies the filters one after another, each only to the rows that
+        # passed the ones before, starting with the rows super_index.  The
+        # result of each filter is appended to results.
+
+        for n, filter in enumerate (filters):
+            new_index = self.__filter_fast (filter, super_index)
+            if new_index is None:
+                new_index = array ("I")
+                for x in self.__filter_rows (filter, super_index, new_index,
+                                             float (n) / len (filters),
+                                             1. / len (filters)):
+                    yield True
+            results.append (new_index)
+            super_index = new_index
+
+    def __filter_fast (self, filter, super_index):
+
+        # Lines that were added to the super model while the process runs
+        # shift its rows, so the fast paths work on the current indices.
+
+        shift = self.__super_shift ()
+        if shift is not None:
+            super_index = array ("I", imap (shift, super_index))
+
+        new_index = self.__filter_arrays (filter, super_index)
+        if new_index is not None:
+            self.logger.debug ("filtered on column arrays")
+        else:
+            new_index = self.__filter_postings (filter, super_index)
+            if new_index is not None:
+                self.logger.debug ("filtered with posting lists")
+            else:
+                return None
+
+        if shift is not None:
+            # None of the rows are added ones, which are not in super_index.
+            pending = self.__pending_super_indices
+            new_index = array ("I", (i - bisect_left (pending, i) for i in new_index))
+
+        return new_index
+
+    def __super_shift (self):
+
+        # Maps the super model indices that a running process works with to
+        # the current ones, or None if they are the same.
+
+        if not self.__pending_super_indices:
+            return None
+
+        return index_shift_func (self.__pending_super_indices)
+
+    def __filter_postings (self, filter, super_index):
 
-    def __filter_process (self, filter):
+        # Filters that select rows by one column value are a set operation on
+        # the lines having that value, if the super model can provide them.
 
-        YIELD_LIMIT = 10000
+        if filter.col_id is None:
+            return None
+
+        lines = self.super_model.get_lines_with_value (filter.col_id, filter.value)
+        if lines is None:
+            return None
+
+        if not isinstance (super_index, array):
+            super_index = array ("I", super_index)
+
+        if filter.show_only:
+            return Data.intersect_sorted (super_index, lines)
+        else:
+            return Data.subtract_sorted (super_index, lines)
+
+    def __filter_arrays (self, filter, super_index):
+
+        # Evaluates the filter on whole columns at once, if both the filter
+        # and the super model support it.
+
+        arrays = self.super_model.get_column_arrays (super_index)
+        if arrays is None:
+            return None
+
+        try:
+            mask = filter.filter_mask (arrays)
+        except (NotImplementedError, KeyError,):
+            return None
+
+        index = arrays.index
+        if isinstance (index, slice):
+            new_super_index = numpy.flatnonzero (mask) + index.start
+        else:
+            new_super_index = index[mask]
+
+        return array ("I", new_super_index.astype (numpy.uint32).tostring ())
 
-        self.logger.debug ("preparing new filter")
-        new_line_offsets = array ("I")
-        new_line_levels = []
-        new_super_index = array ("I")
+    def __filter_rows (self, filter, super_index, result, progress_start, progress_scale):
+
+        super_model = self.super_model
+        super_offsets = super_model.line_offsets
+        super_levels = super_model.line_levels
+        ensure_cached = super_model.ensure_cached
+        line_cache = super_model.line_cache
         level_id = self.COL_LEVEL
         func = filter.filter_func
-        def enum ():
-            i = 0
-            for row, offset in self.iter_rows_offset ():
-                line_index = self.super_index[i]
-                yield (line_index, row, offset,)
-                i += 1
+        append = result.append
+
         self.logger.debug ("running filter")
-        progress = 0.
-        progress_full = float (len (self))
-        y = YIELD_LIMIT
-        for i, row, offset in enum ():
+        progress = 0
+        progress_full = float (max (1, len (super_index)))
+        limit = Data.YieldLimit ()
+        y = limit.size
+        shift = self.__super_shift ()
+        for i in super_index:
+            if shift is None:
+                super_i = i
+            else:
+                super_i = shift (i)
+            offset = super_offsets[super_i]
+            ensure_cached (offset)
+            row = line_cache[offset]
+            row[level_id] = super_levels[super_i]
             if func (row):
-                new_line_offsets.append (offset)
-                new_line_levels.append (row[level_id])
-                new_super_index.append (i)
+                append (i)
             y -= 1
             if y == 0:
-                progress += float (YIELD_LIMIT)
-                self.__filter_progress = progress / progress_full
-                y = YIELD_LIMIT
+                progress += limit.size
+                self.__filter_progress = (progress_start +
+                                          progress_scale * progress / progress_full)
+                y = limit.end_batch ()
                 yield True
-        self.line_offsets = new_line_offsets
-        self.line_levels = new_line_levels
-        self.super_index = new_super_index
-        self.logger.debug ("filtering finished")
+                limit.start_batch ()
+                shift = self.__super_shift ()
 
-        self.__filter_progress = 1.
-        self.__handle_filter_process_finished ()
-        yield False
+    def __start_process (self, dispatcher, process):
+
+        self.__dispatcher = dispatcher
+        self.__filter_progress = 0.
+        self.__active_process = process
+        dispatcher (self.__guard_process (process))
+
+    def __guard_process (self, process):
+
+        # A filter that raises would otherwise leave the process unfinished
+        # for good.
+
+        try:
+            for x in process:
+                yield x
+        except Exception as exc:
+            self.logger.exception ("filter process failed")
+            self.__dispatcher.call (self.__handle_process_failed, exc)
+            yield False
 
     def add_filter (self, filter, dispatcher):
 
         if self.__active_process is not None:
             raise ValueError ("dispatched a filter process already")
 
+        self.__saved_filters = list (self.filters)
         self.filters.append (filter)
 
-        self.__dispatcher = dispatcher
-        self.__active_process = self.__filter_process (filter)
-        dispatcher (self.__active_process)
+        self.__start_process (dispatcher,
+                              self.__filter_process (len (self.filter_results),
+                                                     [filter], self.super_index))
+
+    def remove_filter (self, index, dispatcher):
+
+        """Remove the filter at the given index of the filter stack.  Only
+        the filters after it are applied again, to the cached result of the
+        ones before it."""
+
+        if self.__active_process is not None:
+            raise ValueError ("dispatched a filter process already")
+
+        self.__saved_filters = list (self.filters)
+        del self.filters[index]
+
+        if index == 0:
+            super_index = self.__range_index ()
+        else:
+            super_index = self.filter_results[index - 1]
+
+        self.__start_process (dispatcher,
+                              self.__filter_process (index, self.filters[index:],
+                                                     super_index))
 
     def abort_process (self):
 
@@ -319,10 +764,24 @@ class FilteredLogModel (FilteredLogModelBase):
             raise ValueError ("no filter process running")
 
         self.__dispatcher.cancel ()
+        self.__restore_filters ()
+
+    def __restore_filters (self):
+
+        # Forget about the process, as if it had not been started.
+
         self.__active_process = None
         self.__dispatcher = None
 
-        del self.filters[-1]
+        self.filters[:] = self.__saved_filters
+        self.__saved_filters = None
+
+        self.__apply_pending_lines ()
+
+    def __handle_process_failed (self, exc):
+
+        self.__restore_filters ()
+        self.handle_process_failed (exc)
 
     def get_filter_progress (self):
 
@@ -331,15 +790,28 @@ class FilteredLogModel (FilteredLogModelBase):
 
         return self.__filter_progress
 
-    def __handle_filter_process_finished (self):
+    def __handle_filter_process_finished (self, keep, results):
 
         self.__active_process = None
+        self.__saved_filters = None
+
+        self.filter_results[keep:] = results
+        self.__update_rows ()
+        self.__apply_pending_lines ()
+
         self.handle_process_finished ()
 
     def handle_process_finished (self):
 
         pass
 
+    def handle_process_failed (self, exc):
+
+        """Called instead of handle_process_finished if a filter raised exc.
+        The filters and rows are the same as before the process started."""
+
+        pass
+
     def line_index_from_super (self, super_line_index):
 
         return bisect_left (self.super_index, super_line_index)
@@ -348,39 +820,221 @@ class FilteredLogModel (FilteredLogModelBase):
 
         return self.super_index[line_index]
 
-    def set_range (self, super_start, super_stop):
+    def __count_passed (self, super_line_index):
 
-        old_super_start = self.line_index_to_super (0)
-        old_super_stop = self.line_index_to_super (len (self.super_index) - 1) + 1
+        # Number of filters, from the first one on, that the row passes.
 
-        self.logger.debug ("set range (%i, %i), current (%i, %i)",
-                           super_start, super_stop, old_super_start, old_super_stop)
+        super_model = self.super_model
+        offset = super_model.line_offsets[super_line_index]
+        super_model.ensure_cached (offset)
+        row = super_model.line_cache[offset]
+        row[self.COL_LEVEL] = super_model.line_levels[super_line_index]
+
+        for n, filter in enumerate (self.filters):
+            if not filter.filter_func (row):
+                return n
+        return len (self.filters)
+
+    def handle_super_lines_added (self, super_indices):
+
+        """Update the model after rows were inserted into the super model at
+        the ascending positions super_indices."""
+
+        if not super_indices:
+            return
+
+        if self.__active_process is not None:
+            # The result of the process is for the rows before the addition,
+            # so the new rows are merged in after it is committed.
+            self.__defer_lines (super_indices)
+            return
+
+        super_model = self.super_model
+        n_super = len (super_model.line_offsets)
+        shift = index_shift_func (super_indices)
+
+        if self.super_range is None:
+            start, stop = 0, n_super
+        else:
+            start, stop = self.super_range
+            if stop == n_super - len (super_indices):
+                # Range extends to the end, keep following it.
+                stop = n_super
+            else:
+                stop = shift (stop)
+            start = shift (start)
+            self.super_range = (start, stop,)
+
+        new_rows = [i for i in super_indices if start <= i < stop]
 
         if len (self.filters) == 0:
-            # Identity.
-            self.super_index = xrange (super_start, super_stop)
-            self.line_offsets = SubRange (self.super_model.line_offsets,
-                                          super_start, super_stop)
-            self.line_levels = SubRange (self.super_model.line_levels,
-                                         super_start, super_stop)
+            self.__update_rows ()
+            positions = [i - start for i in new_rows]
+        else:
+            passed = dict ((i, self.__count_passed (i),) for i in new_rows)
+            # Rows in front of the first added one keep their index.  Lines
+            # are usually appended, which leaves only the new rows to add.
+            first = super_indices[0]
+            results = self.filter_results
+            for n, result in enumerate (results):
+                split = bisect_left (result, first)
+                tail = [shift (i) for i in result[split:]]
+                tail.extend (i for i in new_rows if passed[i] > n)
+                tail.sort ()
+                result[split:] = array ("I", tail)
+            self.__update_tail_rows (bisect_left (self.super_index, first))
+            positions = [bisect_left (self.super_index, i) for i in new_rows
+                         if passed[i] == len (results)]
+
+        for position in positions:
+            path = (position,)
+            self.row_inserted (path, self.get_iter (path))
+
+    def __defer_lines (self, super_indices):
+
+        pending = self.__pending_super_indices
+        if pending is None:
+            if isinstance (self.super_index, xrange):
+                self.__keep_rows (super_indices)
+            pending = []
+        else:
+            shift = index_shift_func (super_indices)
+            pending = [shift (i) for i in pending]
+
+        self.__pending_super_indices = sorted (pending + list (super_indices))
+
+    def __keep_rows (self, super_indices):
+
+        # The rows are those of the super model, which changed in place by
+        # the insertion of super_indices.  Until the process is done, this
+        # model has to keep showing the rows from before.
+
+        super_model = self.super_model
+        line_offsets = array (Data.OFFSET_TYPECODE)
+        line_levels = Data.DebugLevelArray ()
+        get_levels = array.__getslice__
+        prev = 0
+        for i in super_indices:
+            line_offsets.extend (super_model.line_offsets[prev:i])
+            line_levels.extend (get_levels (super_model.line_levels, prev, i))
+            prev = i + 1
+        line_offsets.extend (super_model.line_offsets[prev:])
+        line_levels.extend (get_levels (super_model.line_levels, prev,
+                                        len (super_model.line_levels)))
+
+        start = self.super_index[0] if self.super_index else 0
+        stop = start + len (self.super_index)
+        self.line_offsets = line_offsets[start:stop]
+        self.line_levels = line_levels[start:stop]
+
+    def __apply_pending_lines (self):
+
+        pending = self.__pending_super_indices
+        if pending is None:
             return
 
-        if super_start < old_super_start:
-            # TODO:
-            raise NotImplementedError ("Only handling further restriction of the range"
-                                       " (start offset = %i)" % (start_offset,))
+        self.__pending_super_indices = None
+        self.handle_super_lines_added (pending)
+
+    def set_range (self, super_start, super_stop, dispatcher = None):
+
+        """Show only the super model rows from super_start to super_stop that
+        pass the filters.  Rows that were hidden before have to be filtered,
+        which is done by a process dispatched with dispatcher, and True is
+        returned; handle_process_finished is called when the range is
+        applied.  Otherwise, the range is applied right away and False is
+        returned."""
+
+        return self.__change_range ((super_start, super_stop,), dispatcher)
+
+    def reset_range (self, dispatcher = None):
+
+        """Show all rows of the super model again that pass the filters.  See
+        set_range for the return value."""
+
+        return self.__change_range (None, dispatcher)
+
+    def __change_range (self, super_range, dispatcher):
+
+        if self.__active_process is not None:
+            raise ValueError ("dispatched a filter process already")
+
+        if self.super_range is None:
+            old_super_start, old_super_stop = 0, len (self.super_model.line_offsets)
+        else:
+            old_super_start, old_super_stop = self.super_range
+        if super_range is None:
+            super_start, super_stop = 0, len (self.super_model.line_offsets)
+        else:
+            super_start, super_stop = super_range
+
+        self.logger.debug ("set range (%i, %i), current (%i, %i)",
+                           super_start, super_stop, old_super_start, old_super_stop)
+
+        # Cached filter results are kept for the part of the old range that
+        # remains, only the rows that are newly exposed need filtering.
+        inner_start = max (super_start, old_super_start)
+        inner_stop = min (super_stop, old_super_stop)
+        if inner_start >= inner_stop:
+            inner_start = inner_stop = super_start
+
+        exposed = (inner_start - super_start) + (super_stop - inner_stop)
+        if not self.filter_results or exposed == 0:
+            self.__handle_range_process_finished (super_range, inner_start, inner_stop,
+                                                  [array ("I") for filter in self.filters],
+                                                  notify = False)
+            return False
+
+        if dispatcher is None:
+            raise ValueError ("filtering the exposed rows needs a dispatcher")
+
+        super_index = array ("I", xrange (super_start, inner_start))
+        super_index.extend (xrange (inner_stop, super_stop))
+
+        self.__saved_filters = list (self.filters)
+        self.__start_process (dispatcher,
+                              self.__range_process (super_range, inner_start,
+                                                    inner_stop, super_index))
+
+        return True
 
-        if super_stop > old_super_stop:
-            # TODO:
-            raise NotImplementedError ("Only handling further restriction of the range"
-                                       " (end offset = %i)" % (stop_offset,))
+    def __range_process (self, super_range, inner_start, inner_stop, super_index):
 
-        start = self.line_index_from_super (super_start)
-        stop = self.line_index_from_super (super_stop)
+        # Filters the exposed rows super_index.
 
-        self.super_index = SubRange (self.super_index, start, stop)
-        self.line_offsets = SubRange (self.line_offsets, start, stop)
-        self.line_levels = SubRange (self.line_levels, start, stop)
+        results = []
+        for x in self.__filter_stack (self.filters, super_index, results):
+            yield True
+
+        self.logger.debug ("filtering exposed rows finished")
+
+        self.__filter_progress = 1.
+        self.__dispatcher.call (self.__handle_range_process_finished,
+                                super_range, inner_start, inner_stop, results)
+        yield False
+
+    def __handle_range_process_finished (self, super_range, inner_start, inner_stop,
+                                         exposed_results, notify = True):
+
+        self.__active_process = None
+        self.__saved_filters = None
+
+        self.super_range = super_range
+
+        results = self.filter_results
+        for n, result in enumerate (results):
+            exposed = exposed_results[n]
+            split = bisect_left (exposed, inner_start)
+            results[n] = (exposed[:split] +
+                          result[bisect_left (result, inner_start):
+                                 bisect_left (result, inner_stop)] +
+                          exposed[split:])
+
+        self.__update_rows ()
+
+        if notify:
+            self.__apply_pending_lines ()
+            self.handle_process_finished ()
 
 class SubRange (object):
 
@@ -444,6 +1098,11 @@ class LineViewLogModel (FilteredLogModelBase):
 
         return self.parent_indices[line_index]
 
+    def handle_super_lines_added (self, super_indices):
+
+        shift = index_shift_func (super_indices)
+        self.parent_indices[:] = [shift (i) for i in self.parent_indices]
+
     def insert_line (self, position, super_line_index):
 
         if position == -1:
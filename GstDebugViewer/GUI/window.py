@@ -27,6 +27,7 @@ def _ (s):
 import os.path
 from bisect import bisect_right, bisect_left
 import logging
+from multiprocessing import cpu_count
 
 import glib
 import gobject
@@ -36,7 +37,9 @@ from GstDebugViewer import Common, Data, Main
 from GstDebugViewer.GUI.columns import LineViewColumnManager, ViewColumnManager
 from GstDebugViewer.GUI.filters import (CategoryFilter,
                                         DebugLevelFilter,
+                                        ExpressionFilter,
                                         FilenameFilter,
+                                        FilterExpressionError,
                                         ObjectFilter)
 from GstDebugViewer.GUI.models import (FilteredLogModel,
                                        LazyLogModel,
@@ -223,6 +226,8 @@ class Window (object):
         self.info_widget = None
         self.progress_dialog = None
         self.update_progress_id = None
+        self.follow_id = None
+        self.follow_updating = False
 
         self.window_state = Common.GUI.WindowState ()
         self.column_manager = ViewColumnManager (app.state_section)
@@ -248,20 +253,27 @@ class Window (object):
                             ("enlarge-text", gtk.STOCK_ZOOM_IN, _("Enlarge Text"), "<Ctrl>plus"),
                             ("shrink-text", gtk.STOCK_ZOOM_OUT, _("Shrink Text"), "<Ctrl>minus"),
                             ("reset-text", gtk.STOCK_ZOOM_100, _("Normal Text Size"), "<Ctrl>0")])
+        group.add_toggle_actions ([("follow-file", None, _("_Follow File")),
+                                   ("parse-all-fields", None, _("_Parse All Fields After Loading"))])
         self.actions.add_group (group)
         self.actions.reload_file.props.sensitive = False
+        self.actions.parse_all_fields.props.active = bool (app.state_section.parse_all_fields)
 
         group = gtk.ActionGroup ("RowActions")
         group.add_actions ([("hide-before-line", None, _("Hide lines before this point")),
                             ("hide-after-line", None, _("Hide lines after this point")),
                             ("show-hidden-lines", None, _("Show hidden lines")),
+                            ("show-hidden-range", None, _("Show lines before and after")),
                             ("edit-copy-line", gtk.STOCK_COPY, _("Copy line"), "<Ctrl>C"),
                             ("edit-copy-message", gtk.STOCK_COPY, _("Copy message"), ""),
                             ("set-base-time", None, _("Set base time")),
                             ("hide-log-level", None, _("Hide log level")),
                             ("hide-log-category", None, _("Hide log category")),
                             ("hide-log-object", None, _("Hide object")),
-                            ("hide-filename", None, _("Hide filename"))])
+                            ("show-only-log-object", None, _("Show only this object")),
+                            ("hide-filename", None, _("Hide filename")),
+                            ("filter-expression", None, _("Filter by expression..."), "<Ctrl>E"),
+                            ("remove-last-filter", None, _("Remove last filter"))])
         group.props.sensitive = False
         self.actions.add_group (group)
 
@@ -270,6 +282,7 @@ class Window (object):
         self.log_file = None
         self.log_model = None
         self.log_filter = None
+        self.last_filter_expression = None
 
         self.widget_factory = Common.GUI.WidgetFactory (Main.Paths.data_dir)
         self.widgets = self.widget_factory.make ("main-window.ui", "main_window")
@@ -309,6 +322,7 @@ class Window (object):
         self.log_model = model
         self.log_filter = FilteredLogModel (self.log_model)
         self.log_filter.handle_process_finished = self.handle_log_filter_process_finished
+        self.log_filter.handle_process_failed = self.handle_log_filter_process_failed
     def get_top_attach_point (self):
 
         return self.widgets.vbox_main
@@ -336,6 +350,12 @@ class Window (object):
 
         self.gtk_window.connect ("delete-event", self.handle_window_delete_event)
 
+        # Background jobs of the window and its features:
+        self.scheduler = Common.Data.Scheduler ()
+        self.filter_dispatcher = self.scheduler.dispatcher (Common.Data.Scheduler.PRIORITY_HIGH)
+        self.time_range_dispatcher = self.scheduler.dispatcher (Common.Data.Scheduler.PRIORITY_HIGH,
+                                                                after = (self.filter_dispatcher,))
+
         self.features = []
 
         for plugin_feature in self.app.iter_plugin_features ():
@@ -533,6 +553,47 @@ class Window (object):
 
         self.set_log_file (self.log_file.path)
 
+    @action
+    def handle_follow_file_action_activate (self, action):
+
+        if action.props.active:
+            if self.follow_id is None:
+                self.follow_id = gobject.timeout_add (1000, self.poll_log_file)
+        elif self.follow_id is not None:
+            gobject.source_remove (self.follow_id)
+            self.follow_id = None
+
+    @action
+    def handle_parse_all_fields_action_activate (self, action):
+
+        self.app.state_section.parse_all_fields = action.props.active
+
+        if (action.props.active and self.log_file is not None and
+            self.log_file.lines is not None and self.log_file.columns is None):
+            self.log_file.parse_columns = True
+            self.log_file.start_parsing_columns ()
+
+    def poll_log_file (self):
+
+        if self.log_file is None or self.log_file.lines is None:
+            # Not loaded yet.
+            return True
+
+        if self.progress_dialog is not None or self.follow_updating:
+            return True
+
+        try:
+            has_grown = self.log_file.has_grown ()
+        except EnvironmentError as exc:
+            self.logger.warning ("cannot check log file for changes: %s", exc)
+            return True
+
+        if has_grown:
+            self.follow_updating = True
+            self.log_file.start_update ()
+
+        return True
+
     @action
     def handle_cancel_load_action_activate (self, action):
 
@@ -589,13 +650,73 @@ class Window (object):
                               first_index,
                               last_index)
 
-        self.push_view_state ()
         start_index = first_index
         stop_index = last_index + 1
-        self.log_filter.set_range (start_index, stop_index)
-        self.update_model ()
-        self.pop_view_state ()
+        self.change_filter_range ((start_index, stop_index,))
+        self.actions.show_hidden_lines.props.sensitive = True
+        self.actions.show_hidden_range.props.sensitive = True
+
+    def show_time_range (self, start_ts, stop_ts):
+
+        """Hide the lines before start_ts and after stop_ts.  This happens in
+        the background, after the timestamps of the lines are available."""
+
+        self.time_range_dispatcher (self.time_range_process (start_ts, stop_ts))
+
+    def time_range_process (self, start_ts, stop_ts):
+
+        # The timestamps are cached by the timeline already, usually:
+        for x in self.log_model.update_line_times ():
+            yield True
+
+        self.time_range_dispatcher.call (self.handle_line_times_ready,
+                                         start_ts, stop_ts)
+        yield False
+
+    def handle_line_times_ready (self, start_ts, stop_ts):
+
+        start_index, stop_index = self.log_model.get_time_range_rows (start_ts, stop_ts)
+        if start_index >= stop_index:
+            return
+
+        self.logger.info ("showing lines from %s to %s (abs %i to %i)",
+                          Data.time_args (start_ts), Data.time_args (stop_ts),
+                          start_index, stop_index)
+
+        self.change_filter_range ((start_index, stop_index,),
+                                  scroll_to_selection = True)
         self.actions.show_hidden_lines.props.sensitive = True
+        self.actions.show_hidden_range.props.sensitive = True
+
+    @action
+    def handle_show_hidden_range_action_activate (self, action):
+
+        self.logger.info ("showing lines hidden before and after, keeping filters")
+        self.change_filter_range (None, scroll_to_selection = True)
+        self.actions.show_hidden_range.props.sensitive = False
+
+    def change_filter_range (self, super_range, scroll_to_selection = False):
+
+        """Show the lines in super_range (None for all lines) that pass the
+        filters.  Lines that were hidden before are filtered in the
+        background, like for a new filter."""
+
+        if self.progress_dialog is not None:
+            self.logger.warning ("not changing the range while busy")
+            return
+
+        self.push_view_state ()
+        if super_range is None:
+            started = self.log_filter.reset_range (dispatcher = self.filter_dispatcher)
+        else:
+            start_index, stop_index = super_range
+            started = self.log_filter.set_range (start_index, stop_index,
+                                                 dispatcher = self.filter_dispatcher)
+        if started:
+            self.show_filter_progress ()
+        else:
+            self.update_model ()
+            self.pop_view_state (scroll_to_selection = scroll_to_selection)
 
     @action
     def handle_show_hidden_lines_action_activate (self, action):
@@ -607,6 +728,8 @@ class Window (object):
         self.update_model (self.log_filter)
         self.pop_view_state (scroll_to_selection = True)
         self.actions.show_hidden_lines.props.sensitive = False
+        self.actions.show_hidden_range.props.sensitive = False
+        self.actions.remove_last_filter.props.sensitive = False
 
     @action
     def handle_edit_copy_line_action_activate (self, action):
@@ -686,18 +809,24 @@ class Window (object):
 
     def add_model_filter (self, filter):
 
+        self.push_view_state ()
+        self.log_filter.add_filter (filter, dispatcher = self.filter_dispatcher)
+        self.show_filter_progress ()
+
+    def remove_model_filter (self, index):
+
+        self.push_view_state ()
+        self.log_filter.remove_filter (index, dispatcher = self.filter_dispatcher)
+        self.show_filter_progress ()
+
+    def show_filter_progress (self):
+
+        # Background jobs of the features wait for the filter dispatcher, so
+        # the view can keep its model meanwhile.
+
         self.progress_dialog = ProgressDialog (self, _("Filtering"))
         self.show_info (self.progress_dialog.widget)
         self.progress_dialog.handle_cancel = self.handle_filter_progress_dialog_cancel
-        dispatcher = Common.Data.GSourceDispatcher ()
-        self.filter_dispatcher = dispatcher
-
-        # FIXME: Unsetting the model to keep e.g. the dispatched timeline
-        # sentinel from collecting data while we filter idly, which slows
-        # things down for nothing.
-        self.push_view_state ()
-        self.log_view.set_model (None)
-        self.log_filter.add_filter (filter, dispatcher = dispatcher)
 
         gobject.timeout_add (250, self.update_filter_progress)
 
@@ -734,14 +863,27 @@ class Window (object):
         self.hide_info ()
         self.progress_dialog = None
 
-        # No push_view_state here, did this in add_model_filter.
+        # No push_view_state here, it was done before the process started.
         self.update_model (self.log_filter)
         self.pop_view_state ()
 
         self.actions.show_hidden_lines.props.sensitive = True
+        self.actions.remove_last_filter.props.sensitive = bool (self.log_filter.filters)
+
+        self.set_sensitive (True)
+
+    def handle_log_filter_process_failed (self, exc):
+
+        self.hide_info ()
+        self.progress_dialog = None
+
+        self.log_view.set_model (self.log_filter)
+        self.pop_view_state ()
 
         self.set_sensitive (True)
 
+        self.show_error (_("Filtering failed:"), str (exc))
+
     @action
     def handle_set_base_time_action_activate (self, action):
 
@@ -769,6 +911,13 @@ class Window (object):
         object_ = row[LogModelBase.COL_OBJECT]
         self.add_model_filter (ObjectFilter (object_))
 
+    @action
+    def handle_show_only_log_object_action_activate (self, action):
+
+        row = self.get_active_line ()
+        object_ = row[LogModelBase.COL_OBJECT]
+        self.add_model_filter (ObjectFilter (object_, show_only = True))
+
     @action
     def handle_hide_filename_action_activate (self, action):
 
@@ -776,6 +925,53 @@ class Window (object):
         filename = row[LogModelBase.COL_FILENAME]
         self.add_model_filter (FilenameFilter (filename))
 
+    @action
+    def handle_filter_expression_action_activate (self, action):
+
+        dialog = gtk.Dialog (_("Filter by Expression"), self.gtk_window,
+                             gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+                             (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                              gtk.STOCK_OK, gtk.RESPONSE_ACCEPT,))
+        dialog.set_default_response (gtk.RESPONSE_ACCEPT)
+        label = gtk.Label (_("Show only the lines matching, for example:\n"
+                             "level>=WARN and category in (v4l2src, queue) and not object=~\"sink\""))
+        label.props.xalign = 0.
+        entry = gtk.Entry ()
+        entry.props.activates_default = True
+        if self.last_filter_expression is not None:
+            entry.props.text = self.last_filter_expression
+        box = gtk.VBox (spacing = 6)
+        box.props.border_width = 6
+        box.pack_start (label, False, False, 0)
+        box.pack_start (entry, False, False, 0)
+        dialog.vbox.pack_start (box, False, False, 0)
+        dialog.show_all ()
+
+        response = dialog.run ()
+        expression = entry.props.text
+        dialog.destroy ()
+        if response != gtk.RESPONSE_ACCEPT or not expression.strip ():
+            return
+
+        self.last_filter_expression = expression
+        try:
+            log_filter = ExpressionFilter (expression)
+        except FilterExpressionError as exc:
+            self.show_error (_("Invalid filter expression:"), str (exc))
+            return
+
+        self.add_model_filter (log_filter)
+
+    @action
+    def handle_remove_last_filter_action_activate (self, action):
+
+        filters = self.log_filter.filters
+        if not filters:
+            return
+
+        self.logger.info ("removing filter %r", filters[-1])
+        self.remove_model_filter (len (filters) - 1)
+
     @action
     def handle_show_about_action_activate (self, action):
 
@@ -804,10 +1000,13 @@ class Window (object):
             for feature in self.features:
                 feature.handle_detach_log_file (self, self.log_file)
 
-        if filename is None:
-            if self.dispatcher is not None:
-                self.dispatcher.cancel ()
+        self.follow_updating = False
+
+        if self.dispatcher is not None:
+            self.dispatcher.cancel ()
             self.dispatcher = None
+
+        if filename is None:
             self.log_file = None
             self.actions.groups["RowActions"].props.sensitive = False
         else:
@@ -816,8 +1015,13 @@ class Window (object):
             try:
                 self.setup_model (LazyLogModel ())
 
-                self.dispatcher = Common.Data.GSourceDispatcher ()
-                self.log_file = Data.LogFile (filename, self.dispatcher)
+                # Loading and indexing does not touch the UI, so it can run
+                # in a worker thread:
+                self.dispatcher = Common.Data.ThreadDispatcher ()
+                self.log_file = Data.LogFile (filename, self.dispatcher,
+                                              index_cache = self.app.index_cache,
+                                              workers = cpu_count (),
+                                              parse_columns = self.actions.parse_all_fields.props.active)
             except EnvironmentError as exc:
                 try:
                     file_size = os.path.getsize (filename)
@@ -899,6 +1103,8 @@ class Window (object):
         self.actions.reload_file.props.sensitive = True
         self.actions.groups["RowActions"].props.sensitive = True
         self.actions.show_hidden_lines.props.sensitive = False
+        self.actions.show_hidden_range.props.sensitive = False
+        self.actions.remove_last_filter.props.sensitive = False
 
         self.set_sensitive (True)
 
@@ -918,3 +1124,22 @@ class Window (object):
             return False
 
         gobject.idle_add (idle_set)
+
+    def handle_columns_ready (self):
+
+        self.logger.debug ("all fields parsed, switching model over")
+
+        self.log_model.set_columns (self.log_file.columns)
+
+    def handle_lines_added (self, line_indices):
+
+        self.logger.debug ("%i lines added to the log file", len (line_indices))
+
+        self.follow_updating = False
+
+        self.log_model.handle_lines_added (line_indices)
+        self.log_filter.handle_super_lines_added (line_indices)
+
+        line_model = self.line_view.line_view.get_model ()
+        if line_model is not None:
+            line_model.handle_super_lines_added (line_indices)
@@ -21,6 +21,7 @@
 
 from GstDebugViewer.Plugins import *
 import logging
+import gobject
 import gtk
 
 class FilePropertiesSentinel (object):
@@ -29,32 +30,126 @@ class FilePropertiesSentinel (object):
 
 class FilePropertiesDialog (gtk.Dialog):
 
-    pass
+    def __init__ (self, parent, log_file, line_count):
+
+        gtk.Dialog.__init__ (self, _("File Properties"), parent,
+                             gtk.DIALOG_DESTROY_WITH_PARENT,
+                             (gtk.STOCK_CLOSE, gtk.RESPONSE_CLOSE,))
+
+        self.set_default_size (400, 400)
+
+        table = gtk.Table (3, 2)
+        table.props.border_width = 6
+        table.props.column_spacing = 12
+        table.props.row_spacing = 6
+        size = len (log_file.fileobj)
+        for row, (name, value,) in enumerate ([(_("Location:"), log_file.path,),
+                                               (_("Size:"), _("%i bytes") % (size,),),
+                                               (_("Lines:"), str (line_count),)]):
+            label = gtk.Label (name)
+            label.props.xalign = 0.
+            table.attach (label, 0, 1, row, row + 1, gtk.FILL, 0)
+            label = gtk.Label (value)
+            label.props.xalign = 0.
+            label.props.selectable = True
+            table.attach (label, 1, 2, row, row + 1, gtk.FILL | gtk.EXPAND, 0)
+        self.vbox.pack_start (table, False, False, 0)
+
+        if log_file.columns is None:
+            label = gtk.Label (_("Category counts are available once all fields "
+                                 "are parsed."))
+            label.props.wrap = True
+            self.vbox.pack_start (label, False, False, 6)
+        else:
+            self.vbox.pack_start (self.__make_counts_view (log_file.columns),
+                                  True, True, 0)
+
+        self.vbox.show_all ()
+
+    @staticmethod
+    def __make_counts_view (columns):
+
+        store = gtk.ListStore (str, gobject.TYPE_UINT64)
+        counts = columns.get_counts ("categories")
+        for category, count in sorted (counts.iteritems (),
+                                       key = lambda item: -item[1]):
+            store.append ((category, count,))
+
+        view = gtk.TreeView (store)
+        for col_id, title in ((0, _("Category"),), (1, _("Lines"),),):
+            column = gtk.TreeViewColumn (title, gtk.CellRendererText (), text = col_id)
+            column.props.sort_column_id = col_id
+            view.append_column (column)
+
+        scrolled = gtk.ScrolledWindow ()
+        scrolled.props.hscrollbar_policy = gtk.POLICY_AUTOMATIC
+        scrolled.props.vscrollbar_policy = gtk.POLICY_AUTOMATIC
+        scrolled.props.shadow_type = gtk.SHADOW_IN
+        scrolled.add (view)
+
+        return scrolled
 
 class FilePropertiesFeature (FeatureBase):
 
-    def __init__ (self, *a, **kw):
+    def __init__ (self, app):
+
+        FeatureBase.__init__ (self, app)
+
+        self.logger = logging.getLogger ("ui.fileproperties")
 
         self.action_group = gtk.ActionGroup ("FilePropertiesActions")
         self.action_group.add_actions ([("show-file-properties", gtk.STOCK_PROPERTIES,
                                          _("_Properties"), "<Ctrl>P")])
+        self.action_group.props.sensitive = False
+
+        self.merge_ids = {}
+        self.log_files = {}
 
-    def attach (self, window):
+        handler = self.handle_action_activate
+        self.action_group.get_action ("show-file-properties").connect ("activate", handler)
+
+    def handle_attach_window (self, window):
 
         ui = window.ui_manager
         ui.insert_action_group (self.action_group, 0)
 
-        self.merge_id = ui.new_merge_id ()
-        ui.add_ui (self.merge_id, "/menubar/FileMenu/FileMenuAdditions",
+        merge_id = ui.new_merge_id ()
+        ui.add_ui (merge_id, "/menubar/AppMenu/AppMenuAdditions",
                    "FileProperties", "show-file-properties",
                    gtk.UI_MANAGER_MENUITEM, False)
+        self.merge_ids[window] = merge_id
 
-        handler = self.handle_action_activate
-        self.action_group.get_action ("show-file-properties").connect ("activate", handler)
+    def handle_detach_window (self, window):
+
+        ui = window.ui_manager
+        ui.remove_ui (self.merge_ids.pop (window))
+        ui.remove_action_group (self.action_group)
+        self.log_files.pop (window, None)
+
+    def handle_attach_log_file (self, window, log_file):
+
+        self.log_files[window] = log_file
+        self.action_group.props.sensitive = True
+
+    def handle_detach_log_file (self, window, log_file):
+
+        self.log_files.pop (window, None)
+        self.action_group.props.sensitive = bool (self.log_files)
 
     def handle_action_activate (self, action):
 
-        pass
+        for window, log_file in self.log_files.iteritems ():
+            if window.gtk_window.is_active ():
+                break
+        else:
+            if not self.log_files:
+                return
+            window, log_file = self.log_files.items ()[0]
+
+        dialog = FilePropertiesDialog (window.gtk_window, log_file,
+                                       len (window.log_model))
+        dialog.connect ("response", lambda dialog, response: dialog.destroy ())
+        dialog.show ()
 
 class Plugin (PluginBase):
 
@@ -19,7 +19,12 @@
 
 """GStreamer Debug Viewer timeline widget plugin."""
 
+from array import array
+from bisect import bisect_left, bisect_right
 import logging
+import re
+import sre_constants
+import sre_parse
 
 from GstDebugViewer import Common, Data, GUI
 from GstDebugViewer.Plugins import *
@@ -27,48 +32,217 @@ from GstDebugViewer.Plugins import *
 import glib
 import gtk
 
-class SearchOperation (object):
+def required_literal (pattern):
 
-    def __init__ (self, model, search_text, search_forward = True, start_position = None):
+    """Return the longest literal string that every match of the regular
+    expression pattern contains, or None."""
 
-        self.model = model
-        self.search_text = search_text
-        self.search_forward = search_forward
-        self.start_position = start_position
+    try:
+        parsed = sre_parse.parse (pattern)
+    except (re.error, RuntimeError,):
+        return None
+
+    best = ""
+    current = []
+    for op, arg in parsed:
+        if op == sre_constants.LITERAL and arg < 256:
+            current.append (chr (arg))
+            continue
+        if len (current) > len (best):
+            best = "".join (current)
+        current = []
+    if len (current) > len (best):
+        best = "".join (current)
+
+    return best or None
 
-        col_id = GUI.models.LogModelBase.COL_MESSAGE
-        len_search_text = len (search_text)
+class SearchQuery (object):
 
-        def match_func (model_row):
+    """Compiled find bar query.
 
-            message = model_row[col_id]
-            if search_text in message:
-                ranges = []
-                start = 0
-                while True:
-                    pos = message.find (search_text, start)
-                    if pos == -1:
+    The text consists of terms separated by " AND ", which all have to match,
+    and clauses of those separated by " OR ", of which one has to match.  A
+    term matches a row if it is found in any of the columns col_ids."""
+
+    def __init__ (self, text, regex = False, match_case = True, col_ids = None):
+
+        if col_ids is None:
+            col_ids = (GUI.models.LogModelBase.COL_MESSAGE,)
+
+        self.text = text
+        self.regex = regex
+        self.match_case = match_case
+        self.col_ids = tuple (col_ids)
+
+        if match_case:
+            flags = 0
+        else:
+            flags = re.IGNORECASE
+
+        self.clauses = []
+        # Term strings of each clause:
+        self.clause_terms = []
+        # Raw line data can only contain a match if it contains one of these
+        # strings (None if that cannot be told):
+        literals = set ()
+        for clause_text in text.split (" OR "):
+            terms = []
+            best = None
+            for term in clause_text.split (" AND "):
+                if not term:
+                    continue
+                if regex:
+                    # Raises re.error for invalid patterns:
+                    terms.append (re.compile (term, flags))
+                    literal = required_literal (term)
+                else:
+                    terms.append (re.compile (re.escape (term), flags))
+                    literal = term
+                if literal and (best is None or len (literal) > len (best)):
+                    best = literal
+            if not terms:
+                continue
+            self.clauses.append (terms)
+            self.clause_terms.append ([term for term in clause_text.split (" AND ")
+                                       if term])
+            if literals is not None:
+                if best is None:
+                    literals = None
+                else:
+                    literals.add (best)
+
+        if not self.clauses:
+            raise ValueError ("empty search query")
+
+        if literals is None:
+            self.literals = None
+        else:
+            self.literals = tuple (sorted (literals))
+        self.ignore_case = (not match_case or
+                            any (pattern.flags & re.IGNORECASE
+                                 for terms in self.clauses for pattern in terms))
+
+        col_ids = self.col_ids
+        clauses = self.clauses
+
+        def term_matches (pattern, row):
+            search = pattern.search
+            for col_id in col_ids:
+                if search (row[col_id]) is not None:
+                    return True
+            return False
+
+        def match_func (row):
+
+            for terms in clauses:
+                for pattern in terms:
+                    if not term_matches (pattern, row):
                         break
-                    ranges.append ((pos, pos + len_search_text,))
-                    start = pos + len_search_text
-                return ranges
-            else:
-                return ()
+                else:
+                    return True
+            return False
 
         self.match_func = match_func
 
+        message_id = GUI.models.LogModelBase.COL_MESSAGE
+        message_selected = message_id in col_ids
+
+        def highlight_func (row):
+
+            if not message_selected or not match_func (row):
+                return ()
+
+            message = row[message_id]
+            ranges = []
+            for terms in clauses:
+                for pattern in terms:
+                    for match in pattern.finditer (message):
+                        if match.end () > match.start ():
+                            ranges.append (match.span ())
+            if not ranges:
+                return ()
+
+            ranges.sort ()
+            merged = [ranges[0]]
+            for start, end in ranges[1:]:
+                prev_start, prev_end = merged[-1]
+                if start <= prev_end:
+                    merged[-1] = (prev_start, max (prev_end, end),)
+                else:
+                    merged.append ((start, end,))
+            return merged
+
+        self.highlight_func = highlight_func
+
+    def refines (self, other):
+
+        """Return True if every row matching this query is known to match the
+        other query, too."""
+
+        if (self.regex or other.regex or
+            self.match_case != other.match_case or
+            self.col_ids != other.col_ids or
+            len (self.clause_terms) != 1):
+            return False
+
+        if self.match_case:
+            fold = lambda s: s
+        else:
+            fold = lambda s: s.lower ()
+
+        new_terms = [fold (term) for term in self.clause_terms[0]]
+        # Each term of some old clause must be found within a new term:
+        for old_terms in other.clause_terms:
+            for old_term in old_terms:
+                old_term = fold (old_term)
+                if not any (old_term in term for term in new_terms):
+                    break
+            else:
+                return True
+
+        return False
+
+class SearchOperation (object):
+
+    def __init__ (self, model, query, search_forward = True, start_position = None,
+                  candidates = None, fileobj = None):
+
+        self.model = model
+        self.query = query
+        self.search_text = query.text
+        self.search_forward = search_forward
+        self.start_position = start_position
+        # Ascending sequence of the only row positions that can match, if
+        # known:
+        self.candidates = candidates
+        # If given, candidates are found by searching the raw file data:
+        self.fileobj = fileobj
+
+        self.match_func = query.match_func
+        self.highlight_func = query.highlight_func
+
 class SearchSentinel (object):
 
-    def __init__ (self):
+    def __init__ (self, dispatcher = None):
 
-        self.dispatcher = Common.Data.GSourceDispatcher ()
+        if dispatcher is None:
+            dispatcher = Common.Data.GSourceDispatcher ()
+        self.dispatcher = dispatcher
         self.cancelled = False
 
+        # File, search text and the offsets of all lines containing it, from
+        # the last raw data search:
+        self.line_offsets_key = None
+        self.line_offsets = None
+        # Rows of the model that belong to these lines:
+        self.candidates_key = None
+        self.candidates = None
+
     def run_for (self, operation):
 
         self.dispatcher.cancel ()
-        self.dispatcher (self.__process (operation))
         self.cancelled = False
+        self.dispatcher (self.__process (operation))
 
     def abort (self):
 
@@ -86,6 +260,21 @@ class SearchSentinel (object):
         else:
             start_pos = len (model) - 1
 
+        # Searching the raw file data needs a literal that every match
+        # contains, otherwise all rows are scanned:
+        if (operation.candidates is None and operation.fileobj is not None and
+            operation.query.literals is not None):
+            for x in self.__find_candidates (operation):
+                if self.cancelled:
+                    yield False
+                    return
+                yield True
+
+        if operation.candidates is not None:
+            for x in self.__process_candidates (operation, start_pos):
+                yield x
+            return
+
         start_iter = model.iter_nth_child (None, start_pos)
 
         match_func = operation.match_func
@@ -102,21 +291,98 @@ class SearchSentinel (object):
             def iter_next (it):
                 return it_.next ()
 
-        YIELD_LIMIT = 1000
-        i = YIELD_LIMIT
+        limit = Data.YieldLimit ()
+        i = limit.size
         tree_iter = start_iter
         while tree_iter and not self.cancelled:
             i -= 1
             if i == 0:
+                i = limit.end_batch ()
                 yield True
-                i = YIELD_LIMIT
+                limit.start_batch ()
             row = model[tree_iter]
             if match_func (row):
-                self.handle_match_found (model, tree_iter)
+                self.dispatcher.call (self.handle_match_found, model, tree_iter)
             tree_iter = iter_next (tree_iter)
 
         if not self.cancelled:
-            self.handle_search_complete ()
+            self.dispatcher.call (self.handle_search_complete)
+        yield False
+
+    def __find_candidates (self, operation):
+
+        # Search the mapped file for the literals of the query, which is a lot
+        # faster than parsing every row.  Rows of lines that contain one of
+        # them anywhere are candidates.
+
+        fileobj = operation.fileobj
+        query = operation.query
+        key = (fileobj, len (fileobj), query.literals, query.ignore_case,)
+        if key != self.line_offsets_key:
+            line_offsets = array (Data.OFFSET_TYPECODE)
+            for literal in query.literals:
+                for x in Data.find_line_offsets (fileobj, literal, line_offsets,
+                                                 ignore_case = query.ignore_case):
+                    yield True
+            if len (query.literals) > 1:
+                line_offsets = array (Data.OFFSET_TYPECODE,
+                                      sorted (set (line_offsets)))
+            self.line_offsets_key = key
+            self.line_offsets = line_offsets
+            self.candidates_key = None
+
+        # The rows of the model are in timestamp order, so the row of each
+        # line is found by bisection:
+        model = operation.model
+        key = (model, model.line_offsets, len (model), self.line_offsets,)
+        if key != self.candidates_key:
+            model_offsets = model.line_offsets
+            candidates = array ("I")
+            limit = Data.YieldLimit ()
+            i = limit.size
+            for line_offset in self.line_offsets:
+                position = Data.find_line_index (fileobj, model_offsets, line_offset)
+                if position != -1:
+                    candidates.append (position)
+                i -= 1
+                if i == 0:
+                    i = limit.end_batch ()
+                    yield True
+                    limit.start_batch ()
+            # Lines in file order are mostly, but not always, in row order:
+            self.candidates = array ("I", sorted (candidates))
+            self.candidates_key = key
+
+        operation.candidates = self.candidates
+
+    def __process_candidates (self, operation, start_pos):
+
+        model = operation.model
+        candidates = operation.candidates
+        if operation.search_forward:
+            positions = candidates[bisect_left (candidates, start_pos):]
+        else:
+            positions = candidates[:bisect_right (candidates, start_pos)][::-1]
+
+        match_func = operation.match_func
+        nth_child = model.iter_nth_child
+
+        limit = Data.YieldLimit ()
+        i = limit.size
+        for position in positions:
+            if self.cancelled:
+                break
+            i -= 1
+            if i == 0:
+                i = limit.end_batch ()
+                yield True
+                limit.start_batch ()
+            tree_iter = nth_child (None, int (position))
+            if match_func (model[tree_iter]):
+                self.dispatcher.call (self.handle_match_found, model, tree_iter)
+
+        if not self.cancelled:
+            self.dispatcher.call (self.handle_search_complete)
         yield False
 
     def handle_match_found (self, model, tree_iter):
@@ -130,7 +396,19 @@ class SearchSentinel (object):
 class FindBarWidget (gtk.HBox):
 
     __status = {"no-match-found" : _N("No match found"),
-                "searching" : _N("Searching...")}
+                "searching" : _N("Searching..."),
+                "invalid-pattern" : _N("Invalid pattern"),
+                "match-position" : _N("Match %i of %i"),
+                "match-count" : _N("Matches: %i")}
+
+    __model = GUI.models.LogModelBase
+    search_columns = ((_N("Message"), (__model.COL_MESSAGE,),),
+                      (_N("Category"), (__model.COL_CATEGORY,),),
+                      (_N("Object"), (__model.COL_OBJECT,),),
+                      (_N("Function"), (__model.COL_FUNCTION,),),
+                      (_N("All Columns"), (__model.COL_MESSAGE, __model.COL_CATEGORY,
+                                           __model.COL_OBJECT, __model.COL_FUNCTION,
+                                           __model.COL_FILENAME,),),)
 
     def __init__ (self, action_group):
 
@@ -152,6 +430,22 @@ class FindBarWidget (gtk.HBox):
         next_action.connect_proxy (next_button)
         self.pack_start (next_button, False, False, 0)
 
+        self.match_case_button = gtk.CheckButton (_("Match case"))
+        self.match_case_button.props.active = True
+        self.pack_start (self.match_case_button, False, False, 2)
+
+        self.regex_button = gtk.CheckButton (_("Regular expression"))
+        self.pack_start (self.regex_button, False, False, 2)
+
+        label = gtk.Label (_("In:"))
+        self.pack_start (label, False, False, 2)
+
+        self.columns_combo = gtk.combo_box_new_text ()
+        for name, column_names in self.search_columns:
+            self.columns_combo.append_text (_(name))
+        self.columns_combo.props.active = 0
+        self.pack_start (self.columns_combo, False, False, 0)
+
         self.status_label = gtk.Label ()
         self.status_label.props.xalign = 0.
         self.status_label.props.use_markup = True
@@ -169,7 +463,8 @@ class FindBarWidget (gtk.HBox):
         max_width = 0
         try:
             for status in self.__status.values ():
-                self.__set_status (_(status))
+                # Leave room for large counts:
+                self.__set_status (_(status).replace ("%i", "9999999"))
                 width, height = label.size_request ()
                 max_width = max (max_width, width)
             label.set_size_request (max_width, -1)
@@ -194,6 +489,22 @@ class FindBarWidget (gtk.HBox):
 
         self.__set_status (_(self.__status["searching"]))
 
+    def status_invalid_pattern (self):
+
+        self.__set_status (_(self.__status["invalid-pattern"]))
+
+    def status_match_position (self, position, count):
+
+        self.__set_status (_(self.__status["match-position"]) % (position, count,))
+
+    def status_match_count (self, count):
+
+        self.__set_status (_(self.__status["match-count"]) % (count,))
+
+    def get_search_col_ids (self):
+
+        return self.search_columns[self.columns_combo.props.active][1]
+
     def clear_status (self):
 
         self.__set_status ("")
@@ -220,15 +531,31 @@ class FindBarFeature (FeatureBase):
 
         self.bar = None
         self.operation = None
-        self.search_state = None
-        self.next_match = None
-        self.prev_match = None
+        # Ascending line indices of all matches of the current operation,
+        # filled in the background:
+        self.matches = array ("I")
+        self.matches_complete = False
+        self.matches_model_size = None
+        self.current_match = None
         self.scroll_match = False
+        self.scroll_start = 0
+        self.pending_next = False
+        # Position in front of which to go to the previous match, once
+        # counting gets that far:
+        self.pending_previous = None
+        # Model that matches are kept up to date for as rows get inserted:
+        self.watched_model = None
+        self.row_inserted_id = None
 
         self.sentinel = SearchSentinel ()
         self.sentinel.handle_match_found = self.handle_match_found
         self.sentinel.handle_search_complete = self.handle_search_complete
 
+        self.log_file = None
+        self.index_dispatcher = Common.Data.GSourceDispatcher ()
+        self.candidates_key = None
+        self.candidates = None
+
     def scroll_view_to_line (self, line_index):
 
         view = self.log_view
@@ -254,6 +581,11 @@ class FindBarFeature (FeatureBase):
 
         self.log_view = window.log_view
 
+        scheduler = window.scheduler
+        self.sentinel.dispatcher = scheduler.dispatcher (after = (window.filter_dispatcher,),
+                                                         view = self.log_view)
+        self.index_dispatcher = scheduler.dispatcher (scheduler.PRIORITY_LOW)
+
         self.merge_id = ui.new_merge_id ()
         for name, action_name in [("ViewFindBar", "show-find-bar",),
                                   ("ViewNextResult", "goto-next-search-result",),
@@ -280,7 +612,11 @@ class FindBarFeature (FeatureBase):
         action.props.sensitive = False
         action.connect ("activate", handler)
 
+        self.log_view.connect ("notify::model", self.handle_log_view_notify_model)
         self.bar.entry.connect ("changed", self.handle_entry_changed)
+        self.bar.match_case_button.connect ("toggled", self.handle_option_changed)
+        self.bar.regex_button.connect ("toggled", self.handle_option_changed)
+        self.bar.columns_combo.connect ("changed", self.handle_option_changed)
 
     def handle_detach_window (self, window):
 
@@ -289,6 +625,68 @@ class FindBarFeature (FeatureBase):
         window.ui_manager.remove_ui (self.merge_id)
         self.merge_id = None
 
+    def handle_attach_log_file (self, window, log_file):
+
+        self.log_file = log_file
+
+    def handle_detach_log_file (self, window, log_file):
+
+        self.index_dispatcher.cancel ()
+        log_file.abort_trigram_index ()
+        self.log_file = None
+        self.candidates_key = None
+        self.candidates = None
+        self.sentinel.line_offsets_key = None
+        self.sentinel.line_offsets = None
+        self.sentinel.candidates_key = None
+        self.sentinel.candidates = None
+
+    def get_candidates (self, model, query):
+
+        # Rows that can match according to the trigram index, which is built
+        # (or updated for a grown file) on first use.  The index is case
+        # sensitive and only knows about trigrams.
+
+        log_file = self.log_file
+        if log_file is None:
+            return None
+
+        literals = query.literals
+        if (literals is None or query.ignore_case or
+            min (len (literal) for literal in literals) < 3):
+            return None
+
+        index = log_file.trigram_index
+        if index is None or index.size != len (log_file.fileobj):
+            log_file.start_trigram_index (self.index_dispatcher)
+        if index is None:
+            return None
+
+        key = (model, model.line_offsets, len (model), literals, index,)
+        if key != self.candidates_key:
+            line_offsets = GUI.models.numpy_values (model.line_offsets)
+            candidates = None
+            for literal in literals:
+                found = index.find_candidates (literal, line_offsets)
+                if found is None:
+                    candidates = None
+                    break
+                if candidates is None:
+                    candidates = found
+                else:
+                    candidates = GUI.models.numpy.union1d (candidates, found)
+            self.candidates = candidates
+            self.candidates_key = key
+
+        return self.candidates
+
+    def get_fileobj (self, model):
+
+        if self.log_file is None:
+            return None
+
+        return self.log_file.fileobj
+
     def handle_show_find_bar_action_toggled (self, action):
 
         if action.props.active:
@@ -301,6 +699,9 @@ class FindBarFeature (FeatureBase):
                 del column.highlighters[self]
             except KeyError:
                 pass
+            self.sentinel.abort ()
+            self.operation = None
+            self.watch_model (None)
             self.bar.clear_status ()
             self.bar.hide ()
             for action_name in ["goto-next-search-result",
@@ -309,169 +710,302 @@ class FindBarFeature (FeatureBase):
 
     def handle_goto_previous_search_result_action_activate (self, action):
 
-        if self.prev_match is None:
-            self.logger.warning ("inconsistent action sensitivity")
+        if not self.check_matches ():
             return
 
-        self.scroll_view_to_line (self.prev_match)
-        self.prev_match = None
+        if self.current_match is not None:
+            position = self.current_match
+        else:
+            position = self.log_view.get_visible_range ()[1][0] + 1
+
+        if not self.goto_match_before (position) and not self.matches_complete:
+            # Go there as soon as counting gets that far:
+            self.pending_previous = position
+            self.bar.status_searching ()
+
+    def goto_match_before (self, position):
+
+        # Counting goes forward, so every match in front of a found one is
+        # known already.
 
-        start_path = self.log_view.get_visible_range ()[0]
-        new_position = start_path[0] - 1
-        self.start_search_operation (start_position = new_position,
-                                     forward = False)
+        index = bisect_left (self.matches, position) - 1
+        if index < 0:
+            return False
+        if not self.matches_complete and index == len (self.matches) - 1:
+            # There might be more matches up to position.
+            return False
 
-        # FIXME
+        self.goto_match (self.matches[index])
+        return True
 
     def handle_goto_next_search_result_action_activate (self, action):
 
-        if self.next_match is None:
+        if not self.check_matches ():
+            return
+
+        if self.current_match is not None:
+            position = self.current_match
+        else:
+            position = self.log_view.get_visible_range ()[0][0] - 1
+
+        index = bisect_right (self.matches, position)
+        if index < len (self.matches):
+            self.goto_match (self.matches[index])
+        elif not self.matches_complete:
+            # Go there as soon as counting gets that far:
+            self.pending_next = True
+            self.scroll_start = position + 1
+            self.bar.status_searching ()
+
+    def goto_match (self, line_index):
+
+        self.logger.debug ("going to match in line %i", line_index)
+        self.current_match = line_index
+        self.pending_next = False
+        self.pending_previous = None
+        self.scroll_view_to_line (line_index)
+        self.update_sensitivity ()
+        self.update_status ()
+
+    def check_matches (self):
+
+        # Restart counting if the rows of the view changed since it started.
+
+        if self.operation is None:
             self.logger.warning ("inconsistent action sensitivity")
+            return False
+
+        model = self.log_view.get_model ()
+        if model is None:
+            return False
+
+        if model is not self.operation.model or len (model) != self.matches_model_size:
+            self.logger.debug ("view rows changed, counting matches again")
+            self.start_search_operation (scroll = False)
+
+        return True
+
+    def watch_model (self, model):
+
+        if model is self.watched_model:
             return
 
-        self.scroll_view_to_line (self.next_match)
-        self.next_match = None
+        if self.watched_model is not None:
+            self.watched_model.disconnect (self.row_inserted_id)
+            self.row_inserted_id = None
 
-        end_path = self.log_view.get_visible_range ()[1]
-        new_position = end_path[0] + 1
-        self.start_search_operation (start_position = new_position,
-                                     forward = True)
-        # FIXME: Finish.
+        self.watched_model = model
+        if model is not None:
+            self.row_inserted_id = model.connect ("row-inserted",
+                                                  self.handle_model_row_inserted)
 
-        ## model = self.log_view.get_model ()
+    def handle_model_row_inserted (self, model, path, tree_iter):
 
-        ## start_path, end_path = self.log_view.get_visible_range ()
-        ## start_index, end_index = start_path[0], end_path[0]
+        # Keeps the matches up to date for rows that are added while
+        # following the file, instead of counting all over again.  Rows that
+        # are inserted while counting cause a restart (see check_matches).
 
-        ## for line_index in self.matches:
-        ##     if line_index > end_index:
-        ##         break
-        ## else:
-        ##     return
+        if self.operation is None or not self.matches_complete:
+            return
+
+        position = path[0]
+        matches = self.matches
+        index = bisect_left (matches, position)
+        if index < len (matches):
+            matches[index:] = array ("I", (i + 1 for i in matches[index:]))
+        if self.current_match is not None and self.current_match >= position:
+            self.current_match += 1
+        self.matches_model_size += 1
+
+        if self.operation.match_func (model[tree_iter]):
+            matches.insert (index, position)
+            self.update_sensitivity ()
+            self.update_status ()
 
-        ## self.scroll_view_to_line (line_index)
+    def handle_log_view_notify_model (self, view, pspec):
+
+        if self.operation is None or view.props.model is None:
+            return
+
+        self.start_search_operation (scroll = False)
 
     def handle_entry_changed (self, entry):
 
         self.update_search ()
 
+    def handle_option_changed (self, widget):
+
+        if self.bar.entry.props.text:
+            self.update_search ()
+
+    def get_query (self, search_text):
+
+        return SearchQuery (search_text,
+                            regex = self.bar.regex_button.props.active,
+                            match_case = self.bar.match_case_button.props.active,
+                            col_ids = self.bar.get_search_col_ids ())
+
     def update_search (self):
 
-        model = self.log_view.get_model ()
         search_text = self.bar.entry.props.text
         column = self.window.column_manager.find_item (name = "message")
+
+        query = None
         if search_text == "":
             self.logger.debug ("search string set to '', aborting search")
-            self.search_state = None
-            self.next_match = None
-            self.prev_match = None
-            self.update_sensitivity ()
+        else:
+            try:
+                query = self.get_query (search_text)
+            except (re.error, ValueError,) as exc:
+                self.logger.debug ("invalid search pattern %r: %s", search_text, exc)
+                self.bar.status_invalid_pattern ()
+
+        if query is None:
             self.sentinel.abort ()
+            self.operation = None
+            self.watch_model (None)
+            self.matches = array ("I")
+            self.matches_complete = False
+            self.current_match = None
+            self.pending_next = False
+            self.pending_previous = None
+            self.update_sensitivity ()
             try:
                 del column.highlighters[self]
             except KeyError:
                 pass
         else:
             self.logger.debug ("starting search for %r", search_text)
-            self.next_match = None
-            self.prev_match = None
-            self.update_sensitivity ()
-            self.scroll_match = True
-
-            start_path = self.log_view.get_visible_range ()[0]
-            self.start_search_operation (search_text, start_position = start_path[0])
-            self.bar.status_searching ()
-            column.highlighters[self] = self.operation.match_func
+            self.start_search_operation (query, candidates = self.get_refine_candidates (query))
+            column.highlighters[self] = query.highlight_func
 
         self.window.update_view ()
 
-    def update_sensitivity (self):
+    def get_refine_candidates (self, query):
 
-        for name, value in (("goto-next-search-result", self.next_match,),
-                            ("goto-previous-search-result", self.prev_match,),):
-            action = self.action_group.get_action (name)
-            action.props.sensitive = (value is not None)
+        # If the query only narrows down the previous one (typically because
+        # the user typed another character), only rows that matched before
+        # need to be checked again.
 
-    def start_search_operation (self, search_text = None, forward = True, start_position = None):
+        operation = self.operation
+        if operation is None or not query.refines (operation.query):
+            return None
 
         model = self.log_view.get_model ()
+        if model is not operation.model or len (model) != self.matches_model_size:
+            return None
 
-        if forward:
-            self.search_state = "search-forward"
-            if start_position is None:
-                start_position = 0
+        if self.matches_complete:
+            self.logger.debug ("refining %i previous matches", len (self.matches))
+            return self.matches
         else:
-            self.search_state = "search-backward"
-            if start_position is None:
-                start_position = len (model) - 1
+            return operation.candidates
+
+    def update_sensitivity (self):
+
+        matches = self.matches
+        if self.operation is None:
+            have_next = have_prev = False
+        elif self.current_match is None:
+            have_next = bool (matches) or not self.matches_complete
+            have_prev = bool (matches)
+        else:
+            have_next = (bisect_right (matches, self.current_match) < len (matches) or
+                         not self.matches_complete)
+            have_prev = bisect_left (matches, self.current_match) > 0
+
+        for name, value in (("goto-next-search-result", have_next,),
+                            ("goto-previous-search-result", have_prev,),):
+            action = self.action_group.get_action (name)
+            action.props.sensitive = value
+
+    def update_status (self):
+
+        if not self.matches_complete:
+            self.bar.status_searching ()
+        elif not self.matches:
+            self.bar.status_no_match_found ()
+        elif self.current_match is None:
+            self.bar.status_match_count (len (self.matches))
+        else:
+            position = bisect_left (self.matches, self.current_match) + 1
+            self.bar.status_match_position (position, len (self.matches))
+
+    def start_search_operation (self, query = None, scroll = True, candidates = None):
+
+        # Collect all matches of the query in the current view rows.  With
+        # scroll, the view goes to the first match after the top visible row
+        # once it is found.  If given, only the rows candidates are checked.
 
-        if search_text is None:
+        model = self.log_view.get_model ()
+
+        if query is None:
             operation = self.operation
             if operation is None:
-                raise ValueError ("search_text not given but have no previous search operation")
-            search_text = operation.search_text
+                raise ValueError ("query not given but have no previous search operation")
+            query = operation.query
+
+        self.matches = array ("I")
+        self.matches_complete = False
+        self.matches_model_size = len (model)
+        self.current_match = None
+        self.pending_next = False
+        self.pending_previous = None
+        self.scroll_match = scroll
+        if scroll:
+            visible_range = self.log_view.get_visible_range ()
+            if visible_range is None:
+                self.scroll_start = 0
+            else:
+                self.scroll_start = visible_range[0][0]
 
-        self.operation = SearchOperation (model, search_text,
-                                          start_position = start_position,
-                                          search_forward = forward)
+        if candidates is None:
+            candidates = self.get_candidates (model, query)
+
+        self.operation = SearchOperation (model, query,
+                                          start_position = 0,
+                                          search_forward = True,
+                                          candidates = candidates,
+                                          fileobj = self.get_fileobj (model))
+        self.watch_model (model)
         self.sentinel.run_for (self.operation)
 
-    def handle_match_found (self, model, tree_iter):
+        self.update_sensitivity ()
+        self.update_status ()
 
-        if not self.search_state in ("search-forward", "search-backward",):
-            self.logger.warning ("inconsistent search state %r", self.search_state)
-            return
+    def handle_match_found (self, model, tree_iter):
 
         line_index = model.get_path (tree_iter)[0]
-        forward_search = (self.search_state == "search-forward")
-
-        if forward_search:
-            self.logger.debug ("forward search for %r matches line %i",
-                               self.operation.search_text, line_index)
-        else:
-            self.logger.debug ("backward search for %r matches line %i",
-                               self.operation.search_text, line_index)
-
-        self.sentinel.abort ()
+        self.matches.append (line_index)
 
-        if self.scroll_match:
-            self.logger.debug ("scrolling to matching line")
-            self.scroll_view_to_line (line_index)
-            # Now search for the next one:
+        if (self.scroll_match or self.pending_next) and line_index >= self.scroll_start:
             self.scroll_match = False
-            # FIXME: Start with first line that is outside of the visible range.
-            self.start_search_operation (start_position = line_index + 1,
-                                         forward = forward_search)
-        else:
-            if forward_search:
-                self.next_match = line_index
-
-                self.search_state = "search-backward"
-                self.start_search_operation (forward = False,
-                                             start_position = line_index - 1)
-            else:
-                self.prev_match = line_index
-                self.update_sensitivity ()
-                self.bar.clear_status ()
+            self.goto_match (line_index)
+        elif (self.pending_previous is not None and
+              line_index >= self.pending_previous and
+              self.goto_match_before (self.pending_previous)):
+            pass
+        elif len (self.matches) == 1:
+            self.update_sensitivity ()
 
     def handle_search_complete (self):
 
-        if self.search_state == "search-forward":
-            self.logger.debug ("forward search for %r reached last line",
-                               self.operation.search_text)
-            self.next_match = None
-        elif self.search_state == "search-backward":
-            self.logger.debug ("backward search for %r reached first line",
-                               self.operation.search_text)
-            self.prev_match = None
-        else:
-            self.logger.warning ("inconsistent search state %r",
-                                 self.search_state)
-            return
+        self.logger.debug ("search for %r found %i matches",
+                           self.operation.search_text, len (self.matches))
+
+        self.matches_complete = True
+        if self.scroll_match and self.matches:
+            # Nothing after the top visible row, wrap around:
+            self.scroll_match = False
+            self.goto_match (self.matches[0])
+        elif self.pending_previous is not None:
+            self.goto_match_before (self.pending_previous)
+        self.scroll_match = False
+        self.pending_next = False
+        self.pending_previous = None
 
         self.update_sensitivity ()
-        if self.prev_match is None and self.next_match is None:
-            self.bar.status_no_match_found ()
+        self.update_status ()
 
 class Plugin (PluginBase):
 
@@ -19,8 +19,15 @@
 
 """GStreamer Debug Viewer timeline widget plugin."""
 
+from bisect import bisect_left
+from itertools import izip
 import logging
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from GstDebugViewer import Common, Data
 from GstDebugViewer.GUI.colors import LevelColorThemeTango, ThreadColorThemeTango
 from GstDebugViewer.Plugins import *
@@ -29,214 +36,176 @@ import gobject
 import gtk
 import cairo
 
-def iter_model_reversed (model):
+class LineFrequencySentinel (object):
 
-    count = model.iter_n_children (None)
-    for i in xrange (count - 1, 0, -1):
-        yield model[i]
+    """Line counts and level distribution of the rows of a model in
+    n_partitions equal spans of time.  The process prepares the timestamps
+    and level counts of the rows once, after which partition can split any
+    time range into any number of spans in O(n_partitions)."""
 
-class LineFrequencySentinel (object):
+    stacked_levels = (Data.debug_level_trace,
+                      Data.debug_level_fixme,
+                      Data.debug_level_log,
+                      Data.debug_level_debug,
+                      Data.debug_level_info,)
+    indicator_levels = (Data.debug_level_warning,
+                        Data.debug_level_error,)
 
     def __init__ (self, model):
 
         self.model = model
+        self.pyramid = None
+        self.log_ts_range = None
         self.clear ()
 
     def clear (self):
 
         self.data = None
+        self.level_data = None
+        self.stacks = None
+        self.indicators = None
         self.n_partitions = None
         self.partitions = None
         self.step = None
         self.ts_range = None
 
-    def _search_ts (self, target_ts, first_index, last_index):
+    def run_for (self, n, ts_range = None):
 
-        model_get = self.model.get_value
-        model_iter_nth_child = self.model.iter_nth_child
-        col_id = self.model.COL_TIME
-
-        # TODO: Rewrite using a lightweight view object + bisect.
-
-        while True:
-            middle = (last_index - first_index) // 2 + first_index
-            if middle == first_index:
-                return first_index
-            ts = model_get (model_iter_nth_child (None, middle), col_id)
-            if ts < target_ts:
-                first_index = middle
-            elif ts > target_ts:
-                last_index = middle
-            else:
-                return middle
-
-    def run_for (self, n):
+        """Set the number of partitions, and the time range to partition
+        (default is the whole log)."""
 
         if n == 0:
             raise ValueError ("illegal value for n")
 
         self.n_partitions = n
+        self.ts_range = ts_range
 
     def process (self):
 
         model = self.model
-        result = []
-        partitions = []
 
-        first_ts = None
-        for row in self.model:
-            first_ts = row[model.COL_TIME]
-            if first_ts is not None:
-                break
-
-        if first_ts is None:
-            return
+        for x in model.update_line_times ():
+            yield True
+        for x in model.update_level_counts ():
+            yield True
 
-        last_ts = None
-        i = 0
-        UNPARSABLE_LIMIT = 500
-        for row in iter_model_reversed (self.model):
-            last_ts = row[model.COL_TIME]
-            # FIXME: We ignore 0 here (unparsable lines!), this should be
-            # handled differently!
-            i += 1
-            if i == UNPARSABLE_LIMIT:
-                break
-            if last_ts:
-                last_index = row.path[0]
-                break
-
-        if last_ts is None or last_ts < first_ts:
+        times = model.line_times
+        if not times or times[-1] < times[0]:
             return
 
-        step = int (float (last_ts - first_ts) / float (self.n_partitions))
-
-        YIELD_LIMIT = 100
-        limit = YIELD_LIMIT
-
-        first_index = 0
-        target_ts = first_ts + step
-        old_found = 0
-        while target_ts < last_ts:
-            limit -= 1
-            if limit == 0:
-                limit = YIELD_LIMIT
+        if numpy is not None:
+            pyramid = Data.TimePyramid ()
+            for x in pyramid.build (times, model.level_counts.levels):
                 yield True
-            found = self._search_ts (target_ts, first_index, last_index)
-            result.append (found - old_found)
-            partitions.append (found)
-            old_found = found
-            first_index = found
-            target_ts += step
-
-        if step == 0:
-            result = []
+            self.pyramid = pyramid
+
+        self.log_ts_range = (int (times[0]), int (times[-1]),)
+        self.partition ()
+
+    def is_ready (self):
+
+        # The model drops its line times and level counts when rows change:
+        return (self.log_ts_range is not None and
+                self.model.line_times is not None and
+                self.model.level_counts is not None)
+
+    def partition (self):
+
+        if self.ts_range is None:
+            self.ts_range = self.log_ts_range
+        first_ts, last_ts = self.ts_range
+        n = self.n_partitions
+        step = float (last_ts + 1 - first_ts) / n
+        times = self.model.line_times
+
+        # The rows are in timestamp order, so the partition boundaries are a
+        # binary search in the timestamp array:
+        edges = [first_ts + int (step * i) for i in range (n)] + [last_ts + 1]
+        if numpy is not None:
+            values = numpy.frombuffer (times, dtype = times.typecode)
+            partitions = values.searchsorted (numpy.array (edges, dtype = values.dtype))
+            partitions = partitions.tolist ()
+        else:
             partitions = []
+            found = 0
+            for edge in edges:
+                found = bisect_left (times, edge, found)
+                partitions.append (found)
+
+        # Sum up the buckets of the pyramid, unless the spans are narrower
+        # than its resolution:
+        pyramid = self.pyramid
+        if pyramid is not None and step >= pyramid.resolution:
+            level_data = pyramid.histogram (first_ts, last_ts + 1, n)
+            # The buckets at the ends can reach out of the time range, so
+            # the lines of the first and last span are counted exactly:
+            level_counts = self.model.level_counts
+            level_data[0] = level_counts.partition_counts (partitions[:2])[0]
+            level_data[-1] = level_counts.partition_counts (partitions[-2:])[0]
+        else:
+            level_data = self.model.level_counts.partition_counts (partitions)
 
         self.step = step
-        self.data = result
         self.partitions = partitions
-        self.ts_range = (first_ts, last_ts,)
-
-class LevelDistributionSentinel (object):
-
-    def __init__ (self, freq_sentinel, model):
-
-        self.freq_sentinel = freq_sentinel
-        self.model = model
-        self.data = []
-
-    def clear (self):
-
-        del self.data[:]
-
-    def process (self):
-
-        MAX_LEVELS = 8
-        YIELD_LIMIT = 10000
-        y = YIELD_LIMIT
-
-        model_get = self.model.get_value
-        model_next = self.model.iter_next
-        id_time = self.model.COL_TIME
-        id_level = self.model.COL_LEVEL
-        del self.data[:]
-        data = self.data
-        i = 0
-        partitions_i = 0
-        partitions = self.freq_sentinel.partitions
-        counts = [0] * MAX_LEVELS
-        tree_iter = self.model.get_iter_first ()
-
-        if not partitions:
-            return
-
-        level_index = 0
-        level_iter = None
-
-        finished = False
-        while tree_iter:
-            y -= 1
-            if y == 0:
-                y = YIELD_LIMIT
-                yield True
-            if level_iter is None:
-                stop_index = level_index + 512
-                levels = self.model.get_value_range (id_level,
-                                                     level_index, stop_index)
-                level_index = stop_index
-                level_iter = iter (levels)
-            try:
-                level = level_iter.next ()
-            except StopIteration:
-                level_iter = None
-                continue
-            while i > partitions[partitions_i]:
-                data.append (tuple (counts))
-                counts = [0] * MAX_LEVELS
-                partitions_i += 1
-                if partitions_i == len (partitions):
-                    finished = True
-                    break
-            if finished:
-                break
-            counts[level] += 1
-            i += 1
-
-        # Now handle the last one:
-        data.append (tuple (counts))
-
-        yield False
+        self.level_data = level_data
+        self.data = [sum (counts) for counts in level_data]
+        self.__update_stacks ()
+
+    def __update_stacks (self):
+
+        # The level graphs are drawn on top of each other, from the sum of
+        # all stacked levels down to the bottom one:
+        stack = []
+        indicators = {}
+        level_data = self.level_data
+        if numpy is not None:
+            counts = numpy.array (level_data, dtype = numpy.int64)
+            counts.shape = (len (level_data), len (Data.debug_levels),)
+            cumulative = counts[:, list (self.stacked_levels)].cumsum (axis = 1)
+            for i, level in enumerate (self.stacked_levels):
+                stack.append ((level, cumulative[:, i].tolist (),))
+            for level in self.indicator_levels:
+                indicators[level] = numpy.flatnonzero (counts[:, level]).tolist ()
+        else:
+            cumulative = [0] * len (level_data)
+            for level in self.stacked_levels:
+                cumulative = [total + counts[level]
+                              for total, counts in izip (cumulative, level_data)]
+                stack.append ((level, cumulative,))
+            for level in self.indicator_levels:
+                indicators[level] = [i for i, counts in enumerate (level_data)
+                                     if counts[level]]
+        stack.reverse ()
+
+        self.stacks = stack
+        self.indicators = indicators
 
 class UpdateProcess (object):
 
-    def __init__ (self, freq_sentinel, dist_sentinel):
+    def __init__ (self, freq_sentinel, dispatcher = None):
 
         self.freq_sentinel = freq_sentinel
-        self.dist_sentinel = dist_sentinel
         self.is_running = False
-        self.dispatcher = Common.Data.GSourceDispatcher ()
+        if dispatcher is None:
+            dispatcher = Common.Data.GSourceDispatcher ()
+        self.dispatcher = dispatcher
 
     def __process (self):
 
-        if self.freq_sentinel is None or self.dist_sentinel is None:
+        if self.freq_sentinel is None:
             return
 
         self.is_running = True
 
-        for x in self.freq_sentinel.process ():
-            yield True
-
-        self.handle_sentinel_finished (self.freq_sentinel)
+        call = self.dispatcher.call
 
-        for x in self.dist_sentinel.process ():
+        for x in self.freq_sentinel.process ():
             yield True
-            self.handle_sentinel_progress (self.dist_sentinel)
 
         self.is_running = False
 
-        self.handle_sentinel_finished (self.dist_sentinel)
-        self.handle_process_finished ()
+        call (self.handle_sentinel_finished, self.freq_sentinel)
+        call (self.handle_process_finished)
 
         yield False
 
@@ -255,10 +224,6 @@ class UpdateProcess (object):
         self.dispatcher.cancel ()
         self.is_running = False
 
-    def handle_sentinel_progress (self, sentinel):
-
-        pass
-
     def handle_sentinel_finished (self, sentinel):
 
         pass
@@ -425,9 +390,18 @@ class TimelineWidget (gtk.DrawingArea):
 
     __gsignals__ = {"change-position" : (gobject.SIGNAL_RUN_LAST,
                                          gobject.TYPE_NONE,
-                                         (gobject.TYPE_INT,),)}
+                                         (gobject.TYPE_INT,),),
+                    "select-time-range" : (gobject.SIGNAL_RUN_LAST,
+                                           gobject.TYPE_NONE,
+                                           (gobject.TYPE_UINT64,
+                                            gobject.TYPE_UINT64,),)}
 
-    def __init__ (self):
+    # Zoom factor of one scroll wheel step:
+    zoom_step = .5
+    tile_width = 256
+    max_cached_views = 8
+
+    def __init__ (self, dispatcher = None):
 
         gtk.DrawingArea.__init__ (self)
 
@@ -435,111 +409,99 @@ class TimelineWidget (gtk.DrawingArea):
 
         self.add_events (gtk.gdk.BUTTON1_MOTION_MASK |
                          gtk.gdk.BUTTON_PRESS_MASK |
-                         gtk.gdk.BUTTON_RELEASE_MASK)
+                         gtk.gdk.BUTTON_RELEASE_MASK |
+                         gtk.gdk.SCROLL_MASK)
 
-        self.process = UpdateProcess (None, None)
-        self.process.handle_sentinel_progress = self.__handle_sentinel_progress
+        self.process = UpdateProcess (None, dispatcher = dispatcher)
         self.process.handle_sentinel_finished = self.__handle_sentinel_finished
 
         self.model = None
-        self.__offscreen = None
-        self.__offscreen_size = (0, 0)
-        self.__offscreen_dirty = (0, 0)
+        # Rendered tiles of the most recently shown views, by view key:
+        self.__tiles = {}
+        self.__tile_keys = []
+        self.__data_version = 0
 
         self.__position_ts_range = None
+        # Start and current position while selecting a time range:
+        self.__selection = None
 
         try:
             self.set_tooltip_text (_("Log event histogram\n"
-                                     "Different colors represent different log-levels"))
+                                     "Different colors represent different log-levels\n"
+                                     "Scroll to zoom, shift-drag to show a time range"))
         except AttributeError:
             # Compatibility.
             pass
 
-    def __handle_sentinel_progress (self, sentinel):
-
-        if sentinel == self.process.dist_sentinel:
-            old_progress = self.__dist_sentinel_progress
-            new_progress = len (sentinel.data)
-            if new_progress - old_progress >= 32:
-                self.__invalidate_offscreen (old_progress, new_progress)
-                self.__dist_sentinel_progress = new_progress
-
     def __handle_sentinel_finished (self, sentinel):
 
-        if sentinel == self.process.freq_sentinel:
-            self.__invalidate_offscreen (0, -1)
-        else:
-            self.__invalidate_offscreen (self.__dist_sentinel_progress, -1)
+        self.__invalidate_tiles ()
 
-    def __ensure_offscreen (self):
+    def __invalidate_tiles (self):
 
-        x, y, width, height = self.get_allocation ()
-        if self.__offscreen_size == (width, height):
-            return
+        # Tiles are keyed by the view they show, so a different view simply
+        # picks a different set of tiles:
+        self.queue_draw ()
 
-        self.__offscreen = gtk.gdk.Pixmap (self.window, width, height, -1)
-        self.__offscreen_size = (width, height)
-        self.__offscreen_dirty = (0, width)
-        if not self.__offscreen:
-            self.__offscreen_size = (0, 0)
-            raise ValueError ("could not obtain pixmap")
+    def __view_key (self):
 
-    def __invalidate_offscreen (self, start, stop):
+        height = self.get_allocation ()[3]
+        sentinel = self.process.freq_sentinel
+        if sentinel is None or not sentinel.data:
+            return (None, sentinel is not None, height,)
 
-        x, y, width, height = self.get_allocation ()
-        if stop < 0:
-            stop += width
+        return (self.__data_version, sentinel.ts_range, sentinel.n_partitions,
+                height,)
 
-        dirty_start, dirty_stop = self.__offscreen_dirty
-        if dirty_start != dirty_stop:
-            dirty_start = min (dirty_start, start)
-            dirty_stop = max (dirty_stop, stop)
+    def __get_tiles (self):
+
+        key = self.__view_key ()
+        if key in self.__tiles:
+            self.__tile_keys.remove (key)
         else:
-            dirty_start = start
-            dirty_stop = stop
-        self.__offscreen_dirty = (dirty_start, dirty_stop)
+            self.__tiles[key] = {}
+            if len (self.__tile_keys) >= self.max_cached_views:
+                del self.__tiles[self.__tile_keys.pop (0)]
+        self.__tile_keys.append (key)
+
+        return self.__tiles[key]
 
-        # Just like in __draw_offscreen. FIXME: Need this in one place!
-        start -= 8
-        stop += 8
-        self.queue_draw_area (start, 0, stop - start, height)
+    def __drop_tiles (self):
 
-    def __draw_from_offscreen (self, rect = None):
+        self.__data_version += 1
+        self.__tiles.clear ()
+        del self.__tile_keys[:]
+
+    def __draw_from_tiles (self, rect = None):
 
         if not self.props.visible:
             return
 
         x, y, width, height = self.get_allocation ()
-        offscreen_width, offscreen_height = self.__offscreen_size
         if rect is None:
             rect = (0, 0, width, height)
+        rect_x, rect_y, rect_width, rect_height = rect
+        rect_stop = min (rect_x + rect_width, width)
 
-        # Fill the background (where the offscreen pixmap doesn't fit) with
-        # white. This happens after enlarging the window, until all sentinels
-        # have finished running.
-        if offscreen_width < width or offscreen_height < height:
-            ctx = self.window.cairo_create ()
-
-            if rect:
-                ctx.rectangle (rect.x, rect.y,
-                               rect.x + rect.width,
-                               rect.y + rect.height)
-                ctx.clip ()
-
-            if offscreen_width < width:
-                ctx.rectangle (offscreen_width, 0, width, offscreen_height)
-            if offscreen_height < height:
-                ctx.new_path ()
-                ctx.rectangle (0, offscreen_height, width, height)
-
-            ctx.set_line_width (0.)
-            ctx.set_source_rgb (1., 1., 1.)
-            ctx.fill ()
-
+        tiles = self.__get_tiles ()
+        tile_width = self.tile_width
         gc = gtk.gdk.GC (self.window)
-        x, y, width, height = rect
-        self.window.draw_drawable (gc, self.__offscreen, x, y, x, y, width, height)
+        for index in xrange (rect_x // tile_width, (rect_stop - 1) // tile_width + 1):
+            tile = tiles.get (index)
+            if tile is None:
+                tile = gtk.gdk.Pixmap (self.window, tile_width, height, -1)
+                if not tile:
+                    raise ValueError ("could not obtain pixmap")
+                self.__draw_tile (tile, index * tile_width, height)
+                tiles[index] = tile
+            tile_x = index * tile_width
+            start = max (rect_x, tile_x)
+            stop = min (rect_stop, tile_x + tile_width)
+            self.window.draw_drawable (gc, tile, start - tile_x, rect_y,
+                                       start, rect_y, stop - start, rect_height)
+
         self.__draw_position (self.window, clip = rect)
+        self.__draw_selection (self.window, clip = rect)
 
     def update (self, model):
 
@@ -547,20 +509,33 @@ class TimelineWidget (gtk.DrawingArea):
         self.model = model
 
         if model is not None:
-            self.__dist_sentinel_progress = 0
             self.process.freq_sentinel = LineFrequencySentinel (model)
-            self.process.dist_sentinel = LevelDistributionSentinel (self.process.freq_sentinel, model)
             width = self.get_allocation ()[2]
             self.process.freq_sentinel.run_for (width)
             self.process.run ()
 
+    def repartition (self):
+
+        """Update the partitions for the current width, without processing
+        the model again if possible."""
+
+        sentinel = self.process.freq_sentinel
+        if sentinel is None or self.process.is_running or not sentinel.is_ready ():
+            self.update (self.model)
+            return
+
+        width = self.get_allocation ()[2]
+        sentinel.run_for (width, sentinel.ts_range)
+        sentinel.partition ()
+        self.__invalidate_tiles ()
+
     def clear (self):
 
         self.model = None
         self.process.abort ()
         self.process.freq_sentinel = None
-        self.process.dist_sentinel = None
-        self.__invalidate_offscreen (0, -1)
+        self.__drop_tiles ()
+        self.__invalidate_tiles ()
 
     def update_position (self, start_ts, end_ts):
 
@@ -588,29 +563,11 @@ class TimelineWidget (gtk.DrawingArea):
         time_per_pixel = self.process.freq_sentinel.step
         return 32 # FIXME use self.freq_sentinel.step and len (self.process.freq_sentinel.data)
 
-    def __draw_offscreen (self):
-
-        dirty_start, dirty_stop = self.__offscreen_dirty
-        if dirty_start == dirty_stop:
-            return
-
-        self.__offscreen_dirty = (0, 0)
-
-        drawable = self.__offscreen
-        width, height = self.__offscreen_size
+    def __draw_tile (self, drawable, offset, height):
 
+        width = self.tile_width
         ctx = drawable.cairo_create ()
 
-        # Indicator (triangle) size is 8, so we need to draw surrounding areas
-        # a bit:
-        dirty_start -= 8
-        dirty_stop += 8
-        dirty_start = max (dirty_start, 0)
-        dirty_stop = min (dirty_stop, width)
-
-        ctx.rectangle (dirty_start, 0., dirty_stop, height)
-        ctx.clip ()
-
         # White background rectangle.
         ctx.set_line_width (0.)
         ctx.rectangle (0, 0, width, height)
@@ -625,93 +582,62 @@ class TimelineWidget (gtk.DrawingArea):
             y = i * 16 - .5
             ctx.move_to (0, y)
             ctx.line_to (width, y)
-            ctx.stroke ()
+        ctx.stroke ()
 
-        if self.process.freq_sentinel is None:
+        sentinel = self.process.freq_sentinel
+        if sentinel is None:
             return
 
+        ctx.translate (-offset, 0.)
+
         # Vertical reference lines.
         pixel_step = self.find_indicative_time_step ()
         ctx.set_source_rgb (.9, .9, .9)
-        start = dirty_start - dirty_start % pixel_step
-        for x in xrange (start + pixel_step, dirty_stop, pixel_step):
+        start = max (pixel_step, offset + (-offset) % pixel_step)
+        for x in xrange (start, offset + width + 1, pixel_step):
             ctx.move_to (x - .5, 0)
             ctx.line_to (x - .5, height)
-            ctx.stroke ()
+        ctx.stroke ()
 
-        if not self.process.freq_sentinel.data:
+        if not sentinel.data:
             self.logger.debug ("frequency sentinel has no data yet")
             return
 
-        ctx.translate (dirty_start, 0.)
+        # Indicator (triangle) size is 8, so we need to draw the columns
+        # surrounding the tile a bit:
+        start = max (offset - 8, 0)
+        stop = offset + width + 8
+        ctx.translate (start, 0.)
 
-        maximum = max (self.process.freq_sentinel.data)
+        # The shown time range can be one without any lines:
+        maximum = max (1, max (sentinel.data))
 
         ctx.set_source_rgb (0., 0., 0.)
-        data = self.process.freq_sentinel.data[dirty_start:dirty_stop]
-        self.__draw_graph (ctx, height, maximum, data)
-
-        if not self.process.dist_sentinel.data:
-            self.logger.debug ("level distribution sentinel has no data yet")
-            return
+        self.__draw_graph (ctx, height, maximum, sentinel.data[start:stop])
 
         colors = LevelColorThemeTango ().colors
-        dist_data = self.process.dist_sentinel.data[dirty_start:dirty_stop]
-
-        def cumulative_level_counts (*levels):
-            for level_counts in dist_data:
-                yield sum ((level_counts[level] for level in levels))
-
-        level = Data.debug_level_info
-        levels_prev = (Data.debug_level_trace,
-                       Data.debug_level_fixme,
-                       Data.debug_level_log,
-                       Data.debug_level_debug,)
-        ctx.set_source_rgb (*(colors[level][1].float_tuple ()))
-        self.__draw_graph (ctx, height, maximum,
-                           list (cumulative_level_counts (level, *levels_prev)))
-
-        level = Data.debug_level_debug
-        levels_prev = (Data.debug_level_trace,
-                       Data.debug_level_fixme,
-                       Data.debug_level_log,)
-        ctx.set_source_rgb (*(colors[level][1].float_tuple ()))
-        self.__draw_graph (ctx, height, maximum,
-                           list (cumulative_level_counts (level, *levels_prev)))
-
-        level = Data.debug_level_log
-        levels_prev = (Data.debug_level_trace,Data.debug_level_fixme,)
-        ctx.set_source_rgb (*(colors[level][1].float_tuple ()))
-        self.__draw_graph (ctx, height, maximum,
-                           list (cumulative_level_counts (level, *levels_prev)))
-
-        level = Data.debug_level_fixme
-        levels_prev = (Data.debug_level_trace,)
-        ctx.set_source_rgb (*(colors[level][1].float_tuple ()))
-        self.__draw_graph (ctx, height, maximum,
-                           list (cumulative_level_counts (level, *levels_prev)))
-
-        level = Data.debug_level_trace
-        ctx.set_source_rgb (*(colors[level][1].float_tuple ()))
-        self.__draw_graph (ctx, height, maximum, [counts[level] for counts in dist_data])
-
-        # Draw error and warning triangle indicators:
-
-        def triangle (ctx, size = 8):
-            ctx.move_to (-size // 2, 0)
-            ctx.line_to ((size + 1) // 2, 0)
-            ctx.line_to (0, size / 1.41)
+        for level, counts in sentinel.stacks:
+            ctx.set_source_rgb (*(colors[level][1].float_tuple ()))
+            self.__draw_graph (ctx, height, maximum, counts[start:stop])
+
+        # Draw error and warning triangle indicators, one path per level:
+
+        def triangle (ctx, x, size = 8):
+            ctx.move_to (x - size // 2, 0)
+            ctx.line_to (x + (size + 1) // 2, 0)
+            ctx.line_to (x, size / 1.41)
             ctx.close_path ()
 
-        for level in (Data.debug_level_warning, Data.debug_level_error,):
+        for level in sentinel.indicator_levels:
+            positions = sentinel.indicators[level]
+            first = bisect_left (positions, start)
+            last = bisect_left (positions, stop, first)
+            if first == last:
+                continue
             ctx.set_source_rgb (*(colors[level][1].float_tuple ()))
-            for i, counts in enumerate (dist_data):
-                if counts[level] == 0:
-                    continue
-                ctx.translate (i, 0.)
-                triangle (ctx)
-                ctx.fill ()
-                ctx.translate (-i, 0.)
+            for i in positions[first:last]:
+                triangle (ctx, i - start)
+            ctx.fill ()
 
     def __draw_graph (self, ctx, height, maximum, data):
 
@@ -752,6 +678,74 @@ class TimelineWidget (gtk.DrawingArea):
 
         return (position1, position2)
 
+    def position_to_ts (self, position):
+
+        if not self.__have_position ():
+            return None
+
+        first_ts, last_ts = self.process.freq_sentinel.ts_range
+        step = self.process.freq_sentinel.step
+
+        return max (first_ts, min (last_ts, first_ts + int (position * step)))
+
+    def zoom (self, factor, position = None):
+
+        """Zoom the time axis by the given factor (less than 1 zooms in),
+        keeping the time at position (default is the center) in place."""
+
+        sentinel = self.process.freq_sentinel
+        if sentinel is None or self.process.is_running or not sentinel.is_ready ():
+            return
+
+        width = self.get_allocation ()[2]
+        if position is None:
+            position = width // 2
+        first_ts, last_ts = sentinel.ts_range
+        log_first_ts, log_last_ts = sentinel.log_ts_range
+        center_ts = self.position_to_ts (position)
+
+        # Down to one nanosecond per pixel:
+        span = max (width, int ((last_ts - first_ts) * factor))
+        if span >= log_last_ts - log_first_ts:
+            ts_range = None
+        else:
+            first_ts = center_ts - int (span * float (position) / width)
+            first_ts = max (log_first_ts, min (log_last_ts - span, first_ts))
+            ts_range = (first_ts, first_ts + span,)
+
+        self.show_time_range (ts_range)
+
+    def show_time_range (self, ts_range = None):
+
+        """Show the histogram of the given time range, or of the whole log
+        for None."""
+
+        sentinel = self.process.freq_sentinel
+        if sentinel is None or self.process.is_running or not sentinel.is_ready ():
+            return
+
+        width = self.get_allocation ()[2]
+        sentinel.run_for (width, ts_range)
+        sentinel.partition ()
+        self.__invalidate_tiles ()
+
+    def __draw_selection (self, drawable, clip = None):
+
+        if self.__selection is None:
+            return
+
+        position1, position2 = sorted (self.__selection)
+        x, y, width, height = self.get_allocation ()
+
+        ctx = drawable.cairo_create ()
+        if clip:
+            ctx.rectangle (*clip)
+            ctx.clip ()
+
+        ctx.set_source_rgba (.2, .4, .8, .3)
+        ctx.rectangle (position1, 0, max (1, position2 - position1), height)
+        ctx.fill ()
+
     def __draw_position (self, drawable, clip = None):
 
         if not self.__have_position () or self.__position_ts_range is None:
@@ -786,9 +780,7 @@ class TimelineWidget (gtk.DrawingArea):
 
     def do_expose_event (self, event):
 
-        self.__ensure_offscreen ()
-        self.__draw_offscreen ()
-        self.__draw_from_offscreen (event.area)
+        self.__draw_from_tiles (event.area)
 
         return True
 
@@ -800,7 +792,7 @@ class TimelineWidget (gtk.DrawingArea):
         if event.width < 16:
             return False
 
-        self.update (self.model)
+        self.repartition ()
 
         return False
 
@@ -822,6 +814,11 @@ class TimelineWidget (gtk.DrawingArea):
             self.props.has_tooltip = False
 
         pos = int (event.x)
+        if event.state & gtk.gdk.SHIFT_MASK and self.__have_position ():
+            self.__selection = (pos, pos,)
+            self.queue_draw ()
+            return True
+
         self.emit ("change-position", pos)
         return True
 
@@ -834,13 +831,39 @@ class TimelineWidget (gtk.DrawingArea):
             self.grab_remove ()
             self.props.has_tooltip = True
 
+        if self.__selection is not None:
+            position1, position2 = sorted (self.__selection)
+            self.__selection = None
+            self.queue_draw ()
+            if position2 - position1 > 1:
+                self.emit ("select-time-range",
+                           self.position_to_ts (position1),
+                           self.position_to_ts (position2))
+
+        return True
+
+    def do_scroll_event (self, event):
+
+        if event.direction == gtk.gdk.SCROLL_UP:
+            self.zoom (self.zoom_step, int (event.x))
+        elif event.direction == gtk.gdk.SCROLL_DOWN:
+            self.zoom (1. / self.zoom_step, int (event.x))
+        else:
+            return False
+
         return True
 
     def do_motion_notify_event (self, event):
 
         x, y, mod = self.window.get_pointer ()
 
-        if event.state & gtk.gdk.BUTTON1_MASK:
+        if self.__selection is not None:
+            width = self.get_allocation ()[2]
+            self.__selection = (self.__selection[0], max (0, min (width, int (x))),)
+            self.queue_draw ()
+            gtk.gdk.event_request_motions (event)
+            return True
+        elif event.state & gtk.gdk.BUTTON1_MASK:
             self.emit ("change-position", int (x))
             gtk.gdk.event_request_motions (event)
             return True
@@ -865,6 +888,19 @@ class AttachedWindow (object):
 
         ui.insert_action_group (feature.action_group, 0)
 
+        # The zoom actions act on the timeline of this window only:
+        self.zoom_action_group = gtk.ActionGroup ("TimelineZoomActions")
+        self.zoom_action_group.add_actions ([("timeline-zoom-in", gtk.STOCK_ZOOM_IN,
+                                              _("Zoom In Timeline"), None, None,
+                                              self.handle_zoom_in_action_activate),
+                                             ("timeline-zoom-out", gtk.STOCK_ZOOM_OUT,
+                                              _("Zoom Out Timeline"), None, None,
+                                              self.handle_zoom_out_action_activate),
+                                             ("timeline-zoom-reset", gtk.STOCK_ZOOM_FIT,
+                                              _("Show Whole Timeline"), None, None,
+                                              self.handle_zoom_reset_action_activate)])
+        ui.insert_action_group (self.zoom_action_group, 0)
+
         self.merge_id = ui.new_merge_id ()
         ui.add_ui (self.merge_id, "/menubar/ViewMenu/ViewMenuAdditions",
                    "ViewTimeline", "show-timeline",
@@ -878,14 +914,29 @@ class AttachedWindow (object):
         #            "hide-before-line", gtk.UI_MANAGER_MENUITEM, False)
         # ui.add_ui (self.merge_id, "/TimelineContextMenu", "TimelineHideLinesAfter",
         #            "hide-after-line", gtk.UI_MANAGER_MENUITEM, False)
+        for name, action_name in (("TimelineZoomIn", "timeline-zoom-in",),
+                                  ("TimelineZoomOut", "timeline-zoom-out",),
+                                  ("TimelineZoomReset", "timeline-zoom-reset",),):
+            ui.add_ui (self.merge_id, "/TimelineContextMenu", name,
+                       action_name, gtk.UI_MANAGER_MENUITEM, False)
+        ui.add_ui (self.merge_id, "/TimelineContextMenu", "TimelineSeparator",
+                   None, gtk.UI_MANAGER_SEPARATOR, False)
+        ui.add_ui (self.merge_id, "/TimelineContextMenu", "TimelineShowHiddenRange",
+                   "show-hidden-range", gtk.UI_MANAGER_MENUITEM, False)
         ui.add_ui (self.merge_id, "/TimelineContextMenu", "TimelineShowHiddenLines",
                    "show-hidden-lines", gtk.UI_MANAGER_MENUITEM, False)
 
         box = window.get_top_attach_point ()
 
-        self.timeline = TimelineWidget ()
+        scheduler = window.scheduler
+        dispatcher = scheduler.dispatcher (scheduler.PRIORITY_LOW,
+                                           after = (window.filter_dispatcher,),
+                                           view = window.log_view)
+        self.timeline = TimelineWidget (dispatcher)
         self.timeline.connect ("change-position",
                                self.handle_timeline_change_position)
+        self.timeline.connect ("select-time-range",
+                               self.handle_timeline_select_time_range)
         box.pack_start (self.timeline, False, False, 0)
         self.timeline.hide ()
 
@@ -922,6 +973,7 @@ class AttachedWindow (object):
         self.merge_id = None
 
         self.window.ui_manager.remove_action_group (feature.action_group)
+        self.window.ui_manager.remove_action_group (self.zoom_action_group)
 
         self.timeline.destroy ()
         self.timeline = None
@@ -996,6 +1048,22 @@ class AttachedWindow (object):
 
         self.goto_time_position (pos)
 
+    def handle_timeline_select_time_range (self, widget, start_ts, stop_ts):
+
+        self.window.show_time_range (start_ts, stop_ts)
+
+    def handle_zoom_in_action_activate (self, action):
+
+        self.timeline.zoom (self.timeline.zoom_step)
+
+    def handle_zoom_out_action_activate (self, action):
+
+        self.timeline.zoom (1. / self.timeline.zoom_step)
+
+    def handle_zoom_reset_action_activate (self, action):
+
+        self.timeline.show_time_range (None)
+
     def goto_time_position (self, pos):
 
         if not self.timeline.process.freq_sentinel:
@@ -1010,7 +1078,9 @@ class AttachedWindow (object):
         elif pos >= len (data):
             pos = len (data) - 1
 
-        count = sum (data[:pos + 1])
+        # Row at the end of the partition:
+        partitions = self.timeline.process.freq_sentinel.partitions
+        count = partitions[pos + 1]
 
         path = (count,)
         self.idle_scroll_path = path
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the common data module."""
+
+import sys
+import os
+import os.path
+import logging
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import TestCase, main as test_main
+
+import gobject
+
+from GstDebugViewer.Common.Data import Scheduler
+
+def run_main_loop ():
+
+    context = gobject.main_context_default ()
+    while context.pending ():
+        context.iteration (False)
+
+class TestScheduler (TestCase):
+
+    def setUp (self):
+
+        # Failing jobs are logged, which is expected here:
+        logging.getLogger ("scheduler").disabled = True
+
+    def tearDown (self):
+
+        logging.getLogger ("scheduler").disabled = False
+
+    def test_priority (self):
+
+        scheduler = Scheduler ()
+        low = scheduler.dispatcher (priority = Scheduler.PRIORITY_LOW)
+        high = scheduler.dispatcher (priority = Scheduler.PRIORITY_HIGH)
+        steps = []
+
+        def job (name, n):
+            for i in range (n):
+                steps.append (name)
+                yield True
+
+        low (job ("low", 2))
+        high (job ("high", 2))
+        run_main_loop ()
+
+        self.assertEquals (steps, ["high", "high", "low", "low"])
+        self.assertFalse (low.is_busy ())
+        self.assertFalse (high.is_busy ())
+
+    def test_failing_job (self):
+
+        scheduler = Scheduler ()
+        failing = scheduler.dispatcher (priority = Scheduler.PRIORITY_HIGH)
+        other = scheduler.dispatcher ()
+        waiting = scheduler.dispatcher (after = (failing,))
+        steps = []
+
+        def fail ():
+            yield True
+            raise ValueError ("broken job")
+
+        def job (name):
+            for i in range (3):
+                steps.append (name)
+                yield True
+
+        failing (fail ())
+        other (job ("other"))
+        waiting (job ("waiting"))
+        run_main_loop ()
+
+        self.assertEquals (steps.count ("other"), 3)
+        self.assertEquals (steps.count ("waiting"), 3)
+        self.assertFalse (failing.is_busy ())
+        self.assertEquals (scheduler.jobs, [])
+        self.assertEquals (scheduler.source_id, None)
+
+        # Scheduling still works afterwards:
+        other (job ("again"))
+        run_main_loop ()
+        self.assertEquals (steps.count ("again"), 3)
+
+if __name__ == "__main__":
+    test_main ()
@@ -0,0 +1,601 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the data module."""
+
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import TestCase, main as test_main
+
+from GstDebugViewer import Data
+
+class Dispatcher (object):
+
+    def __call__ (self, iterator):
+
+        for x in iterator:
+            pass
+
+    def cancel (self):
+
+        pass
+
+    def call (self, func, *args):
+
+        func (*args)
+
+def line_string (ts, thread, level, category, message):
+
+    return "%s %5d 0x%x %s %20s dummy.c:1:dummy:<obj0> %s\n" % (Data.time_args (ts),
+                                                                  12345, thread,
+                                                                  level.name.ljust (5),
+                                                                  category, message,)
+
+class TestDebugLevelArray (TestCase):
+
+    def test_items (self):
+
+        levels = Data.DebugLevelArray ()
+        levels.append (Data.debug_level_warning)
+        levels.insert (0, Data.debug_level_log)
+        levels.extend ([Data.debug_level_error])
+
+        self.assertEquals (levels.itemsize, 1)
+        self.assertEquals (list (levels), [Data.debug_level_log,
+                                           Data.debug_level_warning,
+                                           Data.debug_level_error])
+        self.assertEquals (levels[1].name, "WARN")
+        self.assertEquals (levels[1:][0].name, "WARN")
+
+class TestLevelCounts (TestCase):
+
+    def test_partitions (self):
+
+        levels = Data.DebugLevelArray ([(i * 7) % 5 + i // 100 for i in range (300)])
+        boundaries = [0, 1, 63, 64, 65, 150, 299, 300]
+
+        level_counts = Data.LevelCounts ()
+        for x in level_counts.build (levels, lines_per_iteration = 128):
+            pass
+
+        expected = []
+        for start, stop in zip (boundaries, boundaries[1:]):
+            counts = [0] * 8
+            for level in levels[start:stop]:
+                counts[level] += 1
+            expected.append (tuple (counts))
+        self.assertEquals (level_counts.partition_counts (boundaries), expected)
+
+class TestTimePyramid (TestCase):
+
+    def test_histogram (self):
+
+        if Data.numpy is None:
+            return
+
+        times = Data.array (Data.TIME_TYPECODE, [i * i for i in range (100)])
+        levels = Data.DebugLevelArray ([i % 8 for i in range (100)])
+
+        pyramid = Data.TimePyramid ()
+        pyramid.max_buckets = 16
+        for x in pyramid.build (times, levels, lines_per_iteration = 30):
+            pass
+        self.assertTrue (len (pyramid.layers[0]) <= 16)
+        self.assertEquals (len (pyramid.layers[-1]), 1)
+        self.assertEquals (pyramid.layers[-1].sum (), 100)
+
+        # Spans aligned to the buckets are exact:
+        width = 2 * pyramid.resolution
+        histogram = pyramid.histogram (0, width * 5, 5)
+        for i, counts in enumerate (histogram):
+            expected = [0] * 8
+            for t, level in zip (times, levels):
+                if i * width <= t < (i + 1) * width:
+                    expected[level] += 1
+            self.assertEquals (counts, tuple (expected))
+
+        for n in (1, 3, 7, 100,):
+            histogram = pyramid.histogram (times[0], times[-1] + 1, n)
+            self.assertEquals (len (histogram), n)
+            self.assertEquals (sum (sum (counts) for counts in histogram), 100)
+
+class TestParseCache (TestCase):
+
+    def test_blocks (self):
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug, "CAT",
+                              "msg %i" % (i,))
+                 for i in range (100)]
+        data = "".join (lines)
+        offsets = [sum (len (l) for l in lines[:i]) for i in range (100)]
+
+        import mmap
+        fileobj = mmap.mmap (-1, len (data))
+        fileobj.write (data)
+
+        cache = Data.ParseCache (fileobj, block_size = 1024, max_lines = 30)
+        for i, offset in enumerate (offsets):
+            cache.ensure (offset)
+            self.assertEquals (cache[offset][0], i * 1000)
+            self.assertEquals (fileobj[offset + cache[offset][-1]:].split ("\n")[0],
+                               "msg %i" % (i,))
+        self.assertTrue (len (cache) <= 30)
+        # Each block is parsed only once:
+        self.assertEquals (cache.misses, len (data) // 1024 + 1)
+        self.assertEquals (cache.hits + cache.misses, 100)
+
+        self.assertTrue (offsets[-1] in cache)
+        self.assertFalse (offsets[0] in cache)
+        cache.reset_stats ()
+        cache.ensure (offsets[-2])
+        self.assertEquals ((cache.hits, cache.misses,), (1, 0,))
+
+class LogFileTestCase (TestCase):
+
+    def setUp (self):
+
+        self.tmp_dir = tempfile.mkdtemp ()
+
+    def tearDown (self):
+
+        shutil.rmtree (self.tmp_dir)
+
+    def write_log (self, lines, name = "test.log"):
+
+        filename = os.path.join (self.tmp_dir, name)
+        with open (filename, "wb") as f:
+            f.write ("".join (lines))
+        return filename
+
+    def load (self, filename, **kw):
+
+        log_file = Data.LogFile (filename, Dispatcher (), **kw)
+        log_file.start_loading ()
+        return log_file
+
+class TestLineIndexCache (LogFileTestCase):
+
+    def test_roundtrip (self):
+
+        levels = (Data.debug_level_debug, Data.debug_level_warning,
+                  Data.debug_level_error,)
+        lines = [line_string (i * 1000, 1, levels[i % 3], "CAT", "msg %i" % (i,))
+                 for i in range (100)]
+        filename = self.write_log (lines)
+
+        cache = Data.LineIndexCache (os.path.join (self.tmp_dir, "index"))
+        cache.min_file_size = 0
+
+        log_file = self.load (filename, index_cache = cache)
+        offsets = list (log_file.line_cache.offsets)
+        levels = list (log_file.line_cache.levels)
+        self.assertEquals (len (offsets), 100)
+
+        self.assertNotEquals (cache.load (log_file.path, log_file.fileobj), None)
+
+        log_file = self.load (filename, index_cache = cache)
+        self.assertEquals (list (log_file.line_cache.offsets), offsets)
+        self.assertEquals (list (log_file.line_cache.levels), levels)
+        self.assertEquals (log_file.line_cache.levels[2].name, "ERROR")
+
+    def test_stale (self):
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug, "CAT", "msg")
+                 for i in range (10)]
+        filename = self.write_log (lines)
+
+        cache = Data.LineIndexCache (os.path.join (self.tmp_dir, "index"))
+        cache.min_file_size = 0
+
+        self.load (filename, index_cache = cache)
+
+        with open (filename, "ab") as f:
+            f.write (lines[-1])
+
+        log_file = self.load (filename, index_cache = cache)
+        self.assertEquals (len (log_file.line_cache.offsets), 11)
+
+class TestSorting (LogFileTestCase):
+
+    def test_interleaved_threads (self):
+
+        import random
+
+        rand = random.Random (0)
+        # 16 threads with a running clock each, written out with some delay:
+        clocks = [0] * 16
+        lines = []
+        for i in range (5000):
+            thread = rand.randrange (16)
+            clocks[thread] = max (clocks) - rand.randrange (50000)
+            clocks[thread] += rand.randrange (1000)
+            lines.append ((clocks[thread], thread,))
+        lines = [line_string (10 ** 6 + ts, thread, Data.debug_level_debug,
+                              "CAT", "msg %i" % (i,))
+                 for i, (ts, thread,) in enumerate (lines)]
+        filename = self.write_log (lines)
+
+        log_file = self.load (filename)
+        offsets = log_file.line_cache.offsets
+        self.assertEquals (len (offsets), len (lines))
+        self.assertEquals (sorted (offsets), sorted (set (offsets)))
+
+        timestamps = [log_file.get_full_line (i)[0] for i in range (len (offsets))]
+        self.assertEquals (timestamps, sorted (timestamps))
+
+class TestUpdate (LogFileTestCase):
+
+    def test_append (self):
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug, "CAT",
+                              "msg %i" % (i,))
+                 for i in range (100)]
+        filename = self.write_log (lines[:50])
+        # Partially written line, completed later:
+        with open (filename, "ab") as f:
+            f.write (lines[50][:20])
+
+        log_file = self.load (filename)
+        self.assertEquals (len (log_file.line_cache.offsets), 50)
+
+        added = []
+        class Consumer (object):
+            def handle_lines_added (self, line_indices):
+                added.extend (line_indices)
+        log_file.consumers.append (Consumer ())
+
+        # One line that belongs in the middle:
+        late_line = line_string (10500, 2, Data.debug_level_debug, "CAT", "late")
+        with open (filename, "ab") as f:
+            f.write (lines[50][20:])
+            f.write ("".join (lines[51:]))
+            f.write (late_line)
+
+        self.assertTrue (log_file.has_grown ())
+        log_file.start_update ()
+        self.assertFalse (log_file.has_grown ())
+
+        self.assertEquals (len (log_file.line_cache.offsets), 101)
+        self.assertEquals (added, [11] + range (51, 101))
+        self.assertEquals (log_file.get_full_line (11)[-1].strip (), "late")
+        timestamps = [log_file.get_full_line (i)[0] for i in range (101)]
+        self.assertEquals (timestamps, sorted (timestamps))
+
+    def test_append_indexed_tail (self):
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug, "CAT",
+                              "msg %i" % (i,))
+                 for i in range (50)]
+        filename = self.write_log (lines)
+        # The partially written line can be indexed already, and sorts in
+        # front of other lines:
+        late_line = line_string (10500, 2, Data.debug_level_debug, "CAT", "late")
+        with open (filename, "ab") as f:
+            f.write (late_line[:-10])
+
+        log_file = self.load (filename)
+        self.assertEquals (len (log_file.line_cache.offsets), 51)
+
+        with open (filename, "ab") as f:
+            f.write (late_line[-10:])
+            f.write (line_string (60000, 1, Data.debug_level_debug, "CAT", "new"))
+        log_file.start_update ()
+
+        offsets = log_file.line_cache.offsets
+        self.assertEquals (len (offsets), 52)
+        self.assertEquals (log_file.get_full_line (11)[-1].strip (), "late")
+        self.assertEquals (log_file.get_full_line (51)[-1].strip (), "new")
+
+class TestLineColumns (LogFileTestCase):
+
+    def assertColumnsMatch (self, log_file):
+
+        columns = log_file.columns
+        offsets = log_file.line_cache.offsets
+        self.assertEquals (len (columns), len (offsets))
+        for i, offset in enumerate (offsets):
+            log_file.fileobj.seek (offset)
+            line = Data.LogLine.parse_full (log_file.fileobj.readline ())
+            self.assertEquals (columns.get_row (i), line)
+            self.assertEquals (columns.index_of_offset (offset), i)
+
+    def test_parse (self):
+
+        lines = [line_string ((i ^ 3) * 1000, i % 3, Data.debug_level_debug,
+                              "CAT%i" % (i % 4,), "msg %i" % (i,))
+                 for i in range (100)]
+        filename = self.write_log (lines)
+
+        log_file = self.load (filename, parse_columns = True)
+        self.assertColumnsMatch (log_file)
+        self.assertEquals (sorted (log_file.columns.strings),
+                           sorted (["", "CAT0", "CAT1", "CAT2", "CAT3",
+                                    "dummy.c", "dummy", "obj0"]))
+
+        with open (filename, "ab") as f:
+            f.write (line_string (200000, 1, Data.debug_level_debug, "NEW", "new"))
+            f.write (line_string (50500, 1, Data.debug_level_debug, "NEW", "late"))
+        log_file.start_update ()
+        self.assertColumnsMatch (log_file)
+
+    def test_parse_keeps_file_position (self):
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug,
+                              "CAT%i" % (i % 3,), "msg %i" % (i,))
+                 for i in range (30)]
+        log_file = self.load (self.write_log (lines))
+        fileobj = log_file.fileobj
+
+        # The parse runs in a worker thread while the UI reads lines from the
+        # same mapping:
+        columns = Data.LineColumns ()
+        for x in columns.parse (fileobj, log_file.line_cache.offsets,
+                                lines_per_iteration = 1):
+            fileobj.seek (len (lines[0]) + 5)
+            self.assertEquals (fileobj.tell (), len (lines[0]) + 5)
+        log_file.columns = columns
+        self.assertColumnsMatch (log_file)
+
+    def test_postings (self):
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug,
+                              "CAT%i" % (i % 3,), "msg %i" % (i,))
+                 for i in range (30)]
+        filename = self.write_log (lines)
+
+        columns = self.load (filename, parse_columns = True).columns
+        self.assertEquals (list (columns.get_lines_with_value ("categories", "CAT1")),
+                           range (1, 30, 3))
+        self.assertEquals (list (columns.get_lines_with_value ("categories", "XYZ")), [])
+        self.assertEquals (columns.get_counts ("categories"),
+                           {"CAT0" : 10, "CAT1" : 10, "CAT2" : 10})
+        self.assertEquals (columns.get_counts ("objects"), {"obj0" : 30})
+
+    def test_postings_update (self):
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug,
+                              "CAT%i" % (i % 3,), "msg %i" % (i,))
+                 for i in range (30)]
+        filename = self.write_log (lines)
+        log_file = self.load (filename, parse_columns = True)
+        columns = log_file.columns
+
+        with open (filename, "ab") as f:
+            f.write (line_string (40000, 1, Data.debug_level_debug, "CAT1", "new"))
+            f.write (line_string (10500, 1, Data.debug_level_debug, "CAT1", "late"))
+            f.write (line_string (41000, 1, Data.debug_level_debug, "NEW", "new"))
+        log_file.start_update ()
+
+        self.assertTrue (log_file.columns is columns)
+        self.assertEquals (list (columns.get_lines_with_value ("categories", "CAT1")),
+                           [1, 4, 7, 10, 11, 14, 17, 20, 23, 26, 29, 31])
+        self.assertEquals (list (columns.get_lines_with_value ("categories", "CAT0")),
+                           [0, 3, 6, 9, 13, 16, 19, 22, 25, 28])
+        self.assertEquals (list (columns.get_lines_with_value ("categories", "NEW")), [32])
+        self.assertEquals (columns.get_counts ("objects"), {"obj0" : 33})
+
+    def test_set_operations (self):
+
+        a = Data.array ("I", [1, 3, 4, 7, 9, 10])
+        b = Data.array ("I", [0, 3, 9, 10, 11])
+        self.assertEquals (list (Data.intersect_sorted (a, b)), [3, 9, 10])
+        self.assertEquals (list (Data.subtract_sorted (a, b)), [1, 4, 7])
+        self.assertEquals (list (Data.subtract_sorted (a, Data.array ("I"))), list (a))
+
+class TestFindLineOffsets (TestCase):
+
+    def test_windows (self):
+
+        lines = ["line %i %s\n" % (i, "match" if i % 7 == 0 else "other",)
+                 for i in range (1000)]
+        data = "".join (lines)
+        offsets = [sum (len (l) for l in lines[:i]) for i in range (0, 1000, 7)]
+
+        # Small windows, so that matches cross window boundaries:
+        for window_size in (3, 64, 1000, len (data),):
+            found = Data.array (Data.OFFSET_TYPECODE)
+            for x in Data.find_line_offsets (data, "match", found,
+                                             window_size = window_size):
+                pass
+            self.assertEquals (list (found), offsets)
+
+    def test_ignore_case (self):
+
+        data = "first Match\nsecond\nthird MATCH match\n"
+
+        found = Data.array (Data.OFFSET_TYPECODE)
+        for x in Data.find_line_offsets (data, "match", found, ignore_case = True):
+            pass
+        self.assertEquals (list (found), [0, 19])
+
+class TestFindLineIndex (LogFileTestCase):
+
+    def test_lookup (self):
+
+        # Out of order threads and runs of equal timestamps:
+        lines = [line_string ((i // 3) * 1000 - (i % 2) * 2500, i % 2,
+                              Data.debug_level_debug, "CAT", "msg %i" % (i,))
+                 for i in range (60)]
+        lines.append ("garbage\n")
+        log_file = self.load (self.write_log (lines))
+        fileobj = log_file.fileobj
+        offsets = log_file.line_cache.offsets
+
+        for i, offset in enumerate (offsets):
+            self.assertEquals (Data.find_line_index (fileobj, offsets, offset), i)
+        self.assertEquals (Data.find_line_index (fileobj, offsets,
+                                                 len (fileobj) - len ("garbage\n")), -1)
+
+        subset = Data.array (Data.OFFSET_TYPECODE, offsets[::3])
+        for i, offset in enumerate (offsets):
+            if i % 3:
+                self.assertEquals (Data.find_line_index (fileobj, subset, offset), -1)
+            else:
+                self.assertEquals (Data.find_line_index (fileobj, subset, offset), i // 3)
+
+class TestParseLineTimes (TestCase):
+
+    def test_prefixes (self):
+
+        lines = [line_string (i * 1001, 1, Data.debug_level_info, "cat", "msg")
+                 for i in range (100)]
+        lines += ["10:00:00.000000001 long hours\n", "0:00:01.5 short\n", "garbage\n"]
+        data = "".join (lines)
+        offsets = Data.array (Data.OFFSET_TYPECODE,
+                              [sum (len (l) for l in lines[:i]) for i in range (len (lines))])
+        expected = ([i * 1001 for i in range (100)] +
+                    [10 * 60**2 * Data.SECOND + 1, Data.SECOND + 5, 0])
+
+        for lines_per_iteration in (7, 1000,):
+            times = Data.array (Data.TIME_TYPECODE)
+            for x in Data.parse_line_times (data, offsets, times,
+                                            lines_per_iteration = lines_per_iteration):
+                pass
+            self.assertEquals (list (times), expected)
+
+class TestTrigramIndex (LogFileTestCase):
+
+    def test_candidates (self):
+
+        if Data.numpy is None:
+            return
+
+        import numpy
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug, "CAT",
+                              "message number %i" % (i,))
+                 for i in range (20000)]
+        lines[1234] = line_string (1234000, 1, Data.debug_level_debug, "CAT",
+                                   "a needle in the haystack")
+        # Match in a line that spans multiple blocks:
+        lines[15000] = line_string (15000000, 1, Data.debug_level_debug, "CAT",
+                                    "x" * 200000 + "needle")
+        filename = self.write_log (lines)
+
+        cache = Data.LineIndexCache (os.path.join (self.tmp_dir, "index"))
+        cache.min_file_size = 0
+        log_file = self.load (filename, index_cache = cache)
+        self.assertTrue (log_file.start_trigram_index (Dispatcher ()))
+        index = log_file.trigram_index
+        self.assertEquals (index.size, len (log_file.fileobj))
+
+        offsets = numpy.frombuffer (log_file.line_cache.offsets,
+                                    dtype = log_file.line_cache.offsets.typecode)
+        candidates = list (index.find_candidates ("needle", offsets))
+        self.assertTrue (1234 in candidates)
+        self.assertTrue (15000 in candidates)
+        self.assertTrue (len (candidates) < len (lines) // 2)
+        self.assertEquals (index.find_candidates ("ne", offsets), None)
+
+        log_file = self.load (filename, index_cache = cache)
+        data = cache.load_data (log_file.path, log_file.fileobj, Data.TrigramIndex.SUFFIX)
+        self.assertEquals (data, index.tostring ())
+
+class Clock (object):
+
+    def __init__ (self):
+
+        self.now = 0.
+
+    def __call__ (self):
+
+        return self.now
+
+class TestYieldLimit (TestCase):
+
+    def setUp (self):
+
+        self.clock = Clock ()
+        self.time = Data.time
+        Data.time = self.clock
+
+    def tearDown (self):
+
+        Data.time = self.time
+
+    def test_adapt (self):
+
+        # Every iteration takes 1/1024 s, which should give batches of 16:
+        limit = Data.YieldLimit (size = 100, budget = 1. / 64)
+        sizes = []
+        for i in range (8):
+            limit.start_batch ()
+            self.clock.now += limit.size / 1024.
+            sizes.append (limit.end_batch ())
+        self.assertEquals (sizes, [58, 37, 26, 21, 18, 17, 16, 16])
+
+        # A slow batch only moves half of the way:
+        limit.start_batch ()
+        self.clock.now += 16 * 4 / 1024.
+        self.assertEquals (limit.end_batch (), 10)
+
+    def test_bounds (self):
+
+        limit = Data.YieldLimit (size = 1, maximum = 64)
+        sizes = []
+        for i in range (8):
+            limit.start_batch ()
+            sizes.append (limit.end_batch ())
+        self.assertEquals (sizes, [2, 4, 8, 16, 32, 64, 64, 64])
+
+        limit = Data.YieldLimit (size = 8, minimum = 4, budget = 1. / 64)
+        for i in range (4):
+            limit.start_batch ()
+            self.clock.now += 1.
+            limit.end_batch ()
+        self.assertEquals (limit.size, 4)
+
+class TestParallelIndexing (LogFileTestCase):
+
+    def test_same_as_serial (self):
+
+        lines = []
+        for i in range (2000):
+            # Some lines out of order, and some lines that do not parse:
+            ts = 10000 + i * 1000 - (i % 7) * 1500
+            level = Data.debug_levels[1 + i % (len (Data.debug_levels) - 1)]
+            lines.append (line_string (ts, i % 5, level, "CAT", "msg %i" % (i,)))
+            if i % 100 == 0:
+                lines.append ("garbage\n")
+        filename = self.write_log (lines)
+
+        serial = self.load (filename)
+
+        min_size = Data.LineCache._parallel_min_size
+        Data.LineCache._parallel_min_size = 0
+        try:
+            parallel = self.load (filename, workers = 2)
+        finally:
+            Data.LineCache._parallel_min_size = min_size
+
+        self.assertEquals (len (parallel.line_cache.offsets), 2000)
+        self.assertEquals (list (parallel.line_cache.offsets),
+                           list (serial.line_cache.offsets))
+        self.assertEquals (list (parallel.line_cache.levels),
+                           list (serial.line_cache.levels))
+
+if __name__ == "__main__":
+    test_main ()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the filter stack of the filtered
+log model."""
+
+import sys
+import os
+import os.path
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import main as test_main
+
+from GstDebugViewer import Data
+from GstDebugViewer.GUI.filters import CategoryFilter, DebugLevelFilter, Filter
+from GstDebugViewer.GUI.models import FilteredLogModel, LazyLogModel
+
+from test_data import Dispatcher, LogFileTestCase, line_string
+
+class PausedDispatcher (Dispatcher):
+
+    """Keeps the dispatched iterator until run is called."""
+
+    def __init__ (self):
+
+        self.iterator = None
+
+    def __call__ (self, iterator):
+
+        self.iterator = iterator
+
+    def cancel (self):
+
+        self.iterator = None
+
+    def run (self):
+
+        iterator = self.iterator
+        self.iterator = None
+        for x in iterator:
+            pass
+
+class BrokenFilter (Filter):
+
+    broken = True
+
+    def filter_func (self, row):
+
+        if self.broken:
+            raise ValueError ("broken filter")
+
+        return True
+
+class FilterStackTestCase (LogFileTestCase):
+
+    parse_columns = False
+
+    def setUp (self):
+
+        LogFileTestCase.setUp (self)
+
+        levels = (Data.debug_level_debug, Data.debug_level_info,
+                  Data.debug_level_log,)
+        lines = [line_string (i * 1000, 1, levels[i % 3], "CAT%i" % (i % 4,),
+                              "msg %i" % (i,))
+                 for i in range (200)]
+        self.filename = self.write_log (lines)
+        self.log_file = self.load (self.filename, parse_columns = self.parse_columns)
+        self.log_file.consumers.append (self)
+
+        self.log_model = LazyLogModel ()
+        self.log_model.set_log (self.log_file)
+        if self.parse_columns:
+            self.log_model.set_columns (self.log_file.columns)
+        self.model = FilteredLogModel (self.log_model)
+        self.inserted = []
+        self.model.row_inserted = lambda path, tree_iter: self.inserted.append (path[0])
+        self.failed = []
+        self.model.handle_process_failed = self.failed.append
+
+    def handle_lines_added (self, line_indices):
+
+        self.log_model.handle_lines_added (line_indices)
+        self.model.handle_super_lines_added (line_indices)
+
+    def append_lines (self, lines):
+
+        with open (self.filename, "ab") as f:
+            f.write ("".join (lines))
+        self.log_file.start_update ()
+
+    def expected_offsets (self, filters, start = 0, stop = None):
+
+        log_model = self.log_model
+        if stop is None:
+            stop = len (log_model.line_offsets)
+
+        offsets = []
+        for i in range (start, stop):
+            offset = log_model.line_offsets[i]
+            log_model.ensure_cached (offset)
+            row = log_model.line_cache[offset]
+            row[log_model.COL_LEVEL] = log_model.line_levels[i]
+            if all (filter.filter_func (row) for filter in filters):
+                offsets.append (offset)
+
+        return offsets
+
+    def assertRows (self, filters, start = 0, stop = None):
+
+        self.assertEquals (list (self.model.line_offsets),
+                           self.expected_offsets (filters, start, stop))
+        self.assertEquals (len (self.model.line_levels), len (self.model.line_offsets))
+
+class TestFilterStack (FilterStackTestCase):
+
+    def test_add_remove (self):
+
+        model = self.model
+        category = CategoryFilter ("CAT1")
+        level = DebugLevelFilter (Data.debug_level_info)
+
+        model.add_filter (category, Dispatcher ())
+        self.assertRows ([category])
+        model.add_filter (level, Dispatcher ())
+        self.assertRows ([category, level])
+        self.assertEquals (model.filters, [category, level])
+
+        model.remove_filter (0, Dispatcher ())
+        self.assertEquals (model.filters, [level])
+        self.assertRows ([level])
+
+        model.remove_filter (0, Dispatcher ())
+        self.assertEquals (model.filters, [])
+        self.assertRows ([])
+
+    def test_abort (self):
+
+        model = self.model
+        category = CategoryFilter ("CAT1")
+        model.add_filter (category, Dispatcher ())
+
+        dispatcher = PausedDispatcher ()
+        model.add_filter (DebugLevelFilter (Data.debug_level_info), dispatcher)
+        model.abort_process ()
+        self.assertEquals (model.filters, [category])
+        self.assertRows ([category])
+
+    def test_failing_filter (self):
+
+        model = self.model
+        category = CategoryFilter ("CAT1")
+        model.add_filter (category, Dispatcher ())
+
+        model.add_filter (BrokenFilter (), Dispatcher ())
+        self.assertEquals (len (self.failed), 1)
+        self.assertTrue (isinstance (self.failed[0], ValueError))
+        self.assertEquals (model.filters, [category])
+        self.assertRows ([category])
+
+        # The model is not stuck with the failed process:
+        level = DebugLevelFilter (Data.debug_level_info)
+        model.add_filter (level, Dispatcher ())
+        self.assertRows ([category, level])
+
+        breaking = BrokenFilter ()
+        breaking.broken = False
+        model.add_filter (breaking, Dispatcher ())
+        model.set_range (20, 50)
+        breaking.broken = True
+        self.assertTrue (model.reset_range (Dispatcher ()))
+        self.assertEquals (len (self.failed), 2)
+        self.assertEquals (model.super_range, (20, 50,))
+        self.assertEquals (model.filters, [category, level, breaking])
+        breaking.broken = False
+        self.assertRows ([category, level], 20, 50)
+
+    def test_lines_added (self):
+
+        model = self.model
+        filters = [CategoryFilter ("CAT1"), DebugLevelFilter (Data.debug_level_info)]
+        for filter in filters:
+            model.add_filter (filter, Dispatcher ())
+
+        self.append_lines ([line_string (300000, 1, Data.debug_level_debug, "CAT2", "new"),
+                            line_string (50500, 2, Data.debug_level_debug, "CAT3", "late"),
+                            line_string (400000, 1, Data.debug_level_info, "CAT3", "hidden"),])
+        self.assertRows (filters)
+        self.assertEquals (len (self.inserted), 2)
+
+    def test_lines_appended (self):
+
+        model = self.model
+        filters = [CategoryFilter ("CAT1"), DebugLevelFilter (Data.debug_level_info)]
+        for filter in filters:
+            model.add_filter (filter, Dispatcher ())
+        n_rows = len (model.line_offsets)
+
+        self.append_lines ([line_string (300000, 1, Data.debug_level_debug, "CAT2", "new"),
+                            line_string (400000, 1, Data.debug_level_info, "CAT3", "hidden"),
+                            line_string (500000, 1, Data.debug_level_log, "CAT0", "new"),])
+        self.assertRows (filters)
+        self.assertEquals (self.inserted, [n_rows, n_rows + 1])
+
+    def test_lines_added_while_filtering (self):
+
+        model = self.model
+        category = CategoryFilter ("CAT1")
+        model.add_filter (category, Dispatcher ())
+
+        level = DebugLevelFilter (Data.debug_level_info)
+        dispatcher = PausedDispatcher ()
+        model.add_filter (level, dispatcher)
+        rows = list (model.line_offsets)
+
+        self.append_lines ([line_string (300000, 1, Data.debug_level_debug, "CAT2", "new"),
+                            line_string (50500, 2, Data.debug_level_debug, "CAT3", "late"),])
+        # Nothing changes until the filter process is done:
+        self.assertEquals (self.inserted, [])
+        self.assertEquals (list (model.line_offsets), rows)
+
+        self.append_lines ([line_string (20500, 2, Data.debug_level_log, "CAT0", "later"),])
+
+        dispatcher.run ()
+        self.assertRows ([category, level])
+        self.assertEquals (len (self.inserted), 3)
+
+    def test_lines_added_while_aborted (self):
+
+        model = self.model
+        dispatcher = PausedDispatcher ()
+        model.add_filter (CategoryFilter ("CAT1"), dispatcher)
+        rows = list (model.line_offsets)
+
+        self.append_lines ([line_string (50500, 2, Data.debug_level_debug, "CAT3", "late"),])
+        self.assertEquals (list (model.line_offsets), rows)
+
+        model.abort_process ()
+        self.assertRows ([])
+        self.assertEquals (len (self.inserted), 1)
+
+    def test_lines_added_in_range_while_filtering (self):
+
+        model = self.model
+        model.set_range (40, 120)
+        dispatcher = PausedDispatcher ()
+        category = CategoryFilter ("CAT1")
+        model.add_filter (category, dispatcher)
+        # The rows are still those of the super model:
+        self.assertTrue (model.line_offsets.l is self.log_model.line_offsets)
+        rows = list (model.line_offsets)
+        levels = list (model.line_levels)
+
+        self.append_lines ([line_string (50500, 2, Data.debug_level_debug, "CAT3", "late"),
+                            line_string (10500, 2, Data.debug_level_debug, "CAT1", "early"),])
+        self.assertEquals (list (model.line_offsets), rows)
+        self.assertEquals (list (model.line_levels), levels)
+        self.append_lines ([line_string (70500, 2, Data.debug_level_debug, "CAT1", "later"),])
+        self.assertEquals (list (model.line_offsets), rows)
+
+        dispatcher.run ()
+        self.assertEquals (model.super_range, (41, 123,))
+        self.assertRows ([category], 41, 123)
+
+class TestFilterRange (FilterStackTestCase):
+
+    def setUp (self):
+
+        FilterStackTestCase.setUp (self)
+
+        self.filters = [CategoryFilter ("CAT1"), DebugLevelFilter (Data.debug_level_info)]
+        for filter in self.filters:
+            self.model.add_filter (filter, Dispatcher ())
+
+    def test_narrow (self):
+
+        model = self.model
+        self.assertFalse (model.set_range (20, 150))
+        self.assertRows (self.filters, 20, 150)
+        self.assertFalse (model.set_range (50, 100))
+        self.assertRows (self.filters, 50, 100)
+
+    def test_widen (self):
+
+        model = self.model
+        model.set_range (50, 100)
+        rows = list (model.line_offsets)
+
+        self.assertRaises (ValueError, model.set_range, 20, 150)
+
+        dispatcher = PausedDispatcher ()
+        self.assertTrue (model.set_range (20, 150, dispatcher))
+        self.assertRaises (ValueError, model.set_range, 0, 200, dispatcher)
+        self.assertEquals (list (model.line_offsets), rows)
+        dispatcher.run ()
+        self.assertEquals (model.super_range, (20, 150,))
+        self.assertRows (self.filters, 20, 150)
+
+        # Not overlapping the current range:
+        self.assertTrue (model.set_range (160, 180, dispatcher))
+        dispatcher.run ()
+        self.assertRows (self.filters, 160, 180)
+
+        self.assertTrue (model.reset_range (dispatcher))
+        dispatcher.run ()
+        self.assertEquals (model.super_range, None)
+        self.assertRows (self.filters)
+
+    def test_abort (self):
+
+        model = self.model
+        model.set_range (50, 100)
+        rows = list (model.line_offsets)
+
+        model.set_range (20, 150, PausedDispatcher ())
+        model.abort_process ()
+        self.assertEquals (model.super_range, (50, 100,))
+        self.assertEquals (list (model.line_offsets), rows)
+        self.assertEquals (model.filters, self.filters)
+
+    def test_lines_added_while_widening (self):
+
+        model = self.model
+        model.set_range (50, 100)
+
+        dispatcher = PausedDispatcher ()
+        model.reset_range (dispatcher)
+        self.append_lines ([line_string (300000, 1, Data.debug_level_debug, "CAT2", "new"),
+                            line_string (50500, 2, Data.debug_level_debug, "CAT3", "late"),])
+        dispatcher.run ()
+        self.assertRows (self.filters)
+        self.assertEquals (len (self.inserted), 2)
+
+class TestFilterStackColumns (TestFilterStack):
+
+    # Filters run on the column arrays or posting lists.
+    parse_columns = True
+
+class TestFilterRangeColumns (TestFilterRange):
+
+    parse_columns = True
+
+if __name__ == "__main__":
+    test_main ()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the log filters."""
+
+import sys
+import os
+import os.path
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import TestCase, main as test_main
+
+from GstDebugViewer import Data
+from GstDebugViewer.GUI.filters import (CategoryFilter, DebugLevelFilter,
+                                        ExpressionFilter, FilenameFilter,
+                                        FilterExpressionError, ObjectFilter,)
+from GstDebugViewer.GUI.models import (ColumnArrays, FilteredLogModel, LazyLogModel,
+                                       LogModelBase, numpy,)
+
+from test_data import Dispatcher, LogFileTestCase
+
+def make_row (pid, level = Data.debug_level_debug):
+
+    if pid % 2 == 0:
+        category = "EVEN"
+    else:
+        category = "ODD"
+
+    line_str = ("0:00:00.000000000 %5i 0x0000000 DEBUG "
+                "%20s dummy.c:1:dummy: dummy" % (pid, category,))
+    row = Data.LogLine.parse_full (line_str)
+    row[LogModelBase.COL_LEVEL] = level
+
+    return row
+
+class TestExpressionFilter (TestCase):
+
+    def __rows (self, expression):
+
+        log_filter = ExpressionFilter (expression)
+        return [pid for pid in range (20)
+                if log_filter.filter_func (make_row (pid))]
+
+    def test_filter_func (self):
+
+        self.assertEquals (self.__rows ("category = EVEN and pid < 6"), [0, 2, 4])
+        self.assertEquals (self.__rows ("pid in (1, 3) or not level <= DEBUG"), [1, 3])
+        self.assertEquals (self.__rows ("level >= INFO"), [])
+        self.assertEquals (self.__rows ("category =~ 'DD' and not (pid > 3)"), [1, 3])
+
+    def test_posting_lists (self):
+
+        log_filter = ExpressionFilter ("category in (EVEN)")
+        self.assertEquals (log_filter.col_id, LogModelBase.COL_CATEGORY)
+        self.assertEquals (log_filter.value, "EVEN")
+        self.assertTrue (log_filter.show_only)
+
+        log_filter = ExpressionFilter ("category = EVEN and pid = 1")
+        self.assertEquals (log_filter.col_id, None)
+
+    def test_errors (self):
+
+        for expression in ("", "pid", "size = 1", "pid = x", "level = LOUD",
+                           "category < b", "(pid = 1", "pid = 1)", "object =~ '('",):
+            self.assertRaises (FilterExpressionError, ExpressionFilter, expression)
+
+    def test_level_none (self):
+
+        levels = [Data.debug_level_none, Data.debug_level_error,
+                  Data.debug_level_warning, Data.debug_level_info,
+                  Data.debug_level_trace,]
+        expected = {"level >= WARN" : [Data.debug_level_error, Data.debug_level_warning],
+                    "level > WARN" : [Data.debug_level_error],
+                    "level <= WARN" : [Data.debug_level_warning, Data.debug_level_info,
+                                       Data.debug_level_trace],
+                    "level < ERROR" : [Data.debug_level_warning, Data.debug_level_info,
+                                       Data.debug_level_trace],
+                    "level = NONE" : [Data.debug_level_none],
+                    "level != INFO" : [Data.debug_level_none, Data.debug_level_error,
+                                       Data.debug_level_warning, Data.debug_level_trace],}
+
+        for expression, expected_levels in expected.iteritems ():
+            log_filter = ExpressionFilter (expression)
+            matching = [level for level in levels
+                        if log_filter.filter_func (make_row (1, level))]
+            self.assertEquals (matching, expected_levels, expression)
+
+            if numpy is None:
+                continue
+            arrays = ColumnArrays (Data.DebugLevelArray (levels), None,
+                                   slice (0, len (levels)))
+            mask = log_filter.filter_mask (arrays)
+            self.assertEquals ([level for level, passed in zip (levels, mask) if passed],
+                               expected_levels, expression)
+
+class TestFilterMask (LogFileTestCase):
+
+    def setUp (self):
+
+        LogFileTestCase.setUp (self)
+
+        levels = (Data.debug_level_debug, Data.debug_level_info,
+                  Data.debug_level_warning,)
+        lines = ["%s %5d 0x1 %s %20s file%i.c:1:func:<obj%i> msg %i\n"
+                 % (Data.time_args (i * 1000), 12345, levels[i % 3].name.ljust (5),
+                    "CAT%i" % (i % 4,), i % 5, i % 7, i,)
+                 for i in range (100)]
+        log_file = self.load (self.write_log (lines), parse_columns = True)
+
+        self.log_model = LazyLogModel ()
+        self.log_model.set_log (log_file)
+        self.log_model.set_columns (log_file.columns)
+
+        self.filters = [DebugLevelFilter (Data.debug_level_info),
+                        CategoryFilter ("CAT2"),
+                        CategoryFilter ("NONEXISTENT"),
+                        ObjectFilter ("obj4"),
+                        ObjectFilter ("obj3", show_only = True),
+                        FilenameFilter ("file1.c"),]
+
+    def passing (self, filter, super_index):
+
+        log_model = self.log_model
+        passing = []
+        for i in super_index:
+            offset = log_model.line_offsets[i]
+            log_model.ensure_cached (offset)
+            row = log_model.line_cache[offset]
+            row[log_model.COL_LEVEL] = log_model.line_levels[i]
+            if filter.filter_func (row):
+                passing.append (i)
+
+        return passing
+
+    def test_masks (self):
+
+        if numpy is None:
+            return
+
+        from array import array
+
+        indices = (xrange (100), xrange (20, 60),
+                   array ("I", range (3, 100, 4)), array ("I"),)
+        for filter in self.filters:
+            for super_index in indices:
+                arrays = self.log_model.get_column_arrays (super_index)
+                mask = filter.filter_mask (arrays)
+                self.assertEquals ([i for i, passed in zip (super_index, mask) if passed],
+                                   self.passing (filter, super_index))
+
+    def test_index_mapping (self):
+
+        if numpy is None:
+            return
+
+        model = FilteredLogModel (self.log_model)
+        model.set_range (20, 60)
+        expected = range (20, 60)
+        for filter in self.filters:
+            expected = self.passing (filter, expected)
+            # The rows have to come from the mask:
+            filter.filter_func = None
+            model.add_filter (filter, Dispatcher ())
+            self.assertEquals (list (model.super_index), expected)
+        self.assertNotEquals (expected, [])
+
+if __name__ == "__main__":
+    test_main ()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the find bar search."""
+
+import sys
+import os
+import os.path
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import TestCase, main as test_main
+
+from GstDebugViewer import Data
+from GstDebugViewer.GUI.filters import DebugLevelFilter
+from GstDebugViewer.GUI.models import FilteredLogModel, LazyLogModel
+from GstDebugViewer.Plugins.FindBar import (FindBarFeature,
+                                            SearchOperation,
+                                            SearchQuery,
+                                            SearchSentinel,)
+
+from test_data import Dispatcher, LogFileTestCase, line_string
+from test_filter_stack import PausedDispatcher
+
+class TestSearchQuery (TestCase):
+
+    def refines (self, new_text, old_text, old = {}, **options):
+
+        old_options = dict (options)
+        old_options.update (old)
+        return SearchQuery (new_text, **options).refines (SearchQuery (old_text,
+                                                                       **old_options))
+
+    def test_extended (self):
+
+        self.assertTrue (self.refines ("abcd", "abc"))
+        self.assertTrue (self.refines ("xabc", "abc"))
+        self.assertTrue (self.refines ("abc", "abc"))
+        self.assertFalse (self.refines ("abc", "abcd"))
+        self.assertFalse (self.refines ("abd", "abc"))
+
+    def test_case_folding (self):
+
+        self.assertFalse (self.refines ("ABCD", "abc"))
+        self.assertTrue (self.refines ("ABCD", "abc", match_case = False))
+        self.assertTrue (self.refines ("abcd", "ABC", match_case = False))
+        # Case insensitive matches are not a subset of case sensitive ones,
+        # and vice versa:
+        self.assertFalse (self.refines ("abcd", "abc", match_case = False,
+                                        old = {"match_case" : True}))
+        self.assertFalse (self.refines ("abcd", "abc", match_case = True,
+                                        old = {"match_case" : False}))
+
+    def test_and_terms (self):
+
+        self.assertTrue (self.refines ("abc AND xyz", "abc"))
+        self.assertTrue (self.refines ("abc AND xyz", "abc AND xy"))
+        self.assertTrue (self.refines ("abc AND xyz", "xyz AND abc"))
+        self.assertFalse (self.refines ("abc", "abc AND xyz"))
+        self.assertFalse (self.refines ("abc AND xy", "abc AND xyz"))
+
+    def test_or_queries (self):
+
+        self.assertFalse (self.refines ("abcd OR xyz", "abc"))
+        self.assertFalse (self.refines ("abc OR abcd", "abc"))
+        # Narrowing down to one of the old clauses is fine:
+        self.assertTrue (self.refines ("abcd", "abc OR xyz"))
+        self.assertFalse (self.refines ("abcd", "xyz OR uvw"))
+
+    def test_regex (self):
+
+        self.assertFalse (self.refines ("abcd", "abc", regex = True))
+        self.assertFalse (self.refines ("abcd", "abc", regex = True,
+                                        old = {"regex" : False}))
+        self.assertFalse (self.refines ("abcd", "abc", regex = False,
+                                        old = {"regex" : True}))
+
+    def test_columns (self):
+
+        from GstDebugViewer.GUI.models import LogModelBase
+
+        self.assertFalse (self.refines ("abcd", "abc",
+                                        col_ids = (LogModelBase.COL_CATEGORY,),
+                                        old = {"col_ids" : (LogModelBase.COL_MESSAGE,)}))
+
+class TestSearchSentinel (LogFileTestCase):
+
+    def setUp (self):
+
+        LogFileTestCase.setUp (self)
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug, "CAT",
+                              ("msg %i" % (i,)) if i % 3 else "no number")
+                 for i in range (100)]
+        self.log_file = self.load (self.write_log (lines))
+        self.model = LazyLogModel ()
+        self.model.set_log (self.log_file)
+
+    def search (self, query):
+
+        sentinel = SearchSentinel (Dispatcher ())
+        matches = []
+        sentinel.handle_match_found = lambda model, tree_iter: \
+            matches.append (model.get_path (tree_iter)[0])
+        operation = SearchOperation (self.model, query,
+                                     fileobj = self.log_file.fileobj)
+        sentinel.run_for (operation)
+        return matches
+
+    def test_literal (self):
+
+        query = SearchQuery ("no number")
+        self.assertEquals (query.literals, ("no number",))
+        self.assertEquals (self.search (query), range (0, 100, 3))
+
+    def test_regex_without_literal (self):
+
+        query = SearchQuery (r"\d+", regex = True)
+        self.assertEquals (query.literals, None)
+        self.assertEquals (self.search (query),
+                           [i for i in range (100) if i % 3])
+
+    def test_rows_out_of_file_order (self):
+
+        # A line that sorts in front of the others, in a filtered model:
+        with open (self.log_file.path, "ab") as f:
+            f.write (line_string (5500, 2, Data.debug_level_info, "CAT", "no number"))
+        self.log_file = self.load (self.log_file.path)
+        self.model = FilteredLogModel (LazyLogModel (self.log_file))
+        self.model.add_filter (DebugLevelFilter (Data.debug_level_debug), Dispatcher ())
+
+        query = SearchQuery ("no number")
+        self.assertEquals (self.search (query), [0])
+        self.model.reset ()
+        # The new line is row 6:
+        self.assertEquals (self.search (query),
+                           [0, 3, 6] + [i + 1 for i in range (6, 100, 3)])
+
+class View (object):
+
+    def __init__ (self, model):
+
+        self.model = model
+        self.visible_range = ((0,), (9,),)
+
+    def get_model (self):
+
+        return self.model
+
+    def get_visible_range (self):
+
+        return self.visible_range
+
+    def scroll_to_cell (self, path, use_align = False, row_align = 0.):
+
+        self.visible_range = ((path[0] - 5,), (path[0] + 4,),)
+
+class Bar (object):
+
+    def __init__ (self):
+
+        self.status = None
+
+    def status_searching (self):
+
+        self.status = ("searching",)
+
+    def status_no_match_found (self):
+
+        self.status = ("no-match-found",)
+
+    def status_match_count (self, count):
+
+        self.status = ("match-count", count,)
+
+    def status_match_position (self, position, count):
+
+        self.status = ("match-position", position, count,)
+
+class TestFindBarMatches (LogFileTestCase):
+
+    def setUp (self):
+
+        LogFileTestCase.setUp (self)
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug, "CAT",
+                              "match" if i % 10 == 5 else "other")
+                 for i in range (100)]
+        self.filename = self.write_log (lines)
+        self.log_file = self.load (self.filename)
+        self.log_file.consumers.append (self)
+        self.model = LazyLogModel (self.log_file)
+
+        self.feature = FindBarFeature (None)
+        self.feature.log_view = View (self.model)
+        self.feature.bar = Bar ()
+        self.dispatcher = PausedDispatcher ()
+        self.feature.sentinel.dispatcher = self.dispatcher
+
+    def handle_lines_added (self, line_indices):
+
+        self.model.handle_lines_added (line_indices)
+
+    def search (self, text):
+
+        feature = self.feature
+        feature.start_search_operation (SearchQuery (text), scroll = False)
+        self.assertEquals (feature.bar.status, ("searching",))
+        self.dispatcher.run ()
+
+    def goto_next (self):
+
+        self.feature.handle_goto_next_search_result_action_activate (None)
+        return self.feature.current_match
+
+    def goto_previous (self):
+
+        self.feature.handle_goto_previous_search_result_action_activate (None)
+        return self.feature.current_match
+
+    def test_count (self):
+
+        feature = self.feature
+        self.search ("match")
+        self.assertEquals (list (feature.matches), range (5, 100, 10))
+        self.assertEquals (feature.bar.status, ("match-count", 10,))
+
+        self.search ("nothing")
+        self.assertEquals (list (feature.matches), [])
+        self.assertEquals (feature.bar.status, ("no-match-found",))
+
+    def test_navigate (self):
+
+        feature = self.feature
+        self.search ("match")
+
+        self.assertEquals (self.goto_next (), 5)
+        self.assertEquals (feature.bar.status, ("match-position", 1, 10,))
+        self.assertEquals (self.goto_next (), 15)
+        self.assertEquals (self.goto_previous (), 5)
+        self.assertEquals (feature.bar.status, ("match-position", 1, 10,))
+
+        feature.current_match = None
+        feature.log_view.visible_range = ((50,), (59,),)
+        self.assertEquals (self.goto_next (), 55)
+        feature.current_match = None
+        self.assertEquals (self.goto_previous (), 55)
+        self.assertEquals (self.goto_previous (), 45)
+        self.assertEquals (feature.bar.status, ("match-position", 5, 10,))
+
+    def test_navigate_while_counting (self):
+
+        feature = self.feature
+        feature.start_search_operation (SearchQuery ("match"), scroll = False)
+        feature.log_view.visible_range = ((50,), (59,),)
+
+        # Both wait for counting to get far enough:
+        self.goto_next ()
+        self.assertEquals (feature.bar.status, ("searching",))
+        self.assertEquals (feature.current_match, None)
+        self.dispatcher.run ()
+        self.assertEquals (feature.current_match, 55)
+
+        feature.start_search_operation (SearchQuery ("match"), scroll = False)
+        feature.log_view.visible_range = ((50,), (59,),)
+        self.goto_previous ()
+        self.assertEquals (feature.current_match, None)
+        self.dispatcher.run ()
+        self.assertEquals (feature.current_match, 55)
+        self.assertEquals (feature.bar.status, ("match-position", 6, 10,))
+
+    def test_refine_candidates (self):
+
+        feature = self.feature
+        self.search ("matc")
+        self.assertEquals (feature.get_refine_candidates (SearchQuery ("match")),
+                           feature.matches)
+        self.assertEquals (feature.get_refine_candidates (SearchQuery ("mat")), None)
+
+        # The candidates are those of the unfinished search:
+        feature.start_search_operation (SearchQuery ("mat"), scroll = False,
+                                        candidates = Data.array ("I", [5, 6, 15]))
+        self.assertEquals (list (feature.get_refine_candidates (SearchQuery ("match"))),
+                           [5, 6, 15])
+        self.dispatcher.run ()
+        self.assertEquals (list (feature.matches), [5, 15])
+
+        feature.start_search_operation (SearchQuery ("match"), scroll = False,
+                                        candidates = feature.matches)
+        self.dispatcher.run ()
+        self.assertEquals (list (feature.matches), [5, 15])
+
+    def test_lines_added (self):
+
+        feature = self.feature
+        self.search ("match")
+        self.assertEquals (self.goto_next (), 5)
+        self.assertEquals (self.goto_next (), 15)
+
+        with open (self.filename, "ab") as f:
+            f.write (line_string (200000, 1, Data.debug_level_debug, "CAT", "match"))
+            f.write (line_string (10500, 2, Data.debug_level_debug, "CAT", "match"))
+            f.write (line_string (12500, 2, Data.debug_level_debug, "CAT", "other"))
+        self.log_file.start_update ()
+
+        # Counted without searching again:
+        self.assertEquals (self.dispatcher.iterator, None)
+        self.assertEquals (list (feature.matches), [5, 11, 17] + range (27, 100, 10) + [102])
+        self.assertEquals (feature.bar.status, ("match-position", 3, 12,))
+        self.assertEquals (self.goto_previous (), 11)
+        self.assertEquals (self.goto_previous (), 5)
+        feature.current_match = 97
+        self.assertEquals (self.goto_next (), 102)
+
+if __name__ == "__main__":
+    test_main ()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; -*-
+#
+#  GStreamer Debug Viewer - View and analyze GStreamer debug log files
+#
+#  Copyright (C) 2007 René Stadler <mail@renestadler.de>
+#
+#  This program is free software; you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License as published by the Free
+#  Software Foundation; either version 3 of the License, or (at your option)
+#  any later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#  FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+#  more details.
+#
+#  You should have received a copy of the GNU General Public License along with
+#  this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GStreamer Debug Viewer test suite for the timeline partitioning."""
+
+import sys
+import os
+import os.path
+
+sys.path.insert (0, os.path.join (sys.path[0], os.pardir))
+
+from unittest import main as test_main
+
+from GstDebugViewer import Data
+from GstDebugViewer.GUI.models import LazyLogModel
+from GstDebugViewer.Plugins import Timeline
+
+from test_data import LogFileTestCase, line_string
+
+class TestLineFrequencySentinel (LogFileTestCase):
+
+    def setUp (self):
+
+        LogFileTestCase.setUp (self)
+
+        levels = (Data.debug_level_debug, Data.debug_level_info,
+                  Data.debug_level_warning,)
+        # Two bursts of lines, a second apart:
+        self.times = ([i * 1000 for i in range (50)] +
+                      [Data.SECOND + i * 1000 for i in range (50)])
+        lines = [line_string (ts, 1, levels[i % 3], "CAT", "msg %i" % (i,))
+                 for i, ts in enumerate (self.times)]
+        log_file = self.load (self.write_log (lines))
+
+        self.model = LazyLogModel ()
+        self.model.set_log (log_file)
+
+    def sentinels (self):
+
+        # With and without NumPy, which also means without the pyramid.
+        sentinel = Timeline.LineFrequencySentinel (self.model)
+        sentinel.run_for (10)
+        for x in sentinel.process ():
+            pass
+        yield sentinel
+
+        numpy = Timeline.numpy
+        Timeline.numpy = None
+        try:
+            sentinel = Timeline.LineFrequencySentinel (self.model)
+            sentinel.run_for (10)
+            for x in sentinel.process ():
+                pass
+            yield sentinel
+        finally:
+            Timeline.numpy = numpy
+
+    def assertPartitions (self, sentinel, ts_range, n):
+
+        sentinel.run_for (n, ts_range)
+        sentinel.partition ()
+
+        first_ts, last_ts = ts_range
+        step = float (last_ts + 1 - first_ts) / n
+        edges = [first_ts + int (step * i) for i in range (n)] + [last_ts + 1]
+        expected = [len ([ts for ts in self.times if start <= ts < stop])
+                    for start, stop in zip (edges, edges[1:])]
+        self.assertEquals (sentinel.data, expected)
+        self.assertEquals ([sum (counts) for counts in sentinel.level_data], expected)
+        self.assertEquals (len (sentinel.partitions), n + 1)
+
+        return expected
+
+    def test_whole_log (self):
+
+        for sentinel in self.sentinels ():
+            self.assertEquals (sentinel.log_ts_range, (0, Data.SECOND + 49000,))
+            self.assertEquals (sum (sentinel.data), 100)
+            self.assertEquals (sentinel.partitions[-1], 100)
+
+    def test_empty_range (self):
+
+        for sentinel in self.sentinels ():
+            expected = self.assertPartitions (sentinel, (100000, Data.SECOND // 2,), 10)
+            self.assertEquals (expected, [0] * 10)
+            self.assertEquals (sentinel.partitions, [50] * 11)
+            self.assertEquals (sentinel.indicators[Data.debug_level_warning], [])
+
+    def test_narrow_range (self):
+
+        for sentinel in self.sentinels ():
+            if sentinel.pyramid is not None:
+                # The spans are narrower than the finest buckets:
+                self.assertTrue (sentinel.pyramid.resolution > 1000)
+            expected = self.assertPartitions (sentinel, (10000, 12999,), 3)
+            self.assertEquals (expected, [1, 1, 1])
+            self.assertEquals ([counts[level] for counts, level
+                                in zip (sentinel.level_data, (Data.debug_level_info,
+                                                              Data.debug_level_warning,
+                                                              Data.debug_level_debug,))],
+                               [1, 1, 1])
+
+            self.assertPartitions (sentinel, (Data.SECOND + 500, Data.SECOND + 20500,), 7)
+
+class TestTimeRangeRows (LogFileTestCase):
+
+    def test_rows (self):
+
+        lines = [line_string (i * 1000, 1, Data.debug_level_debug, "CAT", "msg")
+                 for i in range (50)]
+        model = LazyLogModel ()
+        model.set_log (self.load (self.write_log (lines)))
+        for x in model.update_line_times ():
+            pass
+
+        self.assertEquals (model.get_time_range_rows (10000, 12000), (10, 13,))
+        self.assertEquals (model.get_time_range_rows (10001, 11999), (11, 12,))
+        self.assertEquals (model.get_time_range_rows (0, 49000), (0, 50,))
+        # No lines in between:
+        self.assertEquals (model.get_time_range_rows (10001, 10999), (11, 11,))
+        self.assertEquals (model.get_time_range_rows (60000, 70000), (50, 50,))
+
+if __name__ == "__main__":
+    test_main ()